@@ -0,0 +1,100 @@
+import os
+import threading
+
+from telemetry import get_logger
+
+# Lazily built, process-wide AWS handles. Nothing here touches boto3 until a
+# handle is first asked for, so code paths that never need DynamoDB (or only
+# need the low-level client) don't pay for building the resource layer.
+#
+# Every client comes from one boto3 Session with one botocore Config: a
+# connection pool sized for the threaded server and the broadcast fan-out,
+# TCP keep-alive, adaptive retries and bounded timeouts. Sessions are not
+# thread safe, so building happens under the lock; the clients themselves
+# are safe to share between threads.
+
+REGION_NAME = 'us-east-1'
+
+# Pooled connections per client - at least as many as threads that may use
+# one client at once (BROADCAST_MAX_WORKERS, the threaded dev server)
+AWS_MAX_POOL_CONNECTIONS = int(os.environ.get('AWS_MAX_POOL_CONNECTIONS', '32'))
+AWS_CONNECT_TIMEOUT_SECONDS = float(os.environ.get('AWS_CONNECT_TIMEOUT_SECONDS', '2'))
+AWS_READ_TIMEOUT_SECONDS = float(os.environ.get('AWS_READ_TIMEOUT_SECONDS', '10'))
+# Total attempts including the first; adaptive mode also rate-limits the
+# client when AWS starts throttling
+AWS_MAX_ATTEMPTS = int(os.environ.get('AWS_MAX_ATTEMPTS', '4'))
+
+logger = get_logger('aws_clients')
+
+# Re-entrant: building a Table first builds the resource it hangs off
+_lock = threading.RLock()
+_handles = {}
+
+
+def _cached(key, build):
+    handle = _handles.get(key)
+    if handle is None:
+        with _lock:
+            handle = _handles.get(key)
+            if handle is None:
+                handle = build()
+                _handles[key] = handle
+    return handle
+
+
+def get_session():
+    """The process-wide boto3 Session every client is built from"""
+    def build():
+        import boto3
+        return boto3.session.Session(region_name=REGION_NAME)
+    return _cached('session', build)
+
+
+def get_client_config():
+    """Shared botocore Config: pool size, keep-alive, adaptive retries, timeouts"""
+    def build():
+        from botocore.config import Config
+        return Config(
+            max_pool_connections=AWS_MAX_POOL_CONNECTIONS,
+            tcp_keepalive=True,
+            connect_timeout=AWS_CONNECT_TIMEOUT_SECONDS,
+            read_timeout=AWS_READ_TIMEOUT_SECONDS,
+            retries={'mode': 'adaptive', 'total_max_attempts': AWS_MAX_ATTEMPTS},
+        )
+    return _cached('config', build)
+
+
+def get_client(service_name, endpoint_url=None):
+    """Cached low-level client for a service (and endpoint, if given)"""
+    def build():
+        return get_session().client(service_name, endpoint_url=endpoint_url, config=get_client_config())
+    return _cached(('client', service_name, endpoint_url), build)
+
+
+def get_dynamodb_client():
+    """Low-level DynamoDB client - enough for single put/delete calls"""
+    return get_client('dynamodb')
+
+
+def get_dynamodb_resource():
+    def build():
+        return get_session().resource('dynamodb', config=get_client_config())
+    return _cached('dynamodb_resource', build)
+
+
+def get_table(name):
+    """Cached DynamoDB Table, or None if DynamoDB is unreachable"""
+    try:
+        return _cached(('table', name), lambda: get_dynamodb_resource().Table(name))
+    except Exception as e:
+        logger.error(f"DynamoDB connection failed: {e}")
+        return None
+
+
+def get_secretsmanager_client():
+    return get_client('secretsmanager')
+
+
+def get_management_client(ws_endpoint):
+    """apigatewaymanagementapi client for a wss:// WebSocket endpoint"""
+    return get_client('apigatewaymanagementapi', ws_endpoint.replace('wss://', 'https://'))
@@ -0,0 +1,2 @@
+# Benchmark scripts, run directly (python benchmarks/load.py ...). A package
+# so the tests can import the offline fakes as benchmarks.fakes.
@@ -0,0 +1,104 @@
+"""Cold-start import benchmark for the Lambda entry point.
+
+Runs each scenario in a fresh interpreter under `python -X importtime`,
+reports total import time and the slowest modules, and fails (exit 1) when
+a scenario goes over its budget or pulls in a module it must not load.
+
+    python benchmarks/cold_start.py
+    python benchmarks/cold_start.py --runs 5 --top 15
+    python benchmarks/cold_start.py --websocket-budget-ms 400 --http-budget-ms 2500
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# What each event type imports on a cold start
+SCENARIOS = {
+    'websocket': {
+        # boto3 is imported on the first DynamoDB call, so count it here
+        'code': "import app, websocket_handlers, boto3",
+        # The WebSocket fast path must never load these
+        'forbidden': ['flask', 'PIL', 'serverless_wsgi', 'routes.upload', 'google.cloud.vision', 'numpy'],
+    },
+    'http': {
+        'code': "import app, serverless_wsgi, boto3; app.get_app()",
+        'forbidden': [],
+    },
+}
+
+
+def parse_importtime(stderr):
+    """[(module, self_us, cumulative_us)] from -X importtime output"""
+    modules = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        fields = line[len('import time:'):].split('|')
+        if len(fields) != 3:
+            continue
+        modules.append((fields[2].strip(), int(fields[0]), int(fields[1])))
+    return modules
+
+
+def run_scenario(code):
+    env = dict(os.environ, PYTHONDONTWRITEBYTECODE='1')
+    start = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', code],
+        cwd=BACKEND_DIR, env=env, capture_output=True, text=True
+    )
+    wall_ms = (time.perf_counter() - start) * 1000
+    if result.returncode != 0:
+        raise RuntimeError(f"Scenario failed:\n{result.stderr[-2000:]}")
+    return wall_ms, parse_importtime(result.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=3, help="fresh interpreters per scenario")
+    parser.add_argument('--top', type=int, default=10, help="slowest modules to list")
+    parser.add_argument('--websocket-budget-ms', type=float, default=None)
+    parser.add_argument('--http-budget-ms', type=float, default=None)
+    args = parser.parse_args()
+    budgets = {'websocket': args.websocket_budget_ms, 'http': args.http_budget_ms}
+
+    failed = False
+    for name, scenario in SCENARIOS.items():
+        import_totals = []
+        walls = []
+        modules = []
+        for _ in range(args.runs):
+            wall_ms, modules = run_scenario(scenario['code'])
+            walls.append(wall_ms)
+            import_totals.append(sum(m[1] for m in modules) / 1000)
+
+        import_ms = statistics.median(import_totals)
+        print(f"\n== {name}: {scenario['code']}")
+        print(f"   imports: {import_ms:.1f} ms median ({len(modules)} modules), "
+              f"process wall: {statistics.median(walls):.1f} ms")
+        print("   slowest (cumulative):")
+        # Only top-level packages, so nested modules don't crowd the list
+        roots = [m for m in modules if '.' not in m[0]]
+        for module, _, cumulative in sorted(roots, key=lambda m: m[2], reverse=True)[:args.top]:
+            print(f"     {cumulative / 1000:8.1f} ms  {module}")
+
+        loaded = {m[0] for m in modules}
+        leaked = [f for f in scenario['forbidden'] if f in loaded]
+        if leaked:
+            failed = True
+            print(f"   FAIL: loads {', '.join(leaked)}")
+        budget = budgets.get(name)
+        if budget is not None and import_ms > budget:
+            failed = True
+            print(f"   FAIL: {import_ms:.1f} ms is over the {budget:.0f} ms budget")
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+"""Local stand-in for the Vision REST API (POST /v1/images:annotate).
+
+Answers every image with one canned AnnotateImageResponse after a fixed
+latency, and behaves like Vision under load: requests over the per-second
+image quota get a 429 RESOURCE_EXHAUSTED, and a configurable share fail
+with 503 UNAVAILABLE. Point a real ImageAnnotatorClient at it with
+transport='rest' to exercise the app's client path end to end:
+
+    python benchmarks/fake_vision_server.py --port 8089 --quota 20
+    (then) ImageAnnotatorClient(credentials=AnonymousCredentials(), transport='rest',
+                                client_options={'api_endpoint': 'http://127.0.0.1:8089'})
+
+benchmarks/vision_burst.py starts one in-process with start_server().
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+ANNOTATE_PATH = '/v1/images:annotate'
+
+
+class FakeVision:
+    """Quota, latency and failure behaviour shared by the handler threads"""
+
+    def __init__(self, response_json, latency_seconds=0.1, quota_per_second=None, failure_rate=0.0):
+        self.response_json = response_json
+        self.latency_seconds = latency_seconds
+        self.quota_per_second = quota_per_second
+        self.failure_rate = failure_rate
+        self._lock = threading.Lock()
+        self._window_start = 0.0
+        self._window_images = 0
+        self._in_flight = 0
+        self.counts = {'requests': 0, 'images': 0, 'throttled': 0, 'failed': 0, 'peak_in_flight': 0}
+
+    def admit(self, images):
+        """HTTP status for a request of `images` images: 200, 429 or 503"""
+        with self._lock:
+            self.counts['requests'] += 1
+            now = time.monotonic()
+            if now - self._window_start >= 1.0:
+                self._window_start, self._window_images = now, 0
+            if self.quota_per_second is not None and self._window_images + images > self.quota_per_second:
+                self.counts['throttled'] += 1
+                return 429
+            if random.random() < self.failure_rate:
+                self.counts['failed'] += 1
+                return 503
+            self._window_images += images
+            self.counts['images'] += images
+            self._in_flight += 1
+            self.counts['peak_in_flight'] = max(self.counts['peak_in_flight'], self._in_flight)
+            return 200
+
+    def done(self):
+        with self._lock:
+            self._in_flight -= 1
+
+
+def _error_body(code, status, message):
+    return json.dumps({'error': {'code': code, 'status': status, 'message': message}}).encode()
+
+
+def make_handler(fake):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+            if not self.path.split('?')[0].endswith(ANNOTATE_PATH):
+                return self._send(404, _error_body(404, 'NOT_FOUND', f"No route {self.path}"))
+            images = len(json.loads(body or b'{}').get('requests', []))
+            status = fake.admit(images)
+            if status == 429:
+                return self._send(429, _error_body(
+                    429, 'RESOURCE_EXHAUSTED', "Quota exceeded for quota metric 'Requests' (fake server)"
+                ))
+            if status == 503:
+                return self._send(503, _error_body(503, 'UNAVAILABLE', "The service is currently unavailable"))
+            try:
+                time.sleep(fake.latency_seconds)
+                payload = '{"responses":[' + ','.join([fake.response_json] * images) + ']}'
+                self._send(200, payload.encode())
+            finally:
+                fake.done()
+
+        def _send(self, code, body):
+            self.send_response(code)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def start_server(response, port=0, latency_seconds=0.1, quota_per_second=None, failure_rate=0.0):
+    """Serve in a daemon thread; returns (server, fake, 'http://127.0.0.1:port')
+
+    response is a vision.AnnotateImageResponse returned for every image.
+    """
+    from google.cloud import vision
+    response_json = vision.AnnotateImageResponse.to_json(response, indent=None)
+    fake = FakeVision(response_json, latency_seconds, quota_per_second, failure_rate)
+    server = ThreadingHTTPServer(('127.0.0.1', port), make_handler(fake))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, fake, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def rest_client(endpoint):
+    """ImageAnnotatorClient that talks REST to endpoint without credentials"""
+    from google.auth.credentials import AnonymousCredentials
+    from google.cloud import vision
+    return vision.ImageAnnotatorClient(
+        credentials=AnonymousCredentials(), transport='rest', client_options={'api_endpoint': endpoint}
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--port', type=int, default=8089)
+    parser.add_argument('--latency-ms', type=float, default=100)
+    parser.add_argument('--quota', type=float, help="images per second before answering 429")
+    parser.add_argument('--failure-rate', type=float, default=0.0, help="share of requests answered 503")
+    parser.add_argument('--words', type=int, default=3000, help="word boxes in the synthetic invoice")
+    parser.add_argument('--annotations', help="recorded AnnotateImageResponse JSON to serve")
+    args = parser.parse_args()
+
+    sys.path.insert(0, BACKEND_DIR)
+    import fakes
+    if args.annotations:
+        response = fakes.build_vision_response(recorded_path=args.annotations)
+    else:
+        response = fakes.build_vision_response(fakes.synthetic_annotations(args.words))
+    server, fake, endpoint = start_server(
+        response, args.port, args.latency_ms / 1000, args.quota, args.failure_rate
+    )
+    print(f"Fake Vision listening on {endpoint}{ANNOTATE_PATH} (Ctrl-C to stop)")
+    try:
+        while True:
+            time.sleep(5)
+            print(f"   {fake.counts}")
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
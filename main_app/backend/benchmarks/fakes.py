@@ -0,0 +1,375 @@
+"""Offline stand-ins for Vision, DynamoDB and the API Gateway management API.
+
+Used by benchmarks/load.py so the full /receive pipeline can run without
+network access or credentials. Each fake sleeps for a configurable latency
+per call so the numbers stay in the right ballpark. The fakes are installed
+into the app's own client caches (vision_client, aws_clients),
+not monkeypatched over the code under test.
+"""
+import os
+import re
+import threading
+import time
+from decimal import Decimal
+
+
+def _sleep(seconds):
+    if seconds > 0:
+        time.sleep(seconds)
+
+
+# --- Vision ---------------------------------------------------------------
+
+def synthetic_annotations(words=3000, page_width=2480, row_height=36):
+    """text_annotations for a dense invoice: header fields, then line items
+
+    Vendor name, invoice number and dates on the first rows, then a table of
+    Description / Qty / Price / Total rows with a few extra description
+    words, padded out until there are `words` word boxes in total.
+    """
+    boxes = []
+
+    def add(text, x, y, width):
+        boxes.append((text, x, y, width, row_height - 8))
+
+    for y, words_in_row in (
+        (20, (("Acme", 120), ("Supplies", 240), ("Ltd", 440))),
+        (60, (("Invoice", 120), ("No:", 300), ("INV-2024-0042", 420))),
+        (100, (("Invoice", 120), ("Date:", 300), ("03/05/2024", 420))),
+        (140, (("Due", 120), ("Date:", 220), ("04/04/2024", 420))),
+    ):
+        for text, x in words_in_row:
+            add(text, x, y, 22 * len(text))
+    y = 200
+    for text, x in (("Description", 120), ("Qty", 1400), ("Price", 1700), ("Total", 2100)):
+        add(text, x, y, 22 * len(text))
+    row = 0
+    while len(boxes) < words:
+        row += 1
+        y += row_height
+        quantity = row % 9 + 1
+        price = (row * 37) % 500 + 0.99
+        x = 120
+        for word in ("Item", f"#{row}", "widget", "assembly"):
+            add(word, x, y, 22 * len(word))
+            x += 22 * len(word) + 20
+        add(str(quantity), 1400, y, 30)
+        add(f"{price:.2f}", 1700, y, 120)
+        add(f"{quantity * price:.2f}", 2100, y, 140)
+    boxes = boxes[:words]
+    y += row_height * 2
+    for text, amount in (("Subtotal", "1234.56"), ("Tax", "98.76"), ("Total", "$1333.32")):
+        boxes.append((text, 1700, y, 22 * len(text), row_height - 8))
+        boxes.append((amount, 2100, y, 140, row_height - 8))
+        y += row_height
+
+    full_text = "\n".join(text for text, *_ in boxes)
+    annotations = [{
+        'description': full_text,
+        'bounding_poly': {'vertices': [
+            {'x': 0, 'y': 0}, {'x': page_width, 'y': 0},
+            {'x': page_width, 'y': y}, {'x': 0, 'y': y},
+        ]},
+    }]
+    for text, x, top, width, height in boxes:
+        annotations.append({
+            'description': text,
+            'bounding_poly': {'vertices': [
+                {'x': x, 'y': top}, {'x': x + width, 'y': top},
+                {'x': x + width, 'y': top + height}, {'x': x, 'y': top + height},
+            ]},
+        })
+    return annotations
+
+
+def synthetic_document(annotations):
+    """full_text_annotation for annotation dicts: one block per row of words
+
+    Word confidences are mostly high with every 17th word at 0.45, the way
+    DOCUMENT_TEXT_DETECTION reports a smudged word.
+    """
+    rows = {}
+    for i, annotation in enumerate(annotations[1:]):
+        top = annotation['bounding_poly']['vertices'][0]['y']
+        rows.setdefault(top, []).append((i, annotation))
+    blocks = []
+    for top, words in rows.items():
+        block_words = []
+        for i, annotation in words:
+            confidence = 0.45 if i % 17 == 16 else 0.9 + (i % 10) / 100
+            block_words.append({
+                'confidence': confidence,
+                'bounding_box': annotation['bounding_poly'],
+                'symbols': [{'text': char, 'confidence': confidence} for char in annotation['description']],
+            })
+        blocks.append({
+            'confidence': sum(word['confidence'] for word in block_words) / len(block_words),
+            'paragraphs': [{'words': block_words}],
+        })
+    return {
+        'text': annotations[0]['description'] if annotations else '',
+        'pages': [{'blocks': blocks}] if blocks else [],
+    }
+
+
+def build_vision_response(annotations=None, recorded_path=None):
+    """AnnotateImageResponse from a recorded JSON file or from annotation dicts
+
+    A recording is the output of vision.AnnotateImageResponse.to_json() for
+    a real response. Annotation dicts also get a synthetic_document
+    full_text_annotation, as DOCUMENT_TEXT_DETECTION returns.
+    """
+    from google.cloud import vision
+    if recorded_path:
+        with open(recorded_path) as f:
+            return vision.AnnotateImageResponse.from_json(f.read(), ignore_unknown_fields=True)
+    annotations = annotations or []
+    return vision.AnnotateImageResponse(
+        text_annotations=annotations, full_text_annotation=synthetic_document(annotations)
+    )
+
+
+class FakeVisionClient:
+    """ImageAnnotatorClient that answers every image with one canned response"""
+
+    def __init__(self, response, latency_seconds=0.0):
+        self.response = response
+        self.latency_seconds = latency_seconds
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.images = 0
+
+    def _count(self, images):
+        with self._lock:
+            self.calls += 1
+            self.images += images
+
+    def annotate_image(self, request, **kwargs):
+        self._count(1)
+        _sleep(self.latency_seconds)
+        return self.response
+
+    def batch_annotate_images(self, requests, **kwargs):
+        from google.cloud import vision
+        self._count(len(requests))
+        _sleep(self.latency_seconds)
+        return vision.BatchAnnotateImagesResponse(responses=[self.response] * len(requests))
+
+
+# --- DynamoDB -------------------------------------------------------------
+
+def _conditional_check_failed():
+    from botocore.exceptions import ClientError
+    return ClientError(
+        {'Error': {'Code': 'ConditionalCheckFailedException', 'Message': 'The conditional request failed'}},
+        'UpdateItem'
+    )
+
+
+class _BatchWriter:
+    def __init__(self, table):
+        self.table = table
+
+    def put_item(self, Item):
+        self.table.put_item(Item=Item)
+
+    def delete_item(self, Key):
+        self.table.delete_item(Key=Key)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+class FakeTable:
+    """In-memory boto3 Table covering the calls and expressions this app makes
+
+    Supported: put/get/delete_item, batch_writer, scan (with a projection),
+    update_item with ADD/SET clauses (SET a = :v or if_not_exists(a, :v)) and
+    a condition of AND-ed "a <op> :v" / "attribute_not_exists(a) OR a <op> :v"
+    terms, and query with "hash = :v AND range BETWEEN :a AND :b".
+    """
+
+    def __init__(self, name, key_names, latency_seconds=0.0):
+        self.name = name
+        self.key_names = key_names
+        self.latency_seconds = latency_seconds
+        self._items = {}
+        self._lock = threading.Lock()
+        self.calls = 0
+
+    def _key(self, item):
+        return tuple(item[name] for name in self.key_names)
+
+    def _call(self):
+        with self._lock:
+            self.calls += 1
+        _sleep(self.latency_seconds)
+
+    def put_item(self, Item, **kwargs):
+        self._call()
+        with self._lock:
+            self._items[self._key(Item)] = dict(Item)
+        return {}
+
+    def get_item(self, Key, **kwargs):
+        self._call()
+        with self._lock:
+            item = self._items.get(self._key(Key))
+        return {'Item': dict(item)} if item is not None else {}
+
+    def delete_item(self, Key, **kwargs):
+        self._call()
+        with self._lock:
+            self._items.pop(self._key(Key), None)
+        return {}
+
+    def batch_writer(self):
+        return _BatchWriter(self)
+
+    def scan(self, ProjectionExpression=None, **kwargs):
+        self._call()
+        with self._lock:
+            items = [dict(item) for item in self._items.values()]
+        if ProjectionExpression:
+            attributes = [a.strip() for a in ProjectionExpression.split(',')]
+            items = [{a: item[a] for a in attributes if a in item} for item in items]
+        return {'Items': items}
+
+    def update_item(self, Key, UpdateExpression, ExpressionAttributeValues=None,
+                    ExpressionAttributeNames=None, ConditionExpression=None, ReturnValues=None, **kwargs):
+        self._call()
+        values = ExpressionAttributeValues or {}
+        names = ExpressionAttributeNames or {}
+        with self._lock:
+            key = self._key(Key)
+            item = dict(self._items.get(key) or Key)
+            if ConditionExpression and not self._check(item, ConditionExpression, values, names):
+                raise _conditional_check_failed()
+            self._items[key] = item = self._apply(item, UpdateExpression, values, names)
+        return {'Attributes': dict(item)} if ReturnValues == 'ALL_NEW' else {}
+
+    @staticmethod
+    def _apply(item, expression, values, names):
+        item = dict(item)
+        for action, body in re.findall(r'(ADD|SET)\s+(.*?)(?=\s+(?:ADD|SET)\s+|$)', expression):
+            # Commas inside if_not_exists(...) don't separate clauses
+            for clause in re.split(r',(?![^(]*\))', body):
+                if action == 'ADD':
+                    attribute, ref = clause.split()
+                    attribute = names.get(attribute, attribute)
+                    item[attribute] = item.get(attribute, 0) + values[ref]
+                    continue
+                attribute, ref = (part.strip() for part in clause.split('=', 1))
+                attribute = names.get(attribute, attribute)
+                default = re.fullmatch(r'if_not_exists\((\S+),\s*(:\w+)\)', ref)
+                if default:
+                    item[attribute] = item.get(names.get(default.group(1), default.group(1)), values[default.group(2)])
+                else:
+                    item[attribute] = values[ref]
+        return item
+
+    @staticmethod
+    def _check(item, expression, values, names):
+        # Terms joined by AND, each "a <op> :v" or "attribute_not_exists(a) OR a <op> :v"
+        for term in re.split(r'\s+AND\s+(?![^(]*\))', expression.strip()):
+            term = term.strip()
+            if term.startswith('(') and term.endswith(')'):
+                term = term[1:-1]
+            match = re.fullmatch(r'(?:attribute_not_exists\((\S+)\) OR )?(\S+) (<|>|<=|>=|=) (:\w+)', term)
+            if not match:
+                raise NotImplementedError(f"FakeTable cannot evaluate condition: {expression}")
+            attribute = names.get(match.group(2), match.group(2))
+            if attribute not in item:
+                if match.group(1):
+                    continue
+                return False
+            stored, value = item[attribute], values[match.group(4)]
+            if not {
+                '<': stored < value, '>': stored > value, '<=': stored <= value,
+                '>=': stored >= value, '=': stored == value,
+            }[match.group(3)]:
+                return False
+        return True
+
+    def query(self, KeyConditionExpression, ExpressionAttributeValues, ExpressionAttributeNames=None, **kwargs):
+        self._call()
+        names = ExpressionAttributeNames or {}
+        match = re.fullmatch(
+            r'(\S+) = (:\w+) AND (\S+) BETWEEN (:\w+) AND (:\w+)', KeyConditionExpression.strip()
+        )
+        if not match:
+            raise NotImplementedError(f"FakeTable cannot evaluate key condition: {KeyConditionExpression}")
+        hash_name = names.get(match.group(1), match.group(1))
+        range_name = names.get(match.group(3), match.group(3))
+        hash_value = ExpressionAttributeValues[match.group(2)]
+        low = ExpressionAttributeValues[match.group(4)]
+        high = ExpressionAttributeValues[match.group(5)]
+        with self._lock:
+            items = [
+                dict(item) for item in self._items.values()
+                if item.get(hash_name) == hash_value and low <= item.get(range_name, low - 1) <= high
+            ]
+        items.sort(key=lambda item: item[range_name])
+        return {'Items': items}
+
+
+# --- API Gateway management API -------------------------------------------
+
+class FakeManagementClient:
+    """apigatewaymanagementapi client that accepts every post"""
+
+    def __init__(self, latency_seconds=0.0):
+        self.latency_seconds = latency_seconds
+        self._lock = threading.Lock()
+        self.posts = 0
+        self.bytes = 0
+
+    def post_to_connection(self, ConnectionId, Data):
+        _sleep(self.latency_seconds)
+        with self._lock:
+            self.posts += 1
+            self.bytes += len(Data)
+        return {}
+
+
+# --- Wiring ---------------------------------------------------------------
+
+WS_ENDPOINT = 'wss://benchmark.local/dev'
+
+
+def install(vision_response, vision_latency=0.0, dynamodb_latency=0.0, apigw_latency=0.0, connections=0):
+    """Put the fakes into the app's client caches; returns them by name
+
+    Call after the backend modules are importable (BACKEND_DIR on sys.path)
+    and before the first request.
+    """
+    import aws_clients
+    import vision_client
+    from dashboard import CONNECTIONS_TABLE_NAME, METRICS_TABLE_NAME
+
+    metrics_table = FakeTable(METRICS_TABLE_NAME, ['invoiceId', 'timestamp'], dynamodb_latency)
+    connections_table = FakeTable(CONNECTIONS_TABLE_NAME, ['connectionId'], dynamodb_latency)
+    for i in range(connections):
+        connections_table._items[(f"bench-{i}",)] = {'connectionId': f"bench-{i}", 'timestamp': Decimal(0)}
+    aws_clients._handles[('table', METRICS_TABLE_NAME)] = metrics_table
+    aws_clients._handles[('table', CONNECTIONS_TABLE_NAME)] = connections_table
+
+    management = FakeManagementClient(apigw_latency)
+    os.environ['WS_ENDPOINT'] = WS_ENDPOINT
+    endpoint_url = WS_ENDPOINT.replace('wss://', 'https://')
+    aws_clients._handles[('client', 'apigatewaymanagementapi', endpoint_url)] = management
+
+    vision = FakeVisionClient(vision_response, vision_latency)
+    with vision_client._lock:
+        vision_client._cache.update(credentials=None, client=vision, loaded_at=time.time())
+
+    return {
+        'vision': vision,
+        'metrics_table': metrics_table,
+        'connections_table': connections_table,
+        'management': management,
+    }
+
@@ -0,0 +1,81 @@
+"""Microbenchmark for header-field extraction (field_extraction.extract_fields).
+
+Times extraction on a synthetic dense invoice (or a recorded Vision
+response), checks the fields it finds, and fails (exit 1) when the median
+goes over the budget.
+
+    python benchmarks/fields.py
+    python benchmarks/fields.py --words 5000 --iterations 2000 --budget-ms 1
+    python benchmarks/fields.py --annotations recorded.json
+"""
+import argparse
+import os
+import sys
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PERCENTILES = (50, 95, 99)
+
+# What the synthetic invoice in fakes.synthetic_annotations should yield
+EXPECTED = {
+    'vendor': 'Acme Supplies Ltd',
+    'invoice_number': 'INV-2024-0042',
+    'invoice_date': '2024-03-05',
+    'due_date': '2024-04-04',
+    'subtotal': 1234.56,
+    'tax': 98.76,
+    'total': 1333.32,
+    'currency': 'USD',
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--words', type=int, default=5000, help="word boxes in the synthetic invoice")
+    parser.add_argument('--annotations', help="recorded AnnotateImageResponse JSON to use instead")
+    parser.add_argument('--iterations', type=int, default=1000)
+    parser.add_argument('--budget-ms', type=float, default=1.0, help="maximum median time per page")
+    args = parser.parse_args()
+
+    sys.path.insert(0, BACKEND_DIR)
+    import numpy as np
+    import fakes
+    from field_extraction import extract_fields
+    from segments import SegmentArray
+
+    if args.annotations:
+        response = fakes.build_vision_response(recorded_path=args.annotations)
+    else:
+        response = fakes.build_vision_response(fakes.synthetic_annotations(args.words))
+    segments = SegmentArray.from_annotations(response.text_annotations)
+
+    result = extract_fields(segments)
+    samples = []
+    for _ in range(args.iterations):
+        start = time.perf_counter()
+        extract_fields(segments)
+        samples.append((time.perf_counter() - start) * 1000)
+    stats = dict(zip(PERCENTILES, np.percentile(samples, PERCENTILES)))
+
+    print(f"\n== extract_fields on {len(segments)} words, {args.iterations} iterations")
+    print("   " + "".join(f"{f'p{p}':>10}" for p in PERCENTILES) + "   (ms)")
+    print("   " + "".join(f"{stats[p]:>10.3f}" for p in PERCENTILES))
+    for name, value in result.items():
+        print(f"   {name:<16}{value}")
+
+    failures = []
+    if stats[50] > args.budget_ms:
+        failures.append(f"median {stats[50]:.3f} ms is over the {args.budget_ms} ms budget")
+    if not args.annotations:
+        failures.extend(
+            f"{name}: expected {value!r}, got {result.get(name)!r}"
+            for name, value in EXPECTED.items() if result.get(name) != value
+        )
+    for failure in failures:
+        print(f"   FAIL {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,264 @@
+"""Offline load test for POST /receive.
+
+Drives the real Flask app with Vision, DynamoDB and the API Gateway
+management API replaced by in-memory fakes (benchmarks/fakes.py), so it
+runs without network or credentials. Reports throughput, per-stage latency
+percentiles (from the `timings` each response carries) and peak RSS.
+
+    python benchmarks/load.py
+    python benchmarks/load.py --requests 500 --concurrency 16 --words 5000
+    python benchmarks/load.py --mode http --render thumbnail --connections 50
+    python benchmarks/load.py --annotations recorded.json --json results.json
+
+--mode client uses Flask's test client; --mode http serves the app with
+werkzeug on a local port and posts real multipart requests over sockets.
+--annotations replays a response saved with
+vision.AnnotateImageResponse.to_json(response); without it a synthetic
+dense invoice of --words word boxes is used.
+"""
+import argparse
+import http.client
+import io
+import json
+import os
+import resource
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PERCENTILES = (50, 95, 99)
+
+
+def peak_rss_mb():
+    # ru_maxrss is in KB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def make_invoice_jpeg(width, height):
+    """A page-sized JPEG with some dark text-like bars, so it doesn't compress to nothing"""
+    from PIL import Image, ImageDraw
+    image = Image.new('RGB', (width, height), 'white')
+    draw = ImageDraw.Draw(image)
+    for y in range(150, height - 150, 40):
+        for x in range(100, width - 300, 260):
+            draw.rectangle([x, y, x + 180 + (x * y) % 60, y + 18], fill=(30, 30, 30))
+    output = io.BytesIO()
+    image.save(output, 'JPEG', quality=90)
+    return output.getvalue()
+
+
+def with_unique_marker(jpeg, marker):
+    """Insert a JPEG comment segment after SOI so every upload hashes differently"""
+    payload = marker.encode()
+    segment = b'\xff\xfe' + (len(payload) + 2).to_bytes(2, 'big') + payload
+    return jpeg[:2] + segment + jpeg[2:]
+
+
+def multipart_body(content, filename):
+    boundary = uuid.uuid4().hex
+    body = (
+        f'--{boundary}\r\n'
+        f'Content-Disposition: form-data; name="file"; filename="{filename}"\r\n'
+        f'Content-Type: image/jpeg\r\n\r\n'
+    ).encode() + content + f'\r\n--{boundary}--\r\n'.encode()
+    return body, f'multipart/form-data; boundary={boundary}'
+
+
+class ClientRunner:
+    """Posts through Flask's test client, one client per worker thread"""
+
+    def __init__(self, app):
+        self.app = app
+        self._local = threading.local()
+
+    def post(self, path, content):
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self._local.client = self.app.test_client()
+        response = client.post(path, data={'file': (io.BytesIO(content), 'invoice.jpg')})
+        return response.status_code, response.get_json()
+
+    def close(self):
+        pass
+
+
+class HTTPRunner:
+    """Serves the app with werkzeug on a local port and posts over real sockets"""
+
+    def __init__(self, app):
+        import logging
+        from werkzeug.serving import make_server
+        # One access-log line per request would drown the report
+        logging.getLogger('werkzeug').setLevel(logging.WARNING)
+        self.server = make_server('127.0.0.1', 0, app, threaded=True)
+        self.port = self.server.server_port
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def post(self, path, content):
+        body, content_type = multipart_body(content, 'invoice.jpg')
+        connection = http.client.HTTPConnection('127.0.0.1', self.port, timeout=120)
+        try:
+            connection.request('POST', path, body=body, headers={'Content-Type': content_type})
+            response = connection.getresponse()
+            return response.status, json.loads(response.read())
+        finally:
+            connection.close()
+
+    def close(self):
+        self.server.shutdown()
+
+
+def percentiles(samples):
+    import numpy as np
+    if not samples:
+        return [None] * len(PERCENTILES)
+    return [float(v) for v in np.percentile(samples, PERCENTILES)]
+
+
+def run(runner, base, indices, render, concurrency):
+    """Post one unique copy of base per index; returns (wall seconds, per-request results)"""
+    path = f'/receive?render={render}'
+
+    def one(index):
+        # Built per request so RSS reflects the app, not a queue of uploads
+        content = with_unique_marker(base, f"bench-{index}")
+        start = time.perf_counter()
+        try:
+            status, payload = runner.post(path, content)
+            error = None if status == 200 and payload.get('status') == 'success' else payload.get('error', status)
+        except Exception as e:
+            payload, error = {}, str(e)
+        return (time.perf_counter() - start) * 1000, payload, error
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(one, indices))
+    return time.perf_counter() - start, results
+
+
+def summarize(wall_seconds, results):
+    ok = [(latency, payload) for latency, payload, error in results if error is None]
+    errors = [error for _, _, error in results if error is not None]
+    stages = {
+        'client': [latency for latency, _ in ok],
+        'processing_time': [payload['processing_time_ms'] for _, payload in ok],
+    }
+    for _, payload in ok:
+        for stage, ms in (payload.get('timings') or {}).items():
+            stages.setdefault(stage, []).append(ms)
+    return {
+        'requests': len(results),
+        'succeeded': len(ok),
+        'errors': len(errors),
+        'first_error': errors[0] if errors else None,
+        'wall_seconds': round(wall_seconds, 3),
+        'throughput_rps': round(len(ok) / wall_seconds, 2) if wall_seconds else 0,
+        # Score each response reported (Vision confidence, see scoring.py)
+        'accuracy': dict(zip([f"p{p}" for p in PERCENTILES], percentiles(
+            [payload['accuracy_score'] for _, payload in ok]
+        ))),
+        'stages': {
+            stage: dict(zip([f"p{p}" for p in PERCENTILES], percentiles(samples)), count=len(samples))
+            for stage, samples in stages.items()
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=100)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--warmup', type=int, default=5, help="requests sent before measuring")
+    parser.add_argument('--mode', choices=['client', 'http'], default='client')
+    parser.add_argument('--render', choices=['none', 'thumbnail', 'full'], default='none')
+    parser.add_argument('--words', type=int, default=3000, help="word boxes in the synthetic invoice")
+    parser.add_argument('--annotations', help="recorded AnnotateImageResponse JSON to replay")
+    parser.add_argument('--image-size', default='2480x3508', help="WxH of the uploaded JPEG (A4 at 300 dpi)")
+    parser.add_argument('--vision-latency-ms', type=float, default=300)
+    parser.add_argument('--dynamodb-latency-ms', type=float, default=5)
+    parser.add_argument('--apigw-latency-ms', type=float, default=20)
+    parser.add_argument('--connections', type=int, default=5, help="open dashboard WebSocket connections")
+    parser.add_argument('--json', help="also write the results to this file")
+    args = parser.parse_args()
+
+    # Before the app is imported: keep logs to warnings and every upload a cache miss
+    os.environ.setdefault('LOG_LEVEL', 'WARNING')
+    os.environ.setdefault('OCR_CACHE_BACKEND', 'none')
+    os.environ.setdefault('JOB_WORKERS', '0')
+    sys.path.insert(0, BACKEND_DIR)
+    import fakes
+    import app
+    from dashboard import flush_metrics_broadcast
+
+    rss_baseline = peak_rss_mb()
+    if args.annotations:
+        vision_response = fakes.build_vision_response(recorded_path=args.annotations)
+    else:
+        vision_response = fakes.build_vision_response(fakes.synthetic_annotations(args.words))
+    installed = fakes.install(
+        vision_response,
+        vision_latency=args.vision_latency_ms / 1000,
+        dynamodb_latency=args.dynamodb_latency_ms / 1000,
+        apigw_latency=args.apigw_latency_ms / 1000,
+        connections=args.connections,
+    )
+
+    width, height = (int(v) for v in args.image_size.lower().split('x'))
+    base = make_invoice_jpeg(width, height)
+
+    flask_app = app.get_app()
+    runner = HTTPRunner(flask_app) if args.mode == 'http' else ClientRunner(flask_app)
+    try:
+        if args.warmup:
+            run(runner, base, range(args.warmup), args.render, args.concurrency)
+        wall_seconds, results = run(
+            runner, base, range(args.warmup, args.warmup + args.requests), args.render, args.concurrency
+        )
+    finally:
+        runner.close()
+        flush_metrics_broadcast()
+
+    summary = summarize(wall_seconds, results)
+    summary.update({
+        'mode': args.mode,
+        'concurrency': args.concurrency,
+        'render': args.render,
+        'words': len(vision_response.text_annotations) - 1,
+        'image_bytes': len(base),
+        'peak_rss_mb': round(peak_rss_mb(), 1),
+        'baseline_rss_mb': round(rss_baseline, 1),
+        'vision_calls': installed['vision'].calls,
+        'dynamodb_calls': installed['metrics_table'].calls + installed['connections_table'].calls,
+        'websocket_posts': installed['management'].posts,
+    })
+
+    print(f"\n== {summary['requests']} requests, concurrency {args.concurrency}, mode {args.mode}, "
+          f"render {args.render}, {summary['words']} words, {len(base) / 1024:.0f} KB image")
+    print(f"   throughput: {summary['throughput_rps']} req/s over {summary['wall_seconds']} s "
+          f"({summary['errors']} errors)")
+    if summary['first_error']:
+        print(f"   first error: {summary['first_error']}")
+    print(f"   {'stage':<16}{'p50':>10}{'p95':>10}{'p99':>10}   (ms)")
+    for stage, stats in summary['stages'].items():
+        if not stats['count']:
+            continue
+        print(f"   {stage:<16}" + "".join(f"{stats[f'p{p}']:>10.1f}" for p in PERCENTILES))
+    if summary['accuracy']['p50'] is not None:
+        print("   accuracy score: " + ", ".join(f"{name} {value:.0f}" for name, value in summary['accuracy'].items()))
+    print(f"   peak RSS: {summary['peak_rss_mb']} MB (baseline {summary['baseline_rss_mb']} MB)")
+    print(f"   calls: {summary['vision_calls']} Vision, {summary['dynamodb_calls']} DynamoDB, "
+          f"{summary['websocket_posts']} WebSocket posts")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(summary, f, indent=2)
+    sys.exit(1 if summary['errors'] else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""Burst test for the Vision rate limiter, retries and circuit breaker.
+
+Fires --requests text detections at once (detect_text, the same path
+/receive takes) against benchmarks/fake_vision_server.py through a real
+REST ImageAnnotatorClient, and reports how the burst was absorbed: how many
+calls the fake answered 429/503, retries, breaker rejections, and queue
+wait vs. call time percentiles.
+
+    python benchmarks/vision_burst.py
+    python benchmarks/vision_burst.py --requests 200 --quota 20 --rate 20
+    python benchmarks/vision_burst.py --rate 100          # limiter above quota: 429s and retries
+    python benchmarks/vision_burst.py --failure-rate 1    # Vision down: the breaker fails fast
+
+Exits 1 when a request fails although the fake never returns 503
+(--failure-rate 0), i.e. when the limiter and retries did not hold the
+burst within the quota and the deadline.
+"""
+import argparse
+import io
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PERCENTILES = (50, 95, 99)
+
+
+def make_jpeg(marker, size=(800, 1100)):
+    """Small distinct JPEG per request"""
+    from PIL import Image, ImageDraw
+    image = Image.new('L', size, 255)
+    ImageDraw.Draw(image).text((40, 40), f"Invoice {marker}", fill=0)
+    buffer = io.BytesIO()
+    image.save(buffer, 'JPEG', quality=80)
+    return buffer.getvalue()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=60)
+    parser.add_argument('--concurrency', type=int, default=60, help="detections started at once")
+    parser.add_argument('--quota', type=float, default=20, help="fake Vision images per second before 429")
+    parser.add_argument('--rate', type=float, help="VISION_RATE_PER_SECOND for the limiter (default: --quota)")
+    parser.add_argument('--burst', type=int, default=5, help="VISION_BURST for the limiter")
+    parser.add_argument('--in-flight', type=int, default=8, help="VISION_MAX_IN_FLIGHT")
+    parser.add_argument('--deadline', type=float, default=20, help="VISION_DEADLINE_SECONDS")
+    parser.add_argument('--latency-ms', type=float, default=100, help="fake Vision latency per call")
+    parser.add_argument('--failure-rate', type=float, default=0.0, help="share of calls the fake answers 503")
+    parser.add_argument('--words', type=int, default=300, help="word boxes in the canned response")
+    args = parser.parse_args()
+
+    # Before the app modules are imported: they read these at import time
+    os.environ.setdefault('LOG_LEVEL', 'ERROR')
+    os.environ.setdefault('OCR_CACHE_BACKEND', 'none')
+    os.environ.setdefault('JOB_WORKERS', '0')
+    os.environ['VISION_RATE_PER_SECOND'] = str(args.rate or args.quota)
+    os.environ['VISION_BURST'] = str(args.burst)
+    os.environ['VISION_MAX_IN_FLIGHT'] = str(args.in_flight)
+    os.environ['VISION_DEADLINE_SECONDS'] = str(args.deadline)
+    sys.path.insert(0, BACKEND_DIR)
+    import numpy as np
+    import fakes
+    import vision_client
+    from fake_vision_server import rest_client, start_server
+    from routes.upload import detect_text
+    from telemetry import start_timings
+    from vision_guard import get_vision_stats
+
+    response = fakes.build_vision_response(fakes.synthetic_annotations(args.words))
+    server, fake, endpoint = start_server(
+        response, latency_seconds=args.latency_ms / 1000, quota_per_second=args.quota,
+        failure_rate=args.failure_rate,
+    )
+    # Into the app's own client cache, as benchmarks/fakes.install does
+    with vision_client._lock:
+        vision_client._cache.update(credentials=None, client=rest_client(endpoint), loaded_at=time.time())
+
+    images = [make_jpeg(i) for i in range(args.requests)]
+
+    def one(content):
+        timings = start_timings()
+        start = time.perf_counter()
+        try:
+            detect_text(content, 'none')
+            error = None
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+        return (time.perf_counter() - start) * 1000, timings.as_dict(), error
+
+    wall_start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        results = list(pool.map(one, images))
+    wall_seconds = time.perf_counter() - wall_start
+    server.shutdown()
+
+    errors = [error for _, _, error in results if error]
+    stats = get_vision_stats()
+    print(f"\n== {args.requests} detections at once, fake quota {args.quota}/s, "
+          f"limiter {os.environ['VISION_RATE_PER_SECOND']}/s burst {args.burst}, "
+          f"{args.in_flight} in flight, failure rate {args.failure_rate}")
+    print(f"   wall {wall_seconds:.2f} s, {len(results) - len(errors)} ok, {len(errors)} failed")
+    if errors:
+        print(f"   first error: {errors[0][:200]}")
+    print(f"   fake Vision: {fake.counts}")
+    print("   guard: " + ", ".join(f"{name} {stats[name]}" for name in (
+        'calls', 'attempts', 'retries', 'throttled', 'failures', 'rejected', 'deadline_exceeded', 'breaker'
+    )))
+    print(f"   {'per request':<16}" + "".join(f"{f'p{p}':>10}" for p in PERCENTILES) + "   (ms)")
+    for stage in ('vision_queue', 'vision', 'vision_backoff'):
+        samples = [timings.get(stage, 0) for _, timings, _ in results]
+        print(f"   {stage:<16}" + "".join(f"{v:>10.1f}" for v in np.percentile(samples, PERCENTILES)))
+    samples = [elapsed for elapsed, _, _ in results]
+    print(f"   {'total':<16}" + "".join(f"{v:>10.1f}" for v in np.percentile(samples, PERCENTILES)))
+
+    sys.exit(1 if errors and not args.failure_rate else 0)
+
+
+if __name__ == "__main__":
+    main()
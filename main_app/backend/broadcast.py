@@ -0,0 +1,211 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from aws_clients import get_management_client
+from telemetry import fields, get_logger
+
+# WebSocket fan-out for dashboard updates. Posts go out in parallel on a
+# shared thread pool through one cached management client per endpoint,
+# the connection list is read with a paginated scan, and connections that
+# have gone away are deleted together in one batch_writer at the end.
+
+BROADCAST_MAX_WORKERS = int(os.environ.get('BROADCAST_MAX_WORKERS', '16'))
+# 1 = run broadcasts on a background thread instead of the request path.
+# Only use this on a long-running server - Lambda freezes the process as
+# soon as the response is returned, so background work may never finish.
+BROADCAST_ASYNC = os.environ.get('BROADCAST_ASYNC', '0') == '1'
+# Updates inside this window collapse into one metrics computation and one
+# fan-out; 0 turns coalescing off
+BROADCAST_COALESCE_MS = int(os.environ.get('BROADCAST_COALESCE_MS', '500'))
+
+logger = get_logger('broadcast')
+
+_lock = threading.Lock()
+_executor = None
+_background = None
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        with _lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=BROADCAST_MAX_WORKERS,
+                    thread_name_prefix='ws-broadcast'
+                )
+    return _executor
+
+
+def list_connection_ids(connections_table):
+    """Every connectionId in WSConnections, following scan pages"""
+    connection_ids = []
+    scan_kwargs = {'ProjectionExpression': 'connectionId'}
+    while True:
+        response = connections_table.scan(**scan_kwargs)
+        connection_ids.extend(item['connectionId'] for item in response.get('Items', []))
+        last_key = response.get('LastEvaluatedKey')
+        if not last_key:
+            return connection_ids
+        scan_kwargs['ExclusiveStartKey'] = last_key
+
+
+def _is_gone(error):
+    response = getattr(error, 'response', None) or {}
+    code = response.get('Error', {}).get('Code')
+    status = response.get('ResponseMetadata', {}).get('HTTPStatusCode')
+    return code == 'GoneException' or status == 410 or 'GoneException' in str(error)
+
+
+def delete_connections(connections_table, connection_ids):
+    """Remove connections in one batch_writer (25 deletes per request)"""
+    if not connection_ids:
+        return
+    try:
+        with connections_table.batch_writer() as batch:
+            for connection_id in connection_ids:
+                batch.delete_item(Key={'connectionId': connection_id})
+        logger.info("Removed stale connections", extra=fields(count=len(connection_ids)))
+    except Exception as e:
+        logger.error(f"Error removing stale connections: {e}")
+
+
+def post_to_connections(connections_table, connection_ids, message, ws_endpoint):
+    """Send message to the given connections in parallel; returns the success count"""
+    apigateway = get_management_client(ws_endpoint)
+
+    def post(connection_id):
+        try:
+            apigateway.post_to_connection(ConnectionId=connection_id, Data=message)
+            return connection_id, None
+        except Exception as e:
+            return connection_id, e
+
+    successful = 0
+    gone = []
+    for connection_id, error in _get_executor().map(post, connection_ids):
+        if error is None:
+            successful += 1
+            continue
+        logger.warning(f"Error sending to connection: {error}", extra=fields(connection_id=connection_id))
+        if _is_gone(error):
+            gone.append(connection_id)
+
+    delete_connections(connections_table, gone)
+    return successful
+
+
+def broadcast_message(connections_table, message):
+    """Post message to every open WebSocket connection"""
+    # Get WebSocket endpoint
+    ws_endpoint = os.environ.get('WS_ENDPOINT')
+    if not ws_endpoint:
+        logger.warning("WebSocket endpoint not configured")
+        return
+
+    connection_ids = list_connection_ids(connections_table)
+    if not connection_ids:
+        logger.debug("No active connections to broadcast to")
+        return
+
+    successful = post_to_connections(connections_table, connection_ids, message, ws_endpoint)
+    logger.info("Broadcast sent", extra=fields(successful=successful, connections=len(connection_ids)))
+
+
+def run_broadcast(task):
+    """Run task now, or on the background thread when BROADCAST_ASYNC is set"""
+    global _background
+    if not BROADCAST_ASYNC:
+        task()
+        return
+    if _background is None:
+        with _lock:
+            if _background is None:
+                # A single worker keeps broadcasts in order
+                _background = ThreadPoolExecutor(max_workers=1, thread_name_prefix='ws-broadcast-bg')
+    _background.submit(task)
+
+
+class Coalescer:
+    """Collapses bursts of notify() calls into at most one task run per window
+
+    The first notify after a quiet period runs the task straight away on a
+    timer thread; notifies inside the window fold into a single trailing
+    run, so the last update always goes out.
+
+    With deferred=True no timers are started and pending work only runs on
+    flush() - that is the Lambda mode, where the process is frozen once the
+    handler returns and the handler flushes after every invocation. A flush
+    inside the window of the last run keeps the work pending for a later
+    invocation to send. claim(window_seconds), when given, is asked before
+    each deferred run and returns False when another process already ran
+    within the window, so separate containers collapse a burst too.
+    """
+
+    def __init__(self, task, window_seconds, deferred=False, claim=None, clock=time.monotonic):
+        self.task = task
+        self.window_seconds = window_seconds
+        self.deferred = deferred
+        self.claim = claim
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._timer = None
+        self._pending = False
+        self._last_run = None
+        self.notified = 0
+        self.runs = 0
+
+    def _since_last_run(self):
+        return float('inf') if self._last_run is None else self.clock() - self._last_run
+
+    def notify(self):
+        with self._lock:
+            self.notified += 1
+            if self.deferred:
+                self._pending = True
+                return
+            if self._timer is not None:
+                # Already scheduled - this update rides along
+                return
+            delay = max(0.0, self.window_seconds - self._since_last_run())
+            self._timer = threading.Timer(delay, self._fire)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _fire(self):
+        with self._lock:
+            if self._timer is not threading.current_thread():
+                # flush() already ran this work
+                return
+            self._timer = None
+            self._last_run = self.clock()
+            self.runs += 1
+        self.task()
+
+    def flush(self):
+        """Run any pending work now, on the calling thread
+
+        In deferred mode work stays pending while the last run (here, or
+        in another process per claim) is inside the window.
+        """
+        with self._lock:
+            timer, self._timer = self._timer, None
+            if timer is not None:
+                timer.cancel()
+            if not (self._pending or timer is not None):
+                return
+            if self.deferred and self._since_last_run() < self.window_seconds:
+                self._pending = True
+                return
+            self._pending = False
+            self._last_run = self.clock()
+        if self.deferred and self.claim is not None and not self.claim(self.window_seconds):
+            # Another container just broadcast; send ours after the window
+            with self._lock:
+                self._pending = True
+            return
+        with self._lock:
+            self.runs += 1
+        self.task()
@@ -0,0 +1,191 @@
+import json
+import os
+import time
+
+from aws_clients import get_table
+from broadcast import BROADCAST_COALESCE_MS, Coalescer, broadcast_message, post_to_connections, run_broadcast
+from metrics_aggregate import DEFAULT_WINDOW, WINDOWS, read_aggregate, summarize_aggregate, summarize_window
+from telemetry import fields, get_logger
+
+# Dashboard metrics and the WebSocket broadcast that carries them. Kept
+# free of Flask/PIL imports so the WebSocket Lambda path stays light.
+
+CONNECTIONS_TABLE_NAME = 'WSConnections'
+METRICS_TABLE_NAME = 'InvoiceMetrics'
+# Reserved InvoiceMetrics row holding when any container last broadcast
+BROADCAST_CLAIM_KEY = {'invoiceId': '__broadcast__', 'timestamp': 0}
+
+logger = get_logger('dashboard')
+
+
+def get_connections_table():
+    return get_table(CONNECTIONS_TABLE_NAME)
+
+
+def get_metrics_table():
+    return get_table(METRICS_TABLE_NAME)
+
+
+def calculate_all_time_metrics(window=DEFAULT_WINDOW):
+    """Calculate all-time metrics from the running aggregate - SINGLE SOURCE OF TRUTH
+
+    Tail latency and throughput for the recent window come from the
+    time-bucket rows (one Query on the timestamp range key).
+    """
+    metrics_table = get_metrics_table()
+    if not metrics_table:
+        logger.warning("Metrics table not available")
+        return None
+    
+    try:
+        # One get_item on the aggregate row that store_metrics keeps up to date
+        aggregate = read_aggregate(metrics_table)
+        if aggregate is None:
+            logger.warning("No aggregate record found - run `python metrics_aggregate.py reconcile` to backfill")
+        summary = summarize_aggregate(aggregate)
+        
+        total_all_time = summary['total']
+        avg_latency = summary['avgLatency']
+        avg_accuracy = summary['avgAccuracy']
+        
+        recent = summarize_window(metrics_table, window)
+        
+        aggregated_metrics = {
+            'total': total_all_time,
+            'avgLatency': round(avg_latency),
+            'avgAccuracy': round(avg_accuracy, 1),
+            'minLatency': summary['minLatency'],
+            'maxLatency': summary['maxLatency'],
+            'p50Latency': summary['p50Latency'],
+            'p95Latency': summary['p95Latency'],
+            'p99Latency': summary['p99Latency'],
+            'throughput': recent['invoicesPerMinute'],  # invoices per minute over the window
+            'window': recent,
+            'timestamp': int(time.time() * 1000)
+        }
+        
+        logger.debug("Calculated metrics", extra=fields(**aggregated_metrics))
+        return aggregated_metrics
+        
+    except Exception as e:
+        logger.exception(f"Error calculating metrics: {e}")
+        return None
+
+
+# Latest computed metrics per window, so get-metrics can answer without recomputing
+_metrics_snapshots = {}
+
+
+def get_metrics_snapshot(window=DEFAULT_WINDOW):
+    """Cached metrics if they are younger than the coalescing window, else fresh ones"""
+    max_age = BROADCAST_COALESCE_MS / 1000
+    snapshot = _metrics_snapshots.get(window)
+    if snapshot is not None and time.time() - snapshot['at'] < max_age:
+        return snapshot['metrics']
+    metrics = calculate_all_time_metrics(window)
+    if metrics:
+        _metrics_snapshots[window] = {'metrics': metrics, 'at': time.time()}
+    return metrics
+
+
+def _broadcast_metrics_now():
+    try:
+        logger.debug("Starting broadcast_metrics_to_all")
+        # Get current metrics
+        metrics = calculate_all_time_metrics()
+        if not metrics:
+            logger.warning("No metrics to broadcast - calculate_all_time_metrics returned None")
+            return
+        _metrics_snapshots[DEFAULT_WINDOW] = {'metrics': metrics, 'at': time.time()}
+        
+        logger.debug("Broadcasting metrics", extra=fields(**metrics))
+        
+        message = json.dumps({
+            'type': 'metrics-update',
+            'data': metrics
+        })
+        # Parallel posts, paginated connection list, batched stale cleanup
+        broadcast_message(get_connections_table(), message)
+        
+    except Exception as e:
+        logger.error(f"Error broadcasting metrics: {e}")
+
+
+def _claim_broadcast(window_seconds):
+    """True if no container has broadcast within the window; records this one
+
+    One conditional write on a reserved InvoiceMetrics row, so concurrent
+    Lambda containers share the coalescing window. Fails open.
+    """
+    metrics_table = get_metrics_table()
+    if not metrics_table:
+        return True
+    from botocore.exceptions import ClientError
+    now_ms = int(time.time() * 1000)
+    try:
+        metrics_table.update_item(
+            Key=BROADCAST_CLAIM_KEY,
+            UpdateExpression="SET lastBroadcastAt = :now",
+            ConditionExpression="attribute_not_exists(lastBroadcastAt) OR lastBroadcastAt < :cutoff",
+            ExpressionAttributeValues={':now': now_ms, ':cutoff': now_ms - int(window_seconds * 1000)}
+        )
+    except ClientError as e:
+        if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+            return False
+        logger.warning(f"Could not claim the broadcast window: {e}")
+    return True
+
+
+# Collapses bursts of uploads into one computation + fan-out per window. On
+# Lambda nothing may run after the handler returns, so work is deferred and
+# flushed at the end of each invocation instead of on a timer; a flush that
+# falls inside the window (in this container, or in any other one per the
+# claim row) leaves the update for a later invocation.
+_metrics_coalescer = None
+if BROADCAST_COALESCE_MS > 0:
+    _metrics_coalescer = Coalescer(
+        _broadcast_metrics_now,
+        BROADCAST_COALESCE_MS / 1000,
+        deferred=bool(os.environ.get('AWS_LAMBDA_FUNCTION_NAME')),
+        claim=_claim_broadcast
+    )
+
+
+def broadcast_metrics_to_all():
+    """Broadcast current metrics to all connected WebSocket clients"""
+    if not get_connections_table():
+        logger.warning("Tables not available for broadcasting")
+        return
+    
+    if _metrics_coalescer:
+        _metrics_coalescer.notify()
+    else:
+        # Inline by default; BROADCAST_ASYNC=1 moves it off the request path
+        run_broadcast(_broadcast_metrics_now)
+
+
+def flush_metrics_broadcast():
+    """Send any coalesced broadcast that is still waiting"""
+    if _metrics_coalescer:
+        _metrics_coalescer.flush()
+
+
+def send_metrics_to_connection(connection_id, window=None):
+    """Reply to one dashboard with the cached metrics snapshot for a window"""
+    ws_endpoint = os.environ.get('WS_ENDPOINT')
+    connections_table = get_connections_table()
+    if not ws_endpoint or not connections_table:
+        logger.warning("WebSocket endpoint or connections table not configured")
+        return
+    if window not in WINDOWS:
+        if window is not None:
+            logger.warning("Unknown metrics window, using default", extra=fields(window=window))
+        window = DEFAULT_WINDOW
+    metrics = get_metrics_snapshot(window)
+    if not metrics:
+        return
+    message = json.dumps({
+        'type': 'metrics-update',
+        'data': metrics
+    })
+    post_to_connections(connections_table, [connection_id], message, ws_endpoint)
@@ -0,0 +1,391 @@
+import datetime
+import re
+
+import numpy as np
+
+from segments import SegmentArray
+
+# Header-field extraction (vendor, invoice number, dates, subtotal, tax,
+# total) over OCR word boxes.
+#
+# Every label is found in one pass over the page: the label keywords are
+# merged into a trie and compiled into a single regex, so the scan runs in
+# C and stops at the longest keyword at each position (Aho-Corasick style -
+# "subtotal" wins over "total", "tax id" over "tax"). A label is then
+# resolved through the box geometry: the value is read from the words to
+# its right on the same row, or for ids and dates from the row just below
+# it. Only the handful of words near a label are parsed, never the page.
+# The vendor is the first line of text at the top of the page that is not
+# a label or a document title.
+
+# field -> label keywords, most specific first (earlier labels win)
+FIELD_LABELS = {
+    'invoice_number': (
+        'invoice number', 'invoice no', 'invoice num', 'invoice #', 'invoice id',
+        'inv no', 'inv #', 'bill no', 'bill number',
+    ),
+    'invoice_date': ('invoice date', 'date of issue', 'issue date', 'bill date', 'date'),
+    'due_date': ('due date', 'payment due', 'due by', 'pay by'),
+    'subtotal': ('subtotal', 'sub total', 'sub-total', 'net total', 'net amount'),
+    'tax': ('sales tax', 'tax amount', 'total tax', 'tax', 'vat', 'gst', 'hst'),
+    'total': (
+        'grand total', 'amount due', 'balance due', 'total due', 'invoice total',
+        'total amount', 'amount payable', 'total',
+    ),
+}
+
+# Recognised but never a value label - matching them keeps the shorter
+# keyword inside from firing ("tax id" is not the tax amount)
+IGNORED_LABELS = (
+    'tax id', 'tax no', 'tax number', 'tax rate', 'vat no', 'vat number', 'vat reg',
+    'gst no', 'gst number', 'gstin', 'date of birth',
+)
+
+# Page titles that sit above the vendor name on many layouts
+TITLE_LINES = {
+    'invoice', 'tax invoice', 'proforma invoice', 'commercial invoice', 'bill',
+    'receipt', 'sales receipt', 'statement', 'quote', 'quotation', 'estimate',
+}
+# Lines from the top of the page tried for the vendor name
+VENDOR_LINES = 3
+
+AMOUNT_FIELDS = ('subtotal', 'tax', 'total')
+DATE_FIELDS = ('invoice_date', 'due_date')
+
+# Totals sit at the bottom of the page; ids and dates near the top
+_BOTTOM_FIRST = set(AMOUNT_FIELDS)
+
+# Words read after a label when looking for its value
+VALUE_WORDS = 6
+# Same row: centres within this many label heights
+ROW_TOLERANCE = 0.5
+
+CURRENCY_SYMBOLS = {'$': 'USD', '€': 'EUR', '£': 'GBP', '¥': 'JPY', '₹': 'INR'}
+CURRENCY_CODES = ('USD', 'EUR', 'GBP', 'JPY', 'INR', 'CAD', 'AUD', 'CHF', 'CNY', 'SGD', 'NZD')
+
+MONTHS = {
+    'jan': 1, 'feb': 2, 'mar': 3, 'apr': 4, 'may': 5, 'jun': 6,
+    'jul': 7, 'aug': 8, 'sep': 9, 'sept': 9, 'oct': 10, 'nov': 11, 'dec': 12,
+}
+
+_month = r'(?P<month_name>jan|feb|mar|apr|may|jun|jul|aug|sept?|oct|nov|dec)[a-z]*\.?'
+_date_patterns = (
+    re.compile(r'(?<!\d)(?P<year>\d{4})[-/.](?P<month>\d{1,2})[-/.](?P<day>\d{1,2})(?!\d)'),
+    re.compile(r'(?<!\d)(?P<first>\d{1,2})[-/.](?P<second>\d{1,2})[-/.](?P<year>\d{4}|\d{2})(?!\d)'),
+    re.compile(r'(?<!\d)(?P<day>\d{1,2})(?:st|nd|rd|th)?[\s-]+' + _month + r'[\s,-]+(?P<year>\d{4})', re.I),
+    re.compile(_month + r'\s+(?P<day>\d{1,2})(?:st|nd|rd|th)?,?\s+(?P<year>\d{4})', re.I),
+)
+# Amounts use either separator convention: "1,234.56" or "1.234,56". A
+# decimal part has one or two digits, so "1,234" is grouped; a lone
+# ".ddd" group ("1.234") is either 1234 or 1.234 and is not read at all.
+_amount_pattern = re.compile(
+    r'(?P<currency>[$€£¥₹]|\b(?:' + '|'.join(CURRENCY_CODES) + r')\b)?\s*'
+    r'(?<![\d.,])(?P<number>-?(?:'
+    r'\d{1,3}(?:,\d{3})+(?:\.\d{1,2})?'     # 1,234 / 1,234.56
+    r'|\d{1,3}(?:\.\d{3})+,\d{1,2}'         # 1.234,56
+    r'|\d{1,3}(?:\.\d{3}){2,}'              # 1.234.567
+    r'|\d+[.,]\d{1,2}'                      # 1234.56 / 1234,56
+    r'|\d+'
+    r'))(?![\d.,]*\s*%)(?![\d,])(?!\.\d)',
+    re.I
+)
+_identifier_pattern = re.compile(r'[A-Za-z0-9][A-Za-z0-9\-/.]*')
+
+
+def word_text(words):
+    """Lowercased words one per line, each line starting with a newline
+
+    The form KeywordMatcher scans: every keyword match starts right after
+    a newline, which the regex engine can jump between very quickly.
+    """
+    return ('\n' + '\n'.join(words)).lower()
+
+
+class KeywordMatcher:
+    """Finds many keywords in one left-to-right pass over word_text() output
+
+    The keywords are merged into a trie and compiled to one regex that
+    tries longer keywords first at every branch, so at each position the
+    longest keyword wins and matches never overlap. Matches start at a
+    word and, unless the keyword ends in punctuation, end at one too; a
+    space in a keyword spans the break between two words.
+    """
+
+    def __init__(self, keywords):
+        self.keywords = tuple(dict.fromkeys(keyword.lower() for keyword in keywords))
+        trie = {}
+        for keyword in self.keywords:
+            node = trie
+            for char in keyword:
+                node = node.setdefault(char, {})
+            node[''] = True
+        # A literal newline up front lets the engine skip straight from one
+        # word to the next instead of trying the trie at every character
+        self.pattern = re.compile('\n' + self._compile(trie, ''))
+        # Keywords found inside each keyword ("subtotal" also means "total")
+        self.implies = {
+            keyword: {other for other in self.keywords if other in keyword}
+            for keyword in self.keywords
+        }
+
+    def _compile(self, node, char):
+        branches = [
+            (r'\s' if c == ' ' else re.escape(c)) + self._compile(child, c)
+            for c, child in node.items() if c
+        ]
+        if '' not in node:
+            return branches[0] if len(branches) == 1 else '(?:' + '|'.join(branches) + ')'
+        # A keyword ends here: try the longer ones first, else stop - at a
+        # word boundary if the keyword ends in a letter or digit
+        stop = r'(?![a-z0-9])' if char.isalnum() else ''
+        if not branches:
+            return stop
+        return '(?:' + '|'.join(branches + [stop]) + ')'
+
+    def finditer(self, text):
+        """(start, end, keyword) for each match in word_text() output"""
+        for match in self.pattern.finditer(text):
+            yield match.start() + 1, match.end(), ' '.join(match.group().split())
+
+    def found(self, text):
+        """Every keyword present in the text, including ones inside longer matches"""
+        present = set()
+        for _, _, keyword in self.finditer(text):
+            present |= self.implies[keyword]
+        return present
+
+
+_label_field = {}
+for _field, _labels in FIELD_LABELS.items():
+    for _priority, _label in enumerate(_labels):
+        _label_field[_label] = (_field, _priority)
+for _label in IGNORED_LABELS:
+    _label_field[_label] = (None, 0)
+label_matcher = KeywordMatcher(_label_field)
+
+
+def _amount_value(number):
+    """Float value of a number _amount_pattern matched, in either convention"""
+    decimal = max(number.rfind('.'), number.rfind(','))
+    if decimal >= 0 and len(number) - decimal - 1 > 2:
+        # The last separator groups thousands - there is no decimal part
+        decimal = -1
+    whole = number[:decimal] if decimal >= 0 else number
+    whole = whole.replace(',', '').replace('.', '')
+    return float(whole + '.' + number[decimal + 1:] if decimal >= 0 else whole)
+
+
+def parse_amount(text):
+    """(value, currency) of the last amount in text - the rightmost column
+
+    Percentages are skipped, so "Tax (8%) $8.00" gives 8.0 with USD, and
+    "EUR 1.234,56" gives 1234.56 with EUR.
+    """
+    value = currency = None
+    for match in _amount_pattern.finditer(text):
+        try:
+            value = _amount_value(match.group('number'))
+        except ValueError:
+            continue
+        symbol = match.group('currency')
+        currency = CURRENCY_SYMBOLS.get(symbol, symbol.upper()) if symbol else None
+    if value is None:
+        return None
+    return value, currency
+
+
+def parse_date(text):
+    """First date in text as an ISO string, or None
+
+    Numeric day/month order is ambiguous; month first is assumed unless the
+    first number can only be a day.
+    """
+    for pattern in _date_patterns:
+        match = pattern.search(text)
+        if not match:
+            continue
+        parts = match.groupdict()
+        year = int(parts['year'])
+        if year < 100:
+            year += 2000
+        if parts.get('month_name'):
+            month, day = MONTHS[parts['month_name'].lower()], int(parts['day'])
+        elif parts.get('first'):
+            month, day = int(parts['first']), int(parts['second'])
+            if month > 12:
+                month, day = day, month
+        else:
+            month, day = int(parts['month']), int(parts['day'])
+        try:
+            return datetime.date(year, month, day).isoformat()
+        except ValueError:
+            continue
+    return None
+
+
+def parse_identifier(text):
+    """First token containing a digit, stripped of label punctuation"""
+    for match in _identifier_pattern.finditer(text):
+        token = match.group().strip('.-/')
+        if any(char.isdigit() for char in token):
+            return token
+    return None
+
+
+def _parse(field, text):
+    if field in AMOUNT_FIELDS:
+        return parse_amount(text)
+    if field in DATE_FIELDS:
+        value = parse_date(text)
+    else:
+        value = parse_identifier(text)
+    return None if value is None else (value, None)
+
+
+class _Layout:
+    """Word geometry as flat arrays, computed once per page"""
+
+    def __init__(self, segments):
+        left, right, top, bottom = segments.bounds()
+        self.left = left
+        self.right = right
+        self.top = top
+        self.center = (top + bottom) / 2
+        self.height = np.maximum(bottom - top, 1)
+
+    def row_after(self, index):
+        """Indices of the words right of word index on its row, nearest first"""
+        tolerance = ROW_TOLERANCE * self.height[index]
+        # One pass over the page finds the row; the rest only looks at its
+        # few words, and a label alone on its row stops here
+        row = np.flatnonzero(np.abs(self.center - self.center[index]) <= tolerance)
+        row = row[(self.left[row] >= self.right[index] - tolerance) & (row != index)]
+        return self._nearest(row, self.left)
+
+    def row_below(self, index):
+        """Indices of the words on the row just below word index, from its left edge"""
+        height = self.height[index]
+        below = (self.top > self.center[index] + ROW_TOLERANCE * height) & (self.right >= self.left[index] - height)
+        if not below.any():
+            return []
+        first = int(np.flatnonzero(below)[np.argmin(self.top[below])])
+        mask = below & (np.abs(self.center - self.center[first]) <= ROW_TOLERANCE * self.height[first])
+        return self._nearest(np.flatnonzero(mask), self.left)
+
+    def top_rows(self, count):
+        """The first count rows of words from the top of the page, each left to right"""
+        # Only the topmost words matter - no need to sort the whole page
+        window = min(len(self.center), 16 * count)
+        candidates = np.argpartition(self.center, window - 1)[:window]
+        candidates = candidates[np.argsort(self.center[candidates], kind='stable')].tolist()
+        rows = []
+        current = []
+        for i in candidates:
+            if current and self.center[i] - self.center[current[0]] > ROW_TOLERANCE * self.height[current[0]]:
+                rows.append(current)
+                if len(rows) == count:
+                    break
+                current = []
+            current.append(i)
+        else:
+            if current:
+                rows.append(current)
+        left = self.left
+        return [sorted(row, key=lambda i: left[i]) for row in rows]
+
+    @staticmethod
+    def _nearest(candidates, key):
+        if len(candidates) > VALUE_WORDS:
+            candidates = candidates[np.argpartition(key[candidates], VALUE_WORDS)[:VALUE_WORDS]]
+        return candidates[np.argsort(key[candidates], kind='stable')].tolist()
+
+
+def extract_fields(segments):
+    """Typed header fields of an invoice from its word boxes
+
+    Accepts a SegmentArray (or text_segments JSON). Returns vendor,
+    invoice_number, invoice_date and due_date (ISO), subtotal, tax and total
+    (floats) and currency; fields that were not found are None.
+    """
+    result = {'vendor': None}
+    result.update((field, None) for field in FIELD_LABELS)
+    result['currency'] = None
+    if not isinstance(segments, SegmentArray):
+        segments = SegmentArray.from_json(segments)
+    if not len(segments):
+        return result
+
+    texts = segments.texts
+    # One word per line, so a label's word index is a count of newlines
+    joined = word_text(texts)
+    hits = {}
+    label_words = set()
+    # Word index of each label's last word, counted from one label to the next
+    index = -1
+    position = 0
+    for start, end, keyword in label_matcher.finditer(joined):
+        index += joined.count('\n', position, end)
+        position = end
+        label_words.update(range(index - keyword.count(' '), index + 1))
+        field, priority = _label_field[keyword]
+        if field is not None:
+            hits.setdefault(field, []).append((priority, start, end, index))
+
+    # Row clustering assumes horizontal baselines
+    layout = _Layout(segments.deskewed())
+
+    currencies = {}
+    for field, field_hits in hits.items():
+        if field in _BOTTOM_FIRST:
+            field_hits.sort(key=lambda hit: (hit[0], -hit[1]))
+        else:
+            field_hits.sort()
+        for _, _, end, index in field_hits:
+            # Text glued onto the label's last word ("#INV-1") is part of the value
+            glued = texts[index][end - joined.rfind('\n', 0, end) - 1:]
+            parsed = _parse(field, ' '.join([glued] + [texts[i] for i in layout.row_after(index)]))
+            if parsed is None and field not in _BOTTOM_FIRST:
+                parsed = _parse(field, ' '.join(texts[i] for i in layout.row_below(index)))
+            if parsed is not None:
+                result[field], currencies[field] = parsed
+                break
+
+    for row in layout.top_rows(VENDOR_LINES):
+        if label_words.intersection(row):
+            continue
+        line = ' '.join(texts[i] for i in row[:VALUE_WORDS]).strip(' :,-')
+        if line.lower() in TITLE_LINES or not any(char.isalpha() for char in line):
+            continue
+        result['vendor'] = line
+        break
+
+    for field in ('total', 'subtotal', 'tax'):
+        if currencies.get(field):
+            result['currency'] = currencies[field]
+            break
+    else:
+        for symbol, code in CURRENCY_SYMBOLS.items():
+            if symbol in joined:
+                result['currency'] = code
+                break
+    return result
+
+
+def merge_fields(pages):
+    """One set of fields for a multi-page document from each page's fields
+
+    Vendor, number and dates come from the first page that has them;
+    amounts from the last, where the totals are printed.
+    """
+    merged = {}
+    for page in pages:
+        for name, value in page.items():
+            if value is None:
+                continue
+            if name in AMOUNT_FIELDS or merged.get(name) is None:
+                merged[name] = value
+    result = {'vendor': None}
+    result.update((field, None) for field in FIELD_LABELS)
+    result['currency'] = None
+    result.update(merged)
+    return result
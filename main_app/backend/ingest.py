@@ -0,0 +1,152 @@
+import hashlib
+import os
+
+from werkzeug.sansio.multipart import Data, Epilogue, Field, File, MultipartDecoder, NeedData
+
+from pdf_pages import is_pdf
+
+# Streaming upload reader for /receive. The multipart body is parsed chunk
+# by chunk straight off the request stream instead of letting Werkzeug
+# spool it to a temporary file first, so:
+#   - a Content-Length over the limit is refused before any body is read,
+#   - the file type is sniffed from its first bytes and anything that is
+#     not an image or PDF is refused without reading the rest,
+#   - the size limit is enforced as bytes arrive, not after the fact,
+#   - the SHA-256 used by the OCR cache is computed on the way in.
+# The upload ends up in memory exactly once.
+
+# Largest file accepted by /receive (Vision's own limit is 20 MB)
+MAX_UPLOAD_BYTES = int(os.environ.get('MAX_UPLOAD_BYTES', str(20 * 1024 * 1024)))
+INGEST_CHUNK_BYTES = int(os.environ.get('INGEST_CHUNK_BYTES', str(64 * 1024)))
+# Allowance for boundaries, part headers and the small form fields
+MULTIPART_OVERHEAD_BYTES = 64 * 1024
+# Plain form fields (render, async) are tiny; cap each one
+MAX_FORM_FIELD_BYTES = 16 * 1024
+
+# Bytes needed before the type can be decided (a PDF header may sit
+# anywhere in the first 1 KB, as in pdf_pages.is_pdf)
+SNIFF_BYTES = 1024
+
+SIGNATURES = (
+    (b'\xff\xd8\xff', 'jpeg'),
+    (b'\x89PNG\r\n\x1a\n', 'png'),
+    (b'GIF87a', 'gif'),
+    (b'GIF89a', 'gif'),
+    (b'II*\x00', 'tiff'),
+    (b'MM\x00*', 'tiff'),
+    (b'BM', 'bmp'),
+)
+
+
+class UploadRejected(Exception):
+    """Upload refused while streaming; carries the HTTP status to answer with"""
+
+    def __init__(self, message, status_code=400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class Upload:
+    """One uploaded file read off the stream, with its digest and sniffed type"""
+
+    __slots__ = ('filename', 'content', 'digest', 'kind', 'fields')
+
+    def __init__(self, filename, content, digest, kind, fields):
+        self.filename = filename
+        self.content = content
+        self.digest = digest
+        self.kind = kind
+        self.fields = fields
+
+
+def sniff(head):
+    """File type from its first bytes, or None if it is not one we OCR"""
+    for signature, kind in SIGNATURES:
+        if head.startswith(signature):
+            return kind
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'webp'
+    if is_pdf(head):
+        return 'pdf'
+    return None
+
+
+def _next_event(decoder):
+    try:
+        return decoder.next_event()
+    except ValueError as e:
+        raise UploadRejected(f"Malformed multipart body: {e}")
+
+
+def read_upload(stream, boundary, content_length=None, field_name='file', max_bytes=MAX_UPLOAD_BYTES):
+    """Stream a multipart body and return the Upload for field_name, or None
+
+    Raises UploadRejected as soon as the body is known to be too large or
+    the file is not a supported type - without reading the remainder.
+    """
+    if content_length is not None and content_length > max_bytes + MULTIPART_OVERHEAD_BYTES:
+        raise UploadRejected(
+            f"Upload is {content_length} bytes, over the {max_bytes} byte limit", 413
+        )
+
+    if not boundary:
+        raise UploadRejected("Multipart body has no boundary")
+    decoder = MultipartDecoder(boundary.encode())
+    fields = {}
+    upload = None
+    # State of the part currently being read
+    part_name = None
+    part_is_file = False
+    field_value = bytearray()
+    chunks = []
+    size = 0
+    head = b''
+    kind = None
+    sha256 = None
+    filename = None
+
+    finished = False
+    while not finished:
+        data = stream.read(INGEST_CHUNK_BYTES)
+        decoder.receive_data(data or None)
+        event = _next_event(decoder)
+        while not isinstance(event, NeedData):
+            if isinstance(event, Epilogue):
+                finished = True
+                break
+            if isinstance(event, File):
+                part_name, part_is_file = event.name, True
+                if part_name == field_name and upload is None:
+                    filename = event.filename
+                    sha256 = hashlib.sha256()
+            elif isinstance(event, Field):
+                part_name, part_is_file = event.name, False
+                field_value = bytearray()
+            elif isinstance(event, Data):
+                if part_is_file and part_name == field_name and upload is None:
+                    size += len(event.data)
+                    if size > max_bytes:
+                        raise UploadRejected(f"Upload is over the {max_bytes} byte limit", 413)
+                    if kind is None:
+                        head += event.data[:SNIFF_BYTES - len(head)]
+                        if len(head) >= SNIFF_BYTES or not event.more_data:
+                            kind = sniff(head)
+                            if kind is None and size:
+                                raise UploadRejected("Uploaded file is not a supported image or PDF", 415)
+                    sha256.update(event.data)
+                    chunks.append(event.data)
+                    if not event.more_data:
+                        upload = Upload(filename, b''.join(chunks), sha256.hexdigest(), kind, fields)
+                        chunks = []
+                elif not part_is_file:
+                    field_value += event.data
+                    if len(field_value) > MAX_FORM_FIELD_BYTES:
+                        raise UploadRejected(f"Form field '{part_name}' is too large", 413)
+                    if not event.more_data:
+                        fields[part_name] = field_value.decode('utf-8', 'replace')
+            event = _next_event(decoder)
+        if not data:
+            break
+    if sha256 is not None and upload is None:
+        raise UploadRejected("Upload ended before the file was complete")
+    return upload
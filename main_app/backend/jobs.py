@@ -0,0 +1,297 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from telemetry import fields, get_logger, start_timings
+
+# Background OCR jobs for POST /receive?async=1. The upload is stored in a
+# SQLite-backed queue and its invoice_id returned at once; worker threads
+# claim jobs, run the normal pipeline, keep the result for GET /jobs/<id>
+# and push a 'job-complete' message over the dashboard WebSocket.
+#
+# Workers run in-process (started with the app) or standalone with
+# `python jobs.py worker`. On Lambda the process is frozen as soon as the
+# response is returned and /tmp is private to one instance, so in-process
+# workers would stall and GET /jobs would miss jobs queued elsewhere. Async
+# mode is refused there unless JOB_QUEUE_PATH points at shared storage
+# (e.g. EFS mounted into the function and into a long-running host) and
+# JOB_WORKERS=0, with the standalone worker draining the queue:
+#
+#     JOB_QUEUE_PATH=/mnt/jobs/invoice_jobs.sqlite3 python jobs.py worker
+
+JOB_QUEUE_PATH = os.environ.get('JOB_QUEUE_PATH', '/tmp/invoice_jobs.sqlite3')
+# In-process worker threads; 0 when a standalone worker drains the queue
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', '1'))
+JOB_POLL_SECONDS = float(os.environ.get('JOB_POLL_SECONDS', '0.5'))
+# A 'processing' job not updated for this long is assumed lost and requeued
+JOB_STALE_SECONDS = int(os.environ.get('JOB_STALE_SECONDS', '300'))
+JOB_MAX_ATTEMPTS = int(os.environ.get('JOB_MAX_ATTEMPTS', '3'))
+ON_LAMBDA = bool(os.environ.get('AWS_LAMBDA_FUNCTION_NAME'))
+# Set explicitly when the queue is on storage other processes share
+JOB_QUEUE_SHARED = 'JOB_QUEUE_PATH' in os.environ
+
+STATUS_QUEUED = 'queued'
+STATUS_PROCESSING = 'processing'
+STATUS_DONE = 'done'
+STATUS_FAILED = 'failed'
+
+logger = get_logger('jobs')
+
+
+class JobsUnavailable(Exception):
+    """Async jobs can't work in this deployment (see the note at the top)"""
+
+
+def check_async_available():
+    """Raise JobsUnavailable when queued jobs would never run or be found"""
+    if not ON_LAMBDA:
+        return
+    if not JOB_QUEUE_SHARED:
+        raise JobsUnavailable(
+            "Async processing is not available here: set JOB_QUEUE_PATH to shared storage"
+            " and run `python jobs.py worker`"
+        )
+    if JOB_WORKERS:
+        raise JobsUnavailable("Async processing on Lambda needs JOB_WORKERS=0 and a standalone worker")
+
+
+class JobQueue:
+    """Durable job queue in a single SQLite file"""
+
+    def __init__(self, path=JOB_QUEUE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        # Autocommit mode; transactions are opened explicitly where needed
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                " id TEXT PRIMARY KEY,"
+                " status TEXT NOT NULL,"
+                " filename TEXT,"
+                " render TEXT,"
+                " content BLOB,"
+                " result TEXT,"
+                " error TEXT,"
+                " attempts INTEGER NOT NULL DEFAULT 0,"
+                " created_at REAL NOT NULL,"
+                " updated_at REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_status_created ON jobs (status, created_at)")
+
+    def enqueue(self, job_id, content, filename, render):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO jobs (id, status, filename, render, content, created_at, updated_at)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (job_id, STATUS_QUEUED, filename, render, content, now, now)
+            )
+
+    def claim(self):
+        """Take the oldest queued (or stale) job; returns a dict or None"""
+        now = time.time()
+        with self._lock:
+            # IMMEDIATE takes the write lock up front so two workers (or two
+            # processes) can't claim the same row
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT id, filename, render, content, attempts, created_at FROM jobs"
+                    " WHERE status = ? OR (status = ? AND updated_at < ?)"
+                    " ORDER BY created_at LIMIT 1",
+                    (STATUS_QUEUED, STATUS_PROCESSING, now - JOB_STALE_SECONDS)
+                ).fetchone()
+                if row is None:
+                    self._conn.execute("COMMIT")
+                    return None
+                self._conn.execute(
+                    "UPDATE jobs SET status = ?, attempts = attempts + 1, updated_at = ? WHERE id = ?",
+                    (STATUS_PROCESSING, now, row[0])
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return {
+            'id': row[0], 'filename': row[1], 'render': row[2], 'content': row[3],
+            'attempts': row[4] + 1, 'created_at': row[5],
+        }
+
+    def complete(self, job_id, result):
+        # The image is no longer needed once OCR is done
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, result = ?, content = NULL, updated_at = ? WHERE id = ?",
+                (STATUS_DONE, json.dumps(result), time.time(), job_id)
+            )
+
+    def fail(self, job_id, error, retry=False):
+        with self._lock:
+            if retry:
+                self._conn.execute(
+                    "UPDATE jobs SET status = ?, error = ?, updated_at = ? WHERE id = ?",
+                    (STATUS_QUEUED, error, time.time(), job_id)
+                )
+            else:
+                self._conn.execute(
+                    "UPDATE jobs SET status = ?, error = ?, content = NULL, updated_at = ? WHERE id = ?",
+                    (STATUS_FAILED, error, time.time(), job_id)
+                )
+
+    def requeue_processing(self):
+        """Put every 'processing' job back in the queue; returns how many"""
+        with self._lock:
+            return self._conn.execute(
+                "UPDATE jobs SET status = ?, updated_at = ? WHERE status = ?",
+                (STATUS_QUEUED, time.time(), STATUS_PROCESSING)
+            ).rowcount
+
+    def get(self, job_id):
+        """Job status (and result once done) without the image bytes"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id, status, filename, result, error, attempts, created_at, updated_at"
+                " FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        return {
+            'invoice_id': row[0],
+            'status': row[1],
+            'filename': row[2],
+            'result': json.loads(row[3]) if row[3] else None,
+            'error': row[4],
+            'attempts': row[5],
+            'created_at': int(row[6] * 1000),
+            'updated_at': int(row[7] * 1000),
+        }
+
+
+_queue = None
+_workers = []
+_lock = threading.Lock()
+
+
+def get_job_queue():
+    global _queue
+    if _queue is None:
+        with _lock:
+            if _queue is None:
+                _queue = JobQueue(JOB_QUEUE_PATH)
+    return _queue
+
+
+def _notify_job_complete(job):
+    """Tell connected dashboards a job finished, over the WSConnections channel"""
+    from dashboard import get_connections_table
+    from broadcast import broadcast_message
+    connections_table = get_connections_table()
+    if not connections_table:
+        return
+    broadcast_message(connections_table, json.dumps({
+        'type': 'job-complete',
+        'data': {
+            'invoice_id': job['invoice_id'],
+            'status': job['status'],
+            'error': job['error'],
+        }
+    }))
+
+
+def _process_pdf_job(job):
+    """Run a queued PDF through the page pipeline; the summary carries the pages"""
+    from pdf_pages import PDFDocument
+    from routes.upload import process_pdf
+    with PDFDocument(job['content']) as document:
+        lines = list(process_pdf(document, job['render'], invoice_id=job['id'], filename=job['filename']))
+    result = lines[-1]
+    result['pages'] = lines[:-1]
+    return result
+
+
+def process_job(queue, job):
+    from pdf_pages import is_pdf
+    from routes.upload import process_invoice
+    # Worker threads are reused - give every job its own stage timings
+    start_timings()
+    try:
+        if is_pdf(job['content']):
+            result = _process_pdf_job(job)
+        else:
+            result = process_invoice(job['content'], job['render'], invoice_id=job['id'], filename=job['filename'])
+        if result.get('status') == 'failed':
+            # Every page of the PDF failed - that is a failed job, not a done one
+            errors = [page['error'] for page in result.get('pages', []) if page.get('error')]
+            raise Exception(f"Every page failed: {errors[0]}" if errors else "No page could be processed")
+        result['queue_wait_ms'] = int((time.time() - job['created_at']) * 1000) - result['processing_time_ms']
+        queue.complete(job['id'], result)
+        logger.info("Job done", extra=fields(invoice_id=job['id'], queue_wait_ms=result['queue_wait_ms']))
+    except Exception as e:
+        retry = job['attempts'] < JOB_MAX_ATTEMPTS
+        queue.fail(job['id'], str(e), retry=retry)
+        logger.error(f"Job failed: {e}", extra=fields(invoice_id=job['id'], attempt=job['attempts'], retry=retry))
+        if retry:
+            return
+    try:
+        _notify_job_complete(queue.get(job['id']))
+    except Exception as e:
+        logger.error(f"Error notifying job completion: {e}", extra=fields(invoice_id=job['id']))
+
+
+def run_worker(stop_event=None):
+    """Claim and process jobs until stop_event is set"""
+    queue = get_job_queue()
+    while stop_event is None or not stop_event.is_set():
+        job = queue.claim()
+        if job is None:
+            time.sleep(JOB_POLL_SECONDS)
+            continue
+        process_job(queue, job)
+
+
+def start_workers():
+    """Start the in-process worker threads once (never on Lambda, see the top)
+
+    Called at app startup so jobs left in the queue by a restart resume
+    straight away. With a queue only this process uses, jobs it was in the
+    middle of are requeued too instead of waiting JOB_STALE_SECONDS.
+    """
+    if ON_LAMBDA or JOB_WORKERS <= 0 or _workers:
+        return
+    queue = get_job_queue()
+    with _lock:
+        if _workers:
+            return
+        if not JOB_QUEUE_SHARED:
+            requeued = queue.requeue_processing()
+            if requeued:
+                logger.info("Requeued interrupted jobs", extra=fields(jobs=requeued))
+        for i in range(JOB_WORKERS):
+            worker = threading.Thread(target=run_worker, name=f'job-worker-{i}', daemon=True)
+            worker.start()
+            _workers.append(worker)
+
+
+def submit_job(content, filename, render):
+    """Queue an image for background OCR and return its invoice_id"""
+    from routes.upload import new_invoice_id
+    invoice_id = new_invoice_id()
+    get_job_queue().enqueue(invoice_id, content, filename, render)
+    logger.info("Queued job", extra=fields(invoice_id=invoice_id, bytes=len(content)))
+    start_workers()
+    return invoice_id
+
+
+if __name__ == "__main__":
+    import sys
+    if sys.argv[1:] != ['worker']:
+        print("usage: python jobs.py worker")
+        sys.exit(2)
+    from dotenv import load_dotenv
+    load_dotenv()
+    print(f"Worker polling {JOB_QUEUE_PATH}")
+    run_worker()
@@ -0,0 +1,456 @@
+import time
+from decimal import Decimal
+
+# Running aggregate of every row in InvoiceMetrics, kept in the same table
+# under a reserved key. store_metrics bumps it with an atomic ADD on every
+# write so the dashboard can read totals with a single get_item instead of
+# scanning the whole table. The invoice row is written first and on its
+# own, so it survives whatever happens to the counter updates after it; the
+# aggregate and bucket counters are plain ADDs, which never conflict on the
+# shared rows the way a transaction would.
+#
+# The same counters are also kept per minute, hour and day in time-bucket
+# rows (invoiceId '__bucket__#<granularity>', timestamp = bucket start in
+# ms). The latency histogram in each row is mergeable by addition, so any
+# window is one Query on the timestamp range key plus a sum, and p50/p95/p99
+# are read off the merged histogram, bounded by the rows' min/max latency.
+
+AGGREGATE_ID = '__aggregate__'
+AGGREGATE_TIMESTAMP = 0
+# invoiceIds starting with this prefix are bookkeeping rows, not invoices
+RESERVED_PREFIX = '__'
+
+# Upper bounds (ms) of the latency histogram buckets; the last bucket is open
+LATENCY_BUCKETS_MS = [50, 100, 200, 300, 500, 750, 1000, 1500, 2000, 3000,
+                      5000, 7500, 10000, 15000, 20000, 30000]
+
+AGGREGATE_KEY = {'invoiceId': AGGREGATE_ID, 'timestamp': AGGREGATE_TIMESTAMP}
+
+BUCKET_PREFIX = '__bucket__'
+# Bucket width in seconds per granularity
+BUCKET_SECONDS = {'minute': 60, 'hour': 3600, 'day': 86400}
+# Bucket rows expire (DynamoDB TTL on expiresAt) once no window needs them
+BUCKET_RETENTION_SECONDS = {'minute': 2 * 86400, 'hour': 35 * 86400, 'day': 400 * 86400}
+
+# Selectable dashboard windows: name -> (granularity, length in seconds)
+WINDOWS = {
+    '5m': ('minute', 5 * 60),
+    '1h': ('minute', 3600),
+    '24h': ('hour', 86400),
+    '7d': ('hour', 7 * 86400),
+    '30d': ('day', 30 * 86400),
+}
+DEFAULT_WINDOW = '1h'
+
+PERCENTILES = (('p50Latency', 0.50), ('p95Latency', 0.95), ('p99Latency', 0.99))
+
+
+def latency_bucket_attribute(latency_ms):
+    """Name of the histogram attribute a latency falls into"""
+    for bound in LATENCY_BUCKETS_MS:
+        if latency_ms <= bound:
+            return f"latencyLe{bound}"
+    return f"latencyGt{LATENCY_BUCKETS_MS[-1]}"
+
+
+def histogram_attributes():
+    """All histogram attribute names, in bucket order"""
+    names = [f"latencyLe{bound}" for bound in LATENCY_BUCKETS_MS]
+    names.append(f"latencyGt{LATENCY_BUCKETS_MS[-1]}")
+    return names
+
+
+def is_reserved(item):
+    return str(item.get('invoiceId', '')).startswith(RESERVED_PREFIX)
+
+
+def _to_decimal(value):
+    return Decimal(str(value))
+
+
+def _fold_samples(samples):
+    """Collapse (latency_ms, accuracy) pairs into the deltas for one update"""
+    totals = {
+        'invoiceCount': 0,
+        'latencySum': 0,
+        'accuracySum': Decimal(0),
+        'minLatency': None,
+        'maxLatency': None,
+        'histogram': {},
+    }
+    for latency_ms, accuracy in samples:
+        latency_ms = int(latency_ms)
+        totals['invoiceCount'] += 1
+        totals['latencySum'] += latency_ms
+        totals['accuracySum'] += _to_decimal(accuracy)
+        if totals['minLatency'] is None or latency_ms < totals['minLatency']:
+            totals['minLatency'] = latency_ms
+        if totals['maxLatency'] is None or latency_ms > totals['maxLatency']:
+            totals['maxLatency'] = latency_ms
+        bucket = latency_bucket_attribute(latency_ms)
+        totals['histogram'][bucket] = totals['histogram'].get(bucket, 0) + 1
+    return totals
+
+
+def _add_clauses(totals):
+    """ADD clauses and their values for the counters and histogram in totals"""
+    values = {
+        ':count': totals['invoiceCount'],
+        ':latency': totals['latencySum'],
+        ':accuracy': totals['accuracySum'],
+    }
+    clauses = [
+        "invoiceCount :count",
+        "latencySum :latency",
+        "accuracySum :accuracy",
+    ]
+    for i, (bucket, count) in enumerate(sorted(totals['histogram'].items())):
+        clauses.append(f"{bucket} :h{i}")
+        values[f":h{i}"] = count
+    return clauses, values
+
+
+def bucket_id(granularity):
+    return f"{BUCKET_PREFIX}#{granularity}"
+
+
+def bucket_start(granularity, at_ms):
+    """Start (ms) of the bucket containing at_ms"""
+    width_ms = BUCKET_SECONDS[granularity] * 1000
+    return at_ms - at_ms % width_ms
+
+
+def _bucket_expiry(granularity, start_ms):
+    """TTL (epoch seconds) for a bucket row"""
+    return start_ms // 1000 + BUCKET_SECONDS[granularity] + BUCKET_RETENTION_SECONDS[granularity]
+
+
+def _update_extreme(table, attribute, value, comparison, key):
+    """Set minLatency/maxLatency only if the new value beats the stored one"""
+    from botocore.exceptions import ClientError
+    try:
+        table.update_item(
+            Key=key,
+            UpdateExpression=f"SET {attribute} = :v",
+            ConditionExpression=f"attribute_not_exists({attribute}) OR {attribute} {comparison} :v",
+            ExpressionAttributeValues={':v': value}
+        )
+    except ClientError as e:
+        # Another writer already stored a better value
+        if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            raise
+
+
+def _update_extremes(table, key, item, totals):
+    """Conditional min/max writes for a row just updated with ADD
+
+    min/max cannot be expressed with ADD, so they get a conditional write -
+    but only when the returned item shows this batch actually moves them.
+    """
+    stored_min = item.get('minLatency')
+    if stored_min is None or totals['minLatency'] < stored_min:
+        _update_extreme(table, 'minLatency', totals['minLatency'], '>', key)
+    stored_max = item.get('maxLatency')
+    if stored_max is None or totals['maxLatency'] > stored_max:
+        _update_extreme(table, 'maxLatency', totals['maxLatency'], '<', key)
+
+
+def _aggregate_rows(totals, at_ms):
+    """(key, extra SET clauses, extra values) for the aggregate and each time bucket"""
+    rows = [(AGGREGATE_KEY, ["updatedAt = :now"], {':now': int(time.time() * 1000)})]
+    for granularity in BUCKET_SECONDS:
+        start = bucket_start(granularity, at_ms)
+        rows.append((
+            {'invoiceId': bucket_id(granularity), 'timestamp': start},
+            ["expiresAt = :expires"],
+            {':expires': _bucket_expiry(granularity, start)},
+        ))
+    return rows
+
+
+def record_samples(table, samples, items=(), at_ms=None):
+    """Write invoice rows, then add their (latency_ms, accuracy) samples to
+    the aggregate and to the time buckets holding at_ms
+
+    The rows go in first (a batch writer for more than one), so a failed
+    counter update afterwards can't lose them - rebuild_aggregate and
+    rebuild_time_buckets repair the counters from the rows. Each counter row
+    then takes one unconditional ADD, and a conditional min/max write only
+    when the batch moves its extremes.
+    """
+    if len(items) == 1:
+        table.put_item(Item=items[0])
+    elif items:
+        with table.batch_writer() as batch:
+            for item in items:
+                batch.put_item(Item=item)
+
+    totals = _fold_samples(samples)
+    if not totals['invoiceCount']:
+        return
+    if at_ms is None:
+        at_ms = int(time.time() * 1000)
+
+    clauses, values = _add_clauses(totals)
+    values.update({':min': totals['minLatency'], ':max': totals['maxLatency']})
+    for key, sets, extra in _aggregate_rows(totals, at_ms):
+        # The first write to a row sets min/max outright
+        sets = sets + ["minLatency = if_not_exists(minLatency, :min)", "maxLatency = if_not_exists(maxLatency, :max)"]
+        response = table.update_item(
+            Key=key,
+            UpdateExpression="ADD " + ", ".join(clauses) + " SET " + ", ".join(sets),
+            ExpressionAttributeValues=dict(values, **extra),
+            ReturnValues='ALL_NEW'
+        )
+        _update_extremes(table, key, response.get('Attributes', {}), totals)
+
+
+def query_time_buckets(table, granularity, start_ms, end_ms):
+    """Bucket rows of one granularity whose start lies in [start_ms, end_ms]"""
+    query_kwargs = {
+        'KeyConditionExpression': "invoiceId = :id AND #ts BETWEEN :start AND :end",
+        # timestamp is a DynamoDB reserved word
+        'ExpressionAttributeNames': {'#ts': 'timestamp'},
+        'ExpressionAttributeValues': {
+            ':id': bucket_id(granularity),
+            ':start': bucket_start(granularity, start_ms),
+            ':end': end_ms,
+        },
+    }
+    items = []
+    while True:
+        response = table.query(**query_kwargs)
+        items.extend(response.get('Items', []))
+        last_key = response.get('LastEvaluatedKey')
+        if not last_key:
+            return items
+        query_kwargs['ExclusiveStartKey'] = last_key
+
+
+def histogram_percentile(histogram, q, min_latency=None, max_latency=None):
+    """Latency at quantile q, interpolated linearly inside its bucket
+
+    When the observed min/max latency are known they narrow the bucket
+    edges, so the result always lies in [min_latency, max_latency] (a
+    single 17 ms sample reads as 17, not as the middle of 0-50 ms). The
+    open top bucket is reported at its lower edge without max_latency.
+    """
+    counts = [int(histogram.get(name, 0)) for name in histogram_attributes()]
+    total = sum(counts)
+    if not total:
+        return 0
+    top = LATENCY_BUCKETS_MS[-1]
+    floor = int(min_latency) if min_latency is not None else 0
+    ceiling = int(max_latency) if max_latency is not None else None
+    uppers = LATENCY_BUCKETS_MS + [max(ceiling, top) if ceiling is not None else top]
+    rank = q * total
+    cumulative = 0
+    lower = 0
+    for count, upper in zip(counts, uppers):
+        if count and cumulative + count >= rank:
+            low = max(lower, floor)
+            high = min(upper, ceiling) if ceiling is not None else upper
+            high = max(high, low)
+            return int(round(low + (high - low) * (rank - cumulative) / count))
+        cumulative += count
+        lower = upper
+    return uppers[-1] if ceiling is None else min(uppers[-1], ceiling)
+
+
+def summarize_window(table, window=DEFAULT_WINDOW, now_ms=None):
+    """Totals, throughput and latency percentiles over one of WINDOWS"""
+    if window not in WINDOWS:
+        raise ValueError(f"Unknown window '{window}', expected one of {', '.join(WINDOWS)}")
+    granularity, seconds = WINDOWS[window]
+    if now_ms is None:
+        now_ms = int(time.time() * 1000)
+    # The leading bucket starts before now - window, so the counts cover
+    # [since, now] - divide by that span, not the nominal window
+    since = bucket_start(granularity, now_ms - seconds * 1000)
+    items = query_time_buckets(table, granularity, since, now_ms)
+
+    count = sum(int(item.get('invoiceCount', 0)) for item in items)
+    latency_sum = sum(int(item.get('latencySum', 0)) for item in items)
+    accuracy_sum = sum(float(item.get('accuracySum', 0)) for item in items)
+    histogram = {
+        name: sum(int(item.get(name, 0)) for item in items)
+        for name in histogram_attributes()
+    }
+    minimums = [int(item['minLatency']) for item in items if 'minLatency' in item]
+    maximums = [int(item['maxLatency']) for item in items if 'maxLatency' in item]
+    # Rows written before buckets kept min/max leave the bounds open
+    complete = len(minimums) == len(items)
+    min_latency = min(minimums) if minimums and complete else None
+    max_latency = max(maximums) if maximums and complete else None
+    summary = {
+        'window': window,
+        'granularity': granularity,
+        'since': since,
+        'total': count,
+        'invoicesPerMinute': round(count / ((now_ms - since) / 60000), 2),
+        'avgLatency': round(latency_sum / count) if count else 0,
+        'avgAccuracy': round(accuracy_sum / count, 1) if count else 0,
+        'minLatency': min_latency or 0,
+        'maxLatency': max_latency or 0,
+        'series': [
+            {'timestamp': int(item['timestamp']), 'count': int(item.get('invoiceCount', 0))}
+            for item in items
+        ],
+    }
+    for name, q in PERCENTILES:
+        summary[name] = histogram_percentile(histogram, q, min_latency, max_latency)
+    return summary
+
+
+def read_aggregate(table):
+    """Fetch the aggregate record (a single O(1) read), or None if missing"""
+    response = table.get_item(Key=AGGREGATE_KEY)
+    return response.get('Item')
+
+
+def summarize_aggregate(item):
+    """Turn the stored aggregate into dashboard numbers"""
+    item = item or {}
+    count = int(item.get('invoiceCount', 0))
+    latency_sum = int(item.get('latencySum', 0))
+    accuracy_sum = float(item.get('accuracySum', 0))
+    summary = {
+        'total': count,
+        'avgLatency': latency_sum / count if count else 0,
+        'avgAccuracy': accuracy_sum / count if count else 0,
+        'minLatency': int(item['minLatency']) if 'minLatency' in item else 0,
+        'maxLatency': int(item['maxLatency']) if 'maxLatency' in item else 0,
+        'histogram': {name: int(item.get(name, 0)) for name in histogram_attributes()},
+    }
+    for name, q in PERCENTILES:
+        summary[name] = histogram_percentile(
+            summary['histogram'], q, item.get('minLatency'), item.get('maxLatency')
+        )
+    return summary
+
+
+def scan_all_metrics(table):
+    """Yield every invoice row, following LastEvaluatedKey across pages"""
+    scan_kwargs = {}
+    while True:
+        response = table.scan(**scan_kwargs)
+        for item in response.get('Items', []):
+            if not is_reserved(item):
+                yield item
+        last_key = response.get('LastEvaluatedKey')
+        if not last_key:
+            break
+        scan_kwargs['ExclusiveStartKey'] = last_key
+
+
+def rebuild_aggregate(table, dry_run=False, rows=None):
+    """Recompute the aggregate from a fully paginated scan and overwrite it
+
+    Writes that land while the scan is running can be lost, so run this
+    during a quiet period (it is meant for backfill and drift repair).
+    rows can pass in invoice rows already scanned.
+    """
+    samples = (
+        (int(m.get('latency', 0)), m.get('accuracy', 0))
+        for m in (scan_all_metrics(table) if rows is None else rows)
+    )
+    totals = _fold_samples(samples)
+
+    item = dict(AGGREGATE_KEY)
+    item.update({
+        'invoiceCount': totals['invoiceCount'],
+        'latencySum': totals['latencySum'],
+        'accuracySum': totals['accuracySum'],
+        'updatedAt': int(time.time() * 1000),
+    })
+    if totals['minLatency'] is not None:
+        item['minLatency'] = totals['minLatency']
+        item['maxLatency'] = totals['maxLatency']
+    item.update(totals['histogram'])
+
+    if not dry_run:
+        table.put_item(Item=item)
+    return item
+
+
+def rebuild_time_buckets(table, dry_run=False, rows=None, now_ms=None):
+    """Recompute every unexpired minute/hour/day bucket from the invoice rows
+
+    Same caveat as rebuild_aggregate: run it while nothing is being written.
+    Returns the number of bucket rows per granularity.
+    """
+    if now_ms is None:
+        now_ms = int(time.time() * 1000)
+    grouped = {}
+    for m in (scan_all_metrics(table) if rows is None else rows):
+        sample = (int(m.get('latency', 0)), m.get('accuracy', 0))
+        at_ms = int(m['timestamp'])
+        for granularity in BUCKET_SECONDS:
+            key = (granularity, bucket_start(granularity, at_ms))
+            grouped.setdefault(key, []).append(sample)
+
+    written = {granularity: 0 for granularity in BUCKET_SECONDS}
+    items = []
+    for (granularity, start), samples in grouped.items():
+        expires = _bucket_expiry(granularity, start)
+        if expires * 1000 < now_ms:
+            # TTL would delete it straight away
+            continue
+        totals = _fold_samples(samples)
+        item = {
+            'invoiceId': bucket_id(granularity),
+            'timestamp': start,
+            'invoiceCount': totals['invoiceCount'],
+            'latencySum': totals['latencySum'],
+            'accuracySum': totals['accuracySum'],
+            'minLatency': totals['minLatency'],
+            'maxLatency': totals['maxLatency'],
+            'expiresAt': expires,
+        }
+        item.update(totals['histogram'])
+        items.append(item)
+        written[granularity] += 1
+
+    if not dry_run:
+        with table.batch_writer() as batch:
+            for item in items:
+                batch.put_item(Item=item)
+    return written
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description="Maintain the InvoiceMetrics running aggregate and time buckets")
+    parser.add_argument('command', choices=['reconcile', 'show', 'window'])
+    parser.add_argument('--window', default=DEFAULT_WINDOW, choices=list(WINDOWS))
+    parser.add_argument('--table', default='InvoiceMetrics')
+    parser.add_argument('--region', default='us-east-1')
+    parser.add_argument('--dry-run', action='store_true',
+                        help="compute the aggregate but do not write it")
+    args = parser.parse_args()
+
+    import boto3
+    table = boto3.resource('dynamodb', region_name=args.region).Table(args.table)
+
+    if args.command == 'show':
+        print(summarize_aggregate(read_aggregate(table)))
+        return
+    if args.command == 'window':
+        print(summarize_window(table, args.window))
+        return
+
+    before = summarize_aggregate(read_aggregate(table))
+    # One scan feeds both rebuilds
+    rows = list(scan_all_metrics(table))
+    item = rebuild_aggregate(table, dry_run=args.dry_run, rows=rows)
+    after = summarize_aggregate(item)
+    buckets = rebuild_time_buckets(table, dry_run=args.dry_run, rows=rows)
+    print(f"Stored aggregate: {before['total']} invoices, {before['avgLatency']:.0f}ms avg latency")
+    print(f"Rebuilt aggregate: {after['total']} invoices, {after['avgLatency']:.0f}ms avg latency")
+    print(f"Rebuilt time buckets: {buckets}")
+    if args.dry_run:
+        print("Dry run - aggregate not written")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,232 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# Cache of OCR output keyed on the SHA-256 of the uploaded bytes. Vendors
+# resend the same invoice and users re-upload after a refresh; a hit skips
+# the Vision call entirely.
+#
+# A backend is any object with get(key) -> (stored_at, value) | None,
+# set(key, value, stored_at) and delete(key). Values are plain JSON-able
+# dicts ({'detected_text': ..., 'segments': SegmentArray.to_compact(),
+# 'quality': the scoring dict the accuracy score came from}).
+
+OCR_CACHE_BACKEND = os.environ.get('OCR_CACHE_BACKEND', 'memory')  # memory | sqlite | tiered | none
+OCR_CACHE_MAX_ENTRIES = int(os.environ.get('OCR_CACHE_MAX_ENTRIES', '256'))
+OCR_CACHE_PATH = os.environ.get('OCR_CACHE_PATH', '/tmp/ocr_cache.sqlite3')
+OCR_CACHE_TTL_SECONDS = int(os.environ.get('OCR_CACHE_TTL_SECONDS', '86400'))
+# Bounds for the SQLite tier (it lives in /tmp, which is capped too); the
+# oldest entries go first once either is passed
+OCR_CACHE_SQLITE_MAX_ROWS = int(os.environ.get('OCR_CACHE_SQLITE_MAX_ROWS', '5000'))
+OCR_CACHE_SQLITE_MAX_BYTES = int(os.environ.get('OCR_CACHE_SQLITE_MAX_BYTES', str(200 * 1024 * 1024)))
+# Expired and over-cap entries are pruned every this many writes
+OCR_CACHE_PRUNE_EVERY = int(os.environ.get('OCR_CACHE_PRUNE_EVERY', '64'))
+
+# Bump when the stored value format or the Vision feature set changes so
+# old entries stop matching
+CACHE_KEY_VERSION = 'v4'
+
+
+def content_hash(content):
+    """SHA-256 hex digest of the uploaded bytes"""
+    return hashlib.sha256(content).hexdigest()
+
+
+def cache_key(digest):
+    return f"{CACHE_KEY_VERSION}:{digest}"
+
+
+class MemoryLRUBackend:
+    """In-process LRU bounded by entry count"""
+
+    def __init__(self, max_entries=OCR_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key, value, stored_at):
+        with self._lock:
+            self._entries[key] = (stored_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+
+class SQLiteBackend:
+    """Single-file SQLite tier, so entries survive restarts when the path is mounted
+
+    Bounded by max_rows and max_bytes (stored JSON) and pruned of entries
+    older than ttl_seconds: on open and then every prune_every writes.
+    Freed pages are reused by later writes, so the file stops growing at
+    about the cap.
+    """
+
+    def __init__(self, path=OCR_CACHE_PATH, max_rows=OCR_CACHE_SQLITE_MAX_ROWS,
+                 max_bytes=OCR_CACHE_SQLITE_MAX_BYTES, ttl_seconds=OCR_CACHE_TTL_SECONDS,
+                 prune_every=OCR_CACHE_PRUNE_EVERY):
+        self.path = path
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.prune_every = prune_every
+        self._writes = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS ocr_cache ("
+                " key TEXT PRIMARY KEY,"
+                " stored_at REAL NOT NULL,"
+                " value TEXT NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS ocr_cache_stored_at ON ocr_cache (stored_at)")
+        self.prune()
+
+    def get(self, key):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT stored_at, value FROM ocr_cache WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None:
+            return None
+        return row[0], json.loads(row[1])
+
+    def set(self, key, value, stored_at):
+        payload = json.dumps(value, separators=(',', ':'))
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO ocr_cache (key, stored_at, value) VALUES (?, ?, ?)",
+                (key, stored_at, payload)
+            )
+            self._writes += 1
+            due = self._writes % self.prune_every == 0
+        if due:
+            self.prune()
+
+    def delete(self, key):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM ocr_cache WHERE key = ?", (key,))
+
+    def purge_older_than(self, cutoff):
+        with self._lock, self._conn:
+            return self._conn.execute(
+                "DELETE FROM ocr_cache WHERE stored_at < ?", (cutoff,)
+            ).rowcount
+
+    def prune(self):
+        """Drop expired entries, then the oldest until both caps hold; returns rows removed"""
+        removed = self.purge_older_than(time.time() - self.ttl_seconds)
+        with self._lock, self._conn:
+            # Newest first: keep rows while they fit (no window functions -
+            # the SQLite on Lambda's Amazon Linux 2 predates them)
+            rows = self._conn.execute(
+                "SELECT key, length(value) FROM ocr_cache ORDER BY stored_at DESC"
+            ).fetchall()
+            total = 0
+            for kept, (key, size) in enumerate(rows):
+                total += size
+                if kept >= self.max_rows or total > self.max_bytes:
+                    break
+            else:
+                kept = len(rows)
+            evict = [(key,) for key, _ in rows[kept:]]
+            if evict:
+                self._conn.executemany("DELETE FROM ocr_cache WHERE key = ?", evict)
+        return removed + len(evict)
+
+
+class TieredBackend:
+    """Memory in front of a slower tier; slow-tier hits are promoted"""
+
+    def __init__(self, front, back):
+        self.front = front
+        self.back = back
+
+    def get(self, key):
+        entry = self.front.get(key)
+        if entry is not None:
+            return entry
+        entry = self.back.get(key)
+        if entry is not None:
+            self.front.set(key, entry[1], entry[0])
+        return entry
+
+    def set(self, key, value, stored_at):
+        self.front.set(key, value, stored_at)
+        self.back.set(key, value, stored_at)
+
+    def delete(self, key):
+        self.front.delete(key)
+        self.back.delete(key)
+
+
+class OCRCache:
+    """TTL-aware cache front end over a pluggable backend"""
+
+    def __init__(self, backend, ttl_seconds=OCR_CACHE_TTL_SECONDS):
+        self.backend = backend
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, digest):
+        key = cache_key(digest)
+        entry = self.backend.get(key)
+        if entry is not None and time.time() - entry[0] > self.ttl_seconds:
+            self.backend.delete(key)
+            entry = None
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return entry[1] if entry is not None else None
+
+    def set(self, digest, value):
+        self.backend.set(cache_key(digest), value, time.time())
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses}
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def _build_backend(kind):
+    if kind == 'memory':
+        return MemoryLRUBackend(OCR_CACHE_MAX_ENTRIES)
+    if kind == 'sqlite':
+        return SQLiteBackend(OCR_CACHE_PATH)
+    if kind == 'tiered':
+        return TieredBackend(MemoryLRUBackend(OCR_CACHE_MAX_ENTRIES), SQLiteBackend(OCR_CACHE_PATH))
+    raise ValueError(f"Unknown OCR_CACHE_BACKEND: {kind}")
+
+
+def get_ocr_cache():
+    """Process-wide OCR cache configured from the environment, or None when disabled"""
+    global _cache
+    if OCR_CACHE_BACKEND == 'none':
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = OCRCache(_build_backend(OCR_CACHE_BACKEND), OCR_CACHE_TTL_SECONDS)
+    return _cache
@@ -0,0 +1,79 @@
+import io
+import os
+
+from preprocess import PREPROCESS_ENABLED, PREPROCESS_JPEG_QUALITY, PREPROCESS_MAX_EDGE
+
+# PDF support for /receive. Pages are rasterized one at a time, only when a
+# worker slot is free to OCR them, so memory grows with the number of pages
+# in flight rather than with the page count of the document. With the
+# preprocess stage on, pages are rendered straight to what it would send
+# Vision - grayscale, long edge capped at PREPROCESS_MAX_EDGE - so it
+# passes them through instead of decoding and re-encoding every page.
+
+# Rasterization resolution - 200 dpi keeps small print legible to Vision
+PDF_RENDER_DPI = int(os.environ.get('PDF_RENDER_DPI', '200'))
+# Refuse documents longer than this outright
+PDF_MAX_PAGES = int(os.environ.get('PDF_MAX_PAGES', '50'))
+PDF_JPEG_QUALITY = int(os.environ.get('PDF_JPEG_QUALITY', '90'))
+
+PDF_MAGIC = b'%PDF-'
+
+
+def is_pdf(content):
+    """True for PDF bytes (the header may follow a little leading junk)"""
+    return PDF_MAGIC in content[:1024]
+
+
+class PDFDocument:
+    """Lazily rasterized pages of an in-memory PDF
+
+    pdfium is not thread safe, so pages must be rendered from one thread at
+    a time; OCR of the rendered JPEGs can run anywhere.
+    """
+
+    def __init__(self, content, dpi=PDF_RENDER_DPI):
+        import pypdfium2 as pdfium
+        try:
+            self._pdf = pdfium.PdfDocument(content)
+        except pdfium.PdfiumError as e:
+            raise Exception(f"Uploaded file is not a readable PDF: {e}")
+        self.page_count = len(self._pdf)
+        self.scale = dpi / 72
+        if self.page_count == 0:
+            self.close()
+            raise Exception("Uploaded PDF has no pages")
+        if self.page_count > PDF_MAX_PAGES:
+            self.close()
+            raise Exception(f"PDF has {self.page_count} pages (limit {PDF_MAX_PAGES})")
+
+    def render_page(self, index):
+        """JPEG bytes for one page (0-based); the bitmap is freed before returning"""
+        page = self._pdf[index]
+        try:
+            if PREPROCESS_ENABLED:
+                scale = min(self.scale, PREPROCESS_MAX_EDGE / max(page.get_size()))
+                bitmap = page.render(scale=scale, grayscale=True)
+                quality = PREPROCESS_JPEG_QUALITY
+            else:
+                bitmap = page.render(scale=self.scale)
+                quality = PDF_JPEG_QUALITY
+            try:
+                image = bitmap.to_pil()
+                if image.mode not in ('RGB', 'L'):
+                    image = image.convert('RGB')
+                output = io.BytesIO()
+                image.save(output, 'JPEG', quality=quality)
+                return output.getvalue()
+            finally:
+                bitmap.close()
+        finally:
+            page.close()
+
+    def close(self):
+        self._pdf.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
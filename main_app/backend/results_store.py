@@ -0,0 +1,587 @@
+import base64
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import zlib
+from decimal import Decimal
+
+import numpy as np
+
+from segments import VERTEX_COUNT, SegmentArray
+from telemetry import fields, get_logger
+
+# Persisted OCR results: every processed invoice's text, word boxes and
+# extracted fields, so they can be listed, searched and fetched again
+# without another upload or Vision call.
+#
+# Word boxes are stored column by column - all x1s, then all y1s, ... - as
+# int32 and zlib-compressed, with the word texts as a second compressed
+# column. Neighbouring words have close coordinates, so each column
+# compresses far better than the interleaved JSON.
+#
+# A backend is any object with put_many(records), get(invoice_id,
+# include_segments) -> dict | None and query(**filters, limit, cursor) ->
+# {'items': [...], 'next_cursor': str | None}. Queries always go through an
+# index (vendor, invoice date, total or creation time) or the full-text
+# index and page with a keyset cursor - never a table scan or an OFFSET.
+
+RESULTS_STORE_BACKEND = os.environ.get('RESULTS_STORE_BACKEND', 'sqlite')  # sqlite | dynamodb | none
+RESULTS_STORE_PATH = os.environ.get('RESULTS_STORE_PATH', '/tmp/invoice_results.sqlite3')
+RESULTS_TABLE_NAME = os.environ.get('RESULTS_TABLE_NAME', 'InvoiceResults')
+RESULTS_PAGE_SIZE = int(os.environ.get('RESULTS_PAGE_SIZE', '20'))
+RESULTS_MAX_PAGE_SIZE = 100
+RESULTS_COMPRESSION_LEVEL = 6
+
+# Separates word texts in the compressed texts column (never inside a word)
+_WORD_SEPARATOR = '\x1f'
+
+# DynamoDB items are capped at 400 KB; past this the word boxes are left out
+DYNAMODB_MAX_ITEM_BYTES = 350 * 1024
+
+logger = get_logger('results_store')
+
+
+# --- Encoding -------------------------------------------------------------
+
+def _compress(data):
+    return zlib.compress(data, RESULTS_COMPRESSION_LEVEL)
+
+
+def encode_segments(segments):
+    """(texts, boxes) compressed column blobs for a SegmentArray"""
+    texts = _compress(_WORD_SEPARATOR.join(segments.texts).encode('utf-8'))
+    columns = np.ascontiguousarray(segments.boxes.reshape(len(segments), VERTEX_COUNT * 2).T, dtype='<i4')
+    return texts, _compress(columns.tobytes())
+
+
+def decode_segments(texts, boxes):
+    """Inverse of encode_segments"""
+    words = zlib.decompress(texts).decode('utf-8')
+    words = words.split(_WORD_SEPARATOR) if words else []
+    if not words:
+        return SegmentArray.empty()
+    columns = np.frombuffer(zlib.decompress(boxes), dtype='<i4').reshape(VERTEX_COUNT * 2, len(words))
+    return SegmentArray(words, np.ascontiguousarray(columns.T, dtype=np.int32).reshape(len(words), VERTEX_COUNT, 2))
+
+
+def vendor_key(vendor):
+    """Lookup form of a vendor name: lowercased, punctuation dropped, spaces collapsed"""
+    if not vendor:
+        return None
+    return ' '.join(re.sub(r'[^\w\s]', ' ', vendor.lower()).split()) or None
+
+
+def build_record(invoice_id, pages, invoice_fields, accuracy_score=None, filename=None, created_at=None):
+    """Record for put_many from [(page_number, detected_text, SegmentArray)]"""
+    encoded = []
+    for number, detected_text, segments in pages:
+        texts, boxes = encode_segments(segments)
+        encoded.append({
+            'page': number,
+            'text': _compress((detected_text or '').encode('utf-8')),
+            'texts': texts,
+            'boxes': boxes,
+        })
+    return {
+        'invoice_id': invoice_id,
+        'created_at': int(created_at if created_at is not None else time.time() * 1000),
+        'vendor': invoice_fields.get('vendor'),
+        'vendor_key': vendor_key(invoice_fields.get('vendor')),
+        'invoice_number': invoice_fields.get('invoice_number'),
+        'invoice_date': invoice_fields.get('invoice_date'),
+        'total': invoice_fields.get('total'),
+        'currency': invoice_fields.get('currency'),
+        'accuracy_score': accuracy_score,
+        'page_count': len(pages),
+        'word_count': sum(len(segments) for _, _, segments in pages),
+        'filename': filename,
+        'fields': invoice_fields,
+        'pages': encoded,
+        # Plain text for the full-text index
+        'body': '\n'.join(detected_text or '' for _, detected_text, _ in pages),
+    }
+
+
+def _decode_pages(pages, include_segments):
+    decoded = []
+    for page in pages:
+        item = {
+            'page': page['page'],
+            'extracted_text': zlib.decompress(page['text']).decode('utf-8'),
+        }
+        if include_segments:
+            item['text_segments'] = decode_segments(page['texts'], page['boxes']).to_json()
+        decoded.append(item)
+    return decoded
+
+
+def encode_cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(values, separators=(',', ':')).encode()).decode()
+
+
+def decode_cursor(cursor):
+    try:
+        return json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except Exception:
+        raise ValueError("Invalid cursor")
+
+
+def _page_size(limit):
+    if limit is None:
+        return RESULTS_PAGE_SIZE
+    return max(1, min(int(limit), RESULTS_MAX_PAGE_SIZE))
+
+
+# --- SQLite ---------------------------------------------------------------
+
+# Listing order -> sort column; each has an index ending in (column, id)
+_SQLITE_ORDERS = {
+    'created': 'created_at',
+    'vendor': 'created_at',
+    'date': 'invoice_date',
+    'total': 'total',
+}
+
+_SUMMARY_COLUMNS = (
+    'invoice_id', 'created_at', 'vendor', 'invoice_number', 'invoice_date', 'total', 'currency',
+    'accuracy_score', 'page_count', 'word_count', 'filename', 'fields',
+)
+
+
+class SQLiteResultsBackend:
+    """Reference backend: one SQLite file with B-tree indexes and an FTS5 text index"""
+
+    def __init__(self, path=RESULTS_STORE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(
+                "CREATE TABLE IF NOT EXISTS invoices ("
+                " id INTEGER PRIMARY KEY,"
+                " invoice_id TEXT NOT NULL UNIQUE,"
+                " created_at INTEGER NOT NULL,"
+                " vendor TEXT,"
+                " vendor_key TEXT,"
+                " invoice_number TEXT,"
+                " invoice_date TEXT,"
+                " total REAL,"
+                " currency TEXT,"
+                " accuracy_score INTEGER,"
+                " page_count INTEGER NOT NULL,"
+                " word_count INTEGER NOT NULL,"
+                " filename TEXT,"
+                " fields TEXT NOT NULL);"
+                "CREATE INDEX IF NOT EXISTS invoices_created ON invoices (created_at, id);"
+                "CREATE INDEX IF NOT EXISTS invoices_vendor ON invoices (vendor_key, created_at, id);"
+                "CREATE INDEX IF NOT EXISTS invoices_date ON invoices (invoice_date, id);"
+                "CREATE INDEX IF NOT EXISTS invoices_total ON invoices (total, id);"
+                "CREATE TABLE IF NOT EXISTS invoice_pages ("
+                " invoice INTEGER NOT NULL,"
+                " page INTEGER NOT NULL,"
+                " text BLOB NOT NULL,"
+                " texts BLOB NOT NULL,"
+                " boxes BLOB NOT NULL,"
+                " PRIMARY KEY (invoice, page)) WITHOUT ROWID;"
+            )
+            try:
+                # Contentless: the text itself is only kept compressed in
+                # invoice_pages, the FTS table holds just the index
+                self._conn.execute(
+                    "CREATE VIRTUAL TABLE IF NOT EXISTS invoice_text USING fts5(body, content='')"
+                )
+                self.full_text = True
+            except sqlite3.OperationalError:
+                logger.warning("SQLite has no FTS5 - full-text search disabled")
+                self.full_text = False
+
+    def put_many(self, records):
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                for record in records:
+                    self._put(record)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def _put(self, record):
+        existing = self._conn.execute(
+            "SELECT id FROM invoices WHERE invoice_id = ?", (record['invoice_id'],)
+        ).fetchone()
+        if existing is not None:
+            self._delete(existing[0])
+        cursor = self._conn.execute(
+            "INSERT INTO invoices (invoice_id, created_at, vendor, vendor_key, invoice_number,"
+            " invoice_date, total, currency, accuracy_score, page_count, word_count, filename, fields)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                record['invoice_id'], record['created_at'], record['vendor'], record['vendor_key'],
+                record['invoice_number'], record['invoice_date'], record['total'], record['currency'],
+                record['accuracy_score'], record['page_count'], record['word_count'], record['filename'],
+                json.dumps(record['fields'], separators=(',', ':')),
+            )
+        )
+        rowid = cursor.lastrowid
+        self._conn.executemany(
+            "INSERT INTO invoice_pages (invoice, page, text, texts, boxes) VALUES (?, ?, ?, ?, ?)",
+            [(rowid, page['page'], page['text'], page['texts'], page['boxes']) for page in record['pages']]
+        )
+        if self.full_text:
+            self._conn.execute("INSERT INTO invoice_text (rowid, body) VALUES (?, ?)", (rowid, record['body']))
+
+    def _delete(self, rowid):
+        pages = self._conn.execute(
+            "SELECT text FROM invoice_pages WHERE invoice = ? ORDER BY page", (rowid,)
+        ).fetchall()
+        if self.full_text:
+            # A contentless FTS row is removed by replaying the text it indexed
+            body = '\n'.join(zlib.decompress(text).decode('utf-8') for (text,) in pages)
+            self._conn.execute(
+                "INSERT INTO invoice_text (invoice_text, rowid, body) VALUES ('delete', ?, ?)", (rowid, body)
+            )
+        self._conn.execute("DELETE FROM invoice_pages WHERE invoice = ?", (rowid,))
+        self._conn.execute("DELETE FROM invoices WHERE id = ?", (rowid,))
+
+    def get(self, invoice_id, include_segments=False):
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT id, {', '.join(_SUMMARY_COLUMNS)} FROM invoices WHERE invoice_id = ?", (invoice_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            columns = "page, text, texts, boxes" if include_segments else "page, text"
+            pages = self._conn.execute(
+                f"SELECT {columns} FROM invoice_pages WHERE invoice = ? ORDER BY page", (row[0],)
+            ).fetchall()
+        item = self._summary(row[1:])
+        names = ('page', 'text', 'texts', 'boxes')
+        item['pages'] = _decode_pages([dict(zip(names, page)) for page in pages], include_segments)
+        return item
+
+    @staticmethod
+    def _summary(row):
+        item = dict(zip(_SUMMARY_COLUMNS, row))
+        item['fields'] = json.loads(item['fields'])
+        return item
+
+    def query(self, limit=None, cursor=None, **filters):
+        limit = _page_size(limit)
+        sql, params, order = self._select(cursor, **filters)
+        with self._lock:
+            rows = self._conn.execute(sql, params + [limit + 1]).fetchall()
+
+        items = [self._summary(row[1:]) for row in rows[:limit]]
+        next_cursor = None
+        if len(rows) > limit:
+            last_id = rows[limit - 1][0]
+            if order == 'text':
+                next_cursor = encode_cursor([order, last_id])
+            else:
+                next_cursor = encode_cursor([order, items[-1][_SQLITE_ORDERS[order]], last_id])
+        return {'items': items, 'next_cursor': next_cursor}
+
+    def explain(self, cursor=None, **filters):
+        """EXPLAIN QUERY PLAN details for a query - to check it runs off an index"""
+        sql, params, _ = self._select(cursor, **filters)
+        with self._lock:
+            return [row[-1] for row in self._conn.execute("EXPLAIN QUERY PLAN " + sql, params + [1])]
+
+    def _select(self, cursor=None, vendor=None, date_from=None, date_to=None, min_total=None,
+                max_total=None, text=None):
+        """(sql, params, order) for a filtered listing; LIMIT is the last parameter"""
+        where, params = [], []
+        if text:
+            if not self.full_text:
+                raise ValueError("Full-text search is not available (SQLite without FTS5)")
+            order = 'text'
+            source = "invoice_text JOIN invoices ON invoices.id = invoice_text.rowid"
+            where.append("invoice_text MATCH ?")
+            params.append(_fts_query(text))
+        else:
+            source = "invoices"
+            if vendor:
+                order = 'vendor'
+            elif date_from or date_to:
+                order = 'date'
+            elif min_total is not None or max_total is not None:
+                order = 'total'
+            else:
+                order = 'created'
+
+        # The leading filter is the index prefix; the rest narrow it down
+        if vendor:
+            where.append("invoices.vendor_key = ?")
+            params.append(vendor_key(vendor))
+        if date_from:
+            where.append("invoices.invoice_date >= ?")
+            params.append(date_from)
+        if date_to:
+            where.append("invoices.invoice_date <= ?")
+            params.append(date_to)
+        if min_total is not None:
+            where.append("invoices.total >= ?")
+            params.append(min_total)
+        if max_total is not None:
+            where.append("invoices.total <= ?")
+            params.append(max_total)
+
+        if order == 'text':
+            # FTS5 returns rowids in order, newest (highest) first
+            order_by = "invoice_text.rowid DESC"
+            if cursor:
+                where.append("invoice_text.rowid < ?")
+                params.append(self._cursor(cursor, order)[0])
+        else:
+            column = f"invoices.{_SQLITE_ORDERS[order]}"
+            order_by = f"{column} DESC, invoices.id DESC"
+            if cursor:
+                value, last_id = self._cursor(cursor, order)
+                # Spelled out rather than as a row value so SQLite can
+                # seek the index to the cursor after the equality prefix
+                where.append(f"{column} <= ? AND ({column} < ? OR invoices.id < ?)")
+                params.extend([value, value, last_id])
+
+        sql = (
+            f"SELECT invoices.id, {', '.join('invoices.' + c for c in _SUMMARY_COLUMNS)} FROM {source}"
+            + (f" WHERE {' AND '.join(where)}" if where else "")
+            + f" ORDER BY {order_by} LIMIT ?"
+        )
+        return sql, params, order
+
+    @staticmethod
+    def _cursor(cursor, order):
+        values = decode_cursor(cursor)
+        if not values or values[0] != order:
+            raise ValueError("Cursor does not belong to this query")
+        return values[1:]
+
+
+def _fts_query(text):
+    """Every word as a quoted FTS5 term, so user input is never parsed as syntax"""
+    terms = ['"' + term.replace('"', '""') + '"' for term in text.split()]
+    if not terms:
+        raise ValueError("Empty search text")
+    return ' '.join(terms)
+
+
+# --- DynamoDB -------------------------------------------------------------
+
+# Global secondary indexes (see template.yaml). The constant recordType hash
+# key puts every invoice in one ordered index partition for the listings.
+# That partition is the ceiling: DynamoDB serves one partition key at about
+# 1,000 WCU and 3,000 RCU a second, and a throttled GSI throttles the base
+# table's writes with it. Each stored result costs byCreated, byDate and
+# byTotal one projected summary write (~1 WCU) apiece, so the store tops out
+# near 1,000 results a second - well above what the Vision quota lets the
+# upload path produce. Past that, shard recordType (e.g. by month) and merge
+# the shards per page.
+_DYNAMODB_INDEXES = {
+    'created': ('byCreated', 'recordType', 'createdAt'),
+    'vendor': ('byVendor', 'vendorKey', 'createdAt'),
+    'date': ('byDate', 'recordType', 'invoiceDate'),
+    'total': ('byTotal', 'recordType', 'total'),
+}
+RECORD_TYPE = 'invoice'
+
+_DYNAMODB_ATTRIBUTES = {
+    'invoice_id': 'invoiceId', 'created_at': 'createdAt', 'vendor': 'vendor', 'vendor_key': 'vendorKey',
+    'invoice_number': 'invoiceNumber', 'invoice_date': 'invoiceDate', 'total': 'total',
+    'currency': 'currency', 'accuracy_score': 'accuracyScore', 'page_count': 'pageCount',
+    'word_count': 'wordCount', 'filename': 'filename', 'fields': 'fields',
+}
+# Cursor keys that DynamoDB expects back as numbers
+_NUMERIC_KEYS = ('createdAt', 'total')
+
+
+class DynamoDBResultsBackend:
+    """InvoiceResults table with one GSI per listing order; no full-text search"""
+
+    def __init__(self, table):
+        self.table = table
+
+    def put_many(self, records):
+        with self.table.batch_writer() as batch:
+            for record in records:
+                batch.put_item(Item=self._item(record))
+
+    def _item(self, record):
+        item = {'recordType': RECORD_TYPE}
+        for name, attribute in _DYNAMODB_ATTRIBUTES.items():
+            value = record[name]
+            if value is None:
+                # GSIs are sparse: an invoice without a total is simply not in byTotal
+                continue
+            if name == 'fields':
+                value = json.dumps(value, separators=(',', ':'))
+            elif isinstance(value, float):
+                value = Decimal(str(value))
+            item[attribute] = value
+        pages = [
+            {'page': page['page'], 'text': page['text'], 'texts': page['texts'], 'boxes': page['boxes']}
+            for page in record['pages']
+        ]
+        size = sum(len(page['text']) + len(page['texts']) + len(page['boxes']) for page in pages)
+        if size > DYNAMODB_MAX_ITEM_BYTES:
+            logger.warning("Result too large for DynamoDB, word boxes not stored", extra=fields(
+                invoice_id=record['invoice_id'], bytes=size
+            ))
+            pages = [{'page': page['page'], 'text': page['text']} for page in pages]
+        item['pages'] = pages
+        return item
+
+    def get(self, invoice_id, include_segments=False):
+        found = self.table.get_item(Key={'invoiceId': invoice_id}).get('Item')
+        if found is None:
+            return None
+        item = self._summary(found)
+        pages = [
+            {name: _binary(value) if name != 'page' else int(value) for name, value in page.items()}
+            for page in found.get('pages', [])
+        ]
+        include_segments = include_segments and all('boxes' in page for page in pages)
+        item['pages'] = _decode_pages(pages, include_segments)
+        return item
+
+    @staticmethod
+    def _summary(found):
+        item = {}
+        for name, attribute in _DYNAMODB_ATTRIBUTES.items():
+            value = found.get(attribute)
+            if isinstance(value, Decimal):
+                value = float(value) if name in ('total', 'accuracy_score') else int(value)
+            item[name] = value
+        item['fields'] = json.loads(item['fields']) if item['fields'] else {}
+        return item
+
+    def query(self, vendor=None, date_from=None, date_to=None, min_total=None, max_total=None,
+              text=None, limit=None, cursor=None):
+        if text:
+            raise ValueError("Full-text search needs RESULTS_STORE_BACKEND=sqlite")
+        from boto3.dynamodb.conditions import Attr, Key
+
+        if vendor:
+            order = 'vendor'
+        elif date_from or date_to:
+            order = 'date'
+        elif min_total is not None or max_total is not None:
+            order = 'total'
+        else:
+            order = 'created'
+        index_name, hash_key, range_key = _DYNAMODB_INDEXES[order]
+
+        key_condition = Key(hash_key).eq(vendor_key(vendor) if order == 'vendor' else RECORD_TYPE)
+        ranges = {
+            'invoiceDate': (date_from, date_to),
+            'total': (
+                None if min_total is None else Decimal(str(min_total)),
+                None if max_total is None else Decimal(str(max_total)),
+            ),
+        }
+        filter_expression = None
+        for attribute, (low, high) in ranges.items():
+            condition = None
+            if low is not None and high is not None:
+                condition = Key(attribute).between(low, high) if attribute == range_key else Attr(attribute).between(low, high)
+            elif low is not None:
+                condition = Key(attribute).gte(low) if attribute == range_key else Attr(attribute).gte(low)
+            elif high is not None:
+                condition = Key(attribute).lte(high) if attribute == range_key else Attr(attribute).lte(high)
+            if condition is None:
+                continue
+            if attribute == range_key:
+                key_condition = key_condition & condition
+            else:
+                filter_expression = condition if filter_expression is None else filter_expression & condition
+
+        page_size = _page_size(limit)
+        kwargs = {
+            'IndexName': index_name,
+            'KeyConditionExpression': key_condition,
+            'ScanIndexForward': False,
+        }
+        if filter_expression is not None:
+            kwargs['FilterExpression'] = filter_expression
+        if cursor:
+            values = decode_cursor(cursor)
+            if not values or values[0] != order:
+                raise ValueError("Cursor does not belong to this query")
+            kwargs['ExclusiveStartKey'] = {
+                name: Decimal(value) if name in _NUMERIC_KEYS else value for name, value in values[1].items()
+            }
+        # Limit caps the items read, before FilterExpression drops any, so
+        # one Query can come back short; keep reading until the page plus
+        # one look-ahead item is filled or the index runs out
+        items = []
+        while True:
+            kwargs['Limit'] = page_size + 1 - len(items)
+            response = self.table.query(**kwargs)
+            items.extend(response.get('Items', []))
+            last_key = response.get('LastEvaluatedKey')
+            if len(items) > page_size or not last_key:
+                break
+            kwargs['ExclusiveStartKey'] = last_key
+
+        next_cursor = None
+        if len(items) > page_size:
+            items = items[:page_size]
+            # Resume after the last item returned, not after the last one read
+            last_key = {name: items[-1][name] for name in ('invoiceId', hash_key, range_key)}
+            next_cursor = encode_cursor([order, {
+                name: str(value) if isinstance(value, Decimal) else value for name, value in last_key.items()
+            }])
+        return {'items': [self._summary(item) for item in items], 'next_cursor': next_cursor}
+
+
+def _binary(value):
+    # boto3 hands binary attributes back wrapped in Binary
+    return getattr(value, 'value', value)
+
+
+# --- Front end ------------------------------------------------------------
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def _build_backend(kind):
+    if kind == 'sqlite':
+        return SQLiteResultsBackend(RESULTS_STORE_PATH)
+    if kind == 'dynamodb':
+        from aws_clients import get_table
+        table = get_table(RESULTS_TABLE_NAME)
+        if table is None:
+            raise RuntimeError(f"DynamoDB table {RESULTS_TABLE_NAME} is unavailable")
+        return DynamoDBResultsBackend(table)
+    raise ValueError(f"Unknown RESULTS_STORE_BACKEND: {kind}")
+
+
+def get_results_store():
+    """Process-wide results backend configured from the environment, or None when disabled"""
+    global _store
+    if RESULTS_STORE_BACKEND == 'none':
+        return None
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = _build_backend(RESULTS_STORE_BACKEND)
+    return _store
+
+
+def save_results(records):
+    """Persist records built with build_record; failures are logged, never raised"""
+    if not records:
+        return
+    try:
+        store = get_results_store()
+        if store is not None:
+            store.put_many(records)
+    except Exception as e:
+        logger.exception(f"Error storing invoice results: {e}", extra=fields(
+            invoice_ids=[record['invoice_id'] for record in records]
+        ))
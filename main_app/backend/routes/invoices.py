@@ -0,0 +1,70 @@
+import datetime
+
+from flask import Blueprint, make_response, request
+
+invoices_bp = Blueprint('invoices', __name__)
+
+
+def _json_response(payload, status=200):
+    resp = make_response(payload, status)
+    resp.headers['Access-Control-Allow-Origin'] = '*'
+    return resp
+
+
+def _date_arg(name):
+    value = request.args.get(name)
+    if not value:
+        return None
+    try:
+        return datetime.date.fromisoformat(value).isoformat()
+    except ValueError:
+        raise ValueError(f"Invalid {name} '{value}', expected YYYY-MM-DD")
+
+
+def _number_arg(name, convert=float):
+    value = request.args.get(name)
+    if value in (None, ''):
+        return None
+    try:
+        return convert(value)
+    except ValueError:
+        raise ValueError(f"Invalid {name} '{value}'")
+
+
+@invoices_bp.route('/invoices', methods=['GET'])
+def list_invoices():
+    """Stored invoices, newest first, one page at a time
+
+    Filters: vendor, date_from/date_to (invoice date), min_total/max_total
+    and q (full-text search over the extracted text). Pass the returned
+    next_cursor back as cursor for the next page.
+    """
+    from results_store import get_results_store
+    store = get_results_store()
+    if store is None:
+        return _json_response({"status": "failed", "error": "Results store is disabled"}, 404)
+    try:
+        page = store.query(
+            vendor=request.args.get('vendor') or None,
+            date_from=_date_arg('date_from'),
+            date_to=_date_arg('date_to'),
+            min_total=_number_arg('min_total'),
+            max_total=_number_arg('max_total'),
+            text=request.args.get('q') or None,
+            limit=_number_arg('limit', int),
+            cursor=request.args.get('cursor') or None,
+        )
+    except ValueError as e:
+        return _json_response({"status": "failed", "error": str(e)}, 400)
+    return _json_response({"status": "success", "invoices": page['items'], "next_cursor": page['next_cursor']})
+
+
+@invoices_bp.route('/invoices/<invoice_id>', methods=['GET'])
+def get_invoice(invoice_id):
+    """One stored invoice with its text per page; ?segments=1 adds the word boxes"""
+    from results_store import get_results_store
+    store = get_results_store()
+    invoice = store.get(invoice_id, include_segments=request.args.get('segments') == '1') if store else None
+    if invoice is None:
+        return _json_response({"status": "failed", "error": f"Unknown invoice {invoice_id}"}, 404)
+    return _json_response({"status": "success", "invoice": invoice})
@@ -0,0 +1,22 @@
+from flask import Blueprint, make_response
+
+jobs_bp = Blueprint('jobs', __name__)
+
+
+@jobs_bp.route('/jobs/<invoice_id>', methods=['GET'])
+def get_job(invoice_id):
+    """Status of an async /receive job, with the full result once it is done"""
+    from jobs import JobsUnavailable, check_async_available, get_job_queue
+    try:
+        check_async_available()
+    except JobsUnavailable as e:
+        resp = make_response({"status": "failed", "error": str(e)}, 501)
+        resp.headers['Access-Control-Allow-Origin'] = '*'
+        return resp
+    job = get_job_queue().get(invoice_id)
+    if job is None:
+        resp = make_response({"status": "failed", "error": f"Unknown job {invoice_id}"}, 404)
+    else:
+        resp = make_response(job)
+    resp.headers['Access-Control-Allow-Origin'] = '*'
+    return resp
@@ -1,240 +1,656 @@
-from flask import Blueprint, request
-from PIL import Image, ImageDraw
+from flask import Blueprint, Response, request, stream_with_context
+from PIL import Image, ImageDraw, ImageOps
 from dotenv import load_dotenv
 load_dotenv()
 import time
-import re
+import io
+import os
 import uuid
-import boto3
 import json
-from botocore.exceptions import ClientError
+import zipfile
+from collections import deque
+from decimal import Decimal
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dashboard import broadcast_metrics_to_all, get_metrics_table
+from field_extraction import KeywordMatcher, extract_fields, merge_fields, word_text
+from ingest import MAX_UPLOAD_BYTES, MULTIPART_OVERHEAD_BYTES, UploadRejected, read_upload, sniff
+from jobs import JobsUnavailable
+from metrics_aggregate import record_samples
+from ocr_cache import content_hash, get_ocr_cache
+from pdf_pages import PDFDocument
+from preprocess import prepare_for_ocr, upright_size
+from results_store import build_record, save_results
+from scoring import merge_quality, score_response
+from segments import SegmentArray
+from table_extraction import extract_line_items
+from telemetry import current_timings, fields, get_logger, propagate, span, start_timings
+from vision_client import get_vision_client, get_cache_stats, invalidate_vision_client
+from vision_guard import VisionUnavailable, get_vision_guard, get_vision_stats
 
 upload_bp = Blueprint('upload', __name__)
+logger = get_logger('upload')
 
-def get_secret():
-    secret_name = "google_ocr"
-    region_name = "us-east-1"
+# Max Vision calls in flight at once - keep this under the project quota
+VISION_MAX_CONCURRENCY = int(os.environ.get('VISION_MAX_CONCURRENCY', '4'))
+# Images per batch_annotate_images call (Vision accepts at most 16)
+VISION_BATCH_SIZE = max(1, min(int(os.environ.get('VISION_BATCH_SIZE', '16')), 16))
+# Upper bound on images accepted by one /receive/batch request
+BATCH_MAX_FILES = int(os.environ.get('BATCH_MAX_FILES', '500'))
+# Upper bound on the bytes of one /receive/batch request, and on everything
+# its zip archives decompress to (Lambda has 256 MB in all)
+BATCH_MAX_BYTES = int(os.environ.get('BATCH_MAX_BYTES', str(64 * 1024 * 1024)))
 
-    # Create a Secrets Manager client
-    session = boto3.session.Session()
-    client = session.client(
-        service_name='secretsmanager',
-        region_name=region_name
-    )
+# Annotated image rendering: none | thumbnail | full
+RENDER_MODES = ('none', 'thumbnail', 'full')
+RENDER_DEFAULT = os.environ.get('RENDER_DEFAULT', 'full')
+THUMBNAIL_MAX_EDGE = int(os.environ.get('THUMBNAIL_MAX_EDGE', '512'))
 
-    try:
-        get_secret_value_response = client.get_secret_value(
-            SecretId=secret_name
-        )
-    except ClientError as e:
-        # For a list of exceptions thrown, see
-        # https://docs.aws.amazon.com/secretsmanager/latest/apireference/API_GetSecretValue.html
-        raise e
+# quality dict keys -> InvoiceMetrics attribute names
+_QUALITY_ATTRIBUTES = {
+    'source': 'source', 'word_confidence': 'wordConfidence', 'block_confidence': 'blockConfidence',
+    'low_confidence_share': 'lowConfidenceShare', 'words': 'words', 'preprocess_scale': 'preprocessScale',
+}
 
-    secret = get_secret_value_response['SecretString']
-    return json.loads(secret)
+def _metrics_item(invoice_id, processing_time_ms, accuracy_score, timings=None, quality=None, cache_hit=None):
+    item = {
+        'invoiceId': invoice_id,
+        'timestamp': int(time.time() * 1000),  # milliseconds since epoch
+        'latency': processing_time_ms,
+        'accuracy': accuracy_score,
+        'processedAt': time.strftime('%Y-%m-%d %H:%M:%S UTC')
+    }
+    if timings:
+        # Per-stage breakdown of latency, so a regression can be pinned to a stage
+        item['timings'] = timings
+    if quality:
+        # What the score came from and under which conditions (downscaling,
+        # cache), next to the timings, so quality/latency tradeoffs can be queried
+        item['quality'] = {
+            attribute: Decimal(str(quality[name])) if isinstance(quality[name], float) else quality[name]
+            for name, attribute in _QUALITY_ATTRIBUTES.items() if quality.get(name) is not None
+        }
+    if cache_hit is not None:
+        item['cacheHit'] = cache_hit
+    return item
 
-def store_metrics(invoice_id, processing_time_ms, accuracy_score=95):
+def store_metrics(invoice_id, processing_time_ms, accuracy_score=95, timings=None, quality=None, cache_hit=None):
     """Store processing metrics in DynamoDB for dashboard"""
-    # Import here to avoid circular imports
-    from app import metrics_table
+    metrics_table = get_metrics_table()
     
     if not metrics_table:
-        print("Metrics table not available, skipping metrics storage")
+        logger.warning("Metrics table not available, skipping metrics storage")
         return
     
     try:
-        metrics_table.put_item(
-            Item={
-                'invoiceId': invoice_id,
-                'timestamp': int(time.time() * 1000),  # milliseconds since epoch
-                'latency': processing_time_ms,
-                'accuracy': accuracy_score,
-                'processedAt': time.strftime('%Y-%m-%d %H:%M:%S UTC')
-            }
+        # The row first, then the dashboard aggregate and time buckets in step with it
+        record_samples(
+            metrics_table, [(processing_time_ms, accuracy_score)],
+            items=[_metrics_item(invoice_id, processing_time_ms, accuracy_score, timings, quality, cache_hit)]
         )
-        print(f"Stored metrics for invoice {invoice_id}: {processing_time_ms}ms, {accuracy_score}%")
+        logger.info("Stored metrics", extra=fields(
+            invoice_id=invoice_id, processing_time_ms=processing_time_ms, accuracy_score=accuracy_score
+        ))
     except Exception as e:
-        print(f"Error storing metrics: {e}")
+        logger.error(f"Error storing metrics: {e}", extra=fields(invoice_id=invoice_id))
+
+def store_metrics_batch(records):
+    """Store (invoice_id, processing_time_ms, accuracy_score, quality, cache_hit) rows with one batch writer"""
+    metrics_table = get_metrics_table()
+    
+    if not metrics_table:
+        logger.warning("Metrics table not available, skipping metrics storage")
+        return
+    if not records:
+        return
+    
+    try:
+        # One aggregate (and one per time bucket) update for the whole batch
+        record_samples(
+            metrics_table,
+            [(latency, accuracy) for _, latency, accuracy, _, _ in records],
+            items=[
+                _metrics_item(invoice_id, latency, accuracy, None, quality, cache_hit)
+                for invoice_id, latency, accuracy, quality, cache_hit in records
+            ]
+        )
+        logger.info("Stored batch metrics", extra=fields(invoices=len(records)))
+    except Exception as e:
+        logger.error(f"Error storing batch metrics: {e}")
+
+# Common invoice words; '$' counts as one more keyword
+_invoice_keywords = KeywordMatcher(['invoice', 'total', 'amount', 'date', 'tax', 'subtotal'])
+
 
 def calculate_accuracy_score(detected_text):
-    """Calculate accuracy score based on detected text quality"""
+    """Text length and keyword heuristic, for responses without Vision confidences"""
     if not detected_text:
         return 0
     
     # Simple heuristic: longer text with common invoice keywords = higher accuracy
-    text_lower = detected_text.lower()
-    invoice_keywords = ['invoice', 'total', 'amount', 'date', 'tax', 'subtotal', '$']
-    keyword_count = sum(1 for keyword in invoice_keywords if keyword in text_lower)
+    # (all keywords in one pass over the words)
+    found = _invoice_keywords.found(word_text(detected_text.split()))
+    keyword_count = len(found) + ('$' in detected_text)
     
     # Base score on text length and keyword presence
     length_score = min(len(detected_text) / 1000 * 50, 50)  # Up to 50% for text length
-    keyword_score = (keyword_count / len(invoice_keywords)) * 50  # Up to 50% for keywords
+    keyword_score = (keyword_count / (len(_invoice_keywords.keywords) + 1)) * 50  # Up to 50% for keywords
     
     total_score = length_score + keyword_score
     return min(int(total_score), 95)  # Cap at 95%
 
 
-def detect_text(path):
-    """Detects text in the file."""
+def ocr_quality(response, detected_text, segments, prepared):
+    """Quality dict for one Vision response; quality['score'] is the accuracy score
+
+    Vision's word and block confidences when the response has them (see
+    scoring.py), else calculate_accuracy_score. preprocess_scale records
+    how far the image was downscaled before it was sent.
+    """
+    with span('score'):
+        quality = score_response(response) or {
+            'source': 'heuristic', 'score': calculate_accuracy_score(detected_text), 'words': len(segments)
+        }
+    quality['preprocess_scale'] = round(min(prepared.scale_x, prepared.scale_y), 4)
+    return quality
+
+
+def _text_detection_request(content):
     from google.cloud import vision
-    from google.oauth2 import service_account
+    return {
+        'image': vision.Image(content=content),
+        # Same words as TEXT_DETECTION, plus the per-word and per-block
+        # confidences the accuracy score is built from
+        'features': [{'type_': vision.Feature.Type.DOCUMENT_TEXT_DETECTION}]
+    }
 
-    # Get credentials from AWS Secrets Manager
-    credentials_info = get_secret()
-    credentials = service_account.Credentials.from_service_account_info(credentials_info)
-    client = vision.ImageAnnotatorClient(credentials=credentials)
 
-    with open(path, "rb") as image_file:
-        content = image_file.read()
+def _call_vision(call, *args, images=1, **kwargs):
+    """call(*args, **kwargs) through the rate limiter, retries and circuit breaker"""
+    from google.api_core.exceptions import Unauthenticated
+    try:
+        return get_vision_guard().call(call, *args, images=images, **kwargs)
+    except Unauthenticated:
+        # Rotated or revoked key - rebuild from the secret on the next call
+        invalidate_vision_client()
+        raise
 
-    image = vision.Image(content=content)
 
-    response = client.annotate_image({
-        'image': image,
-        'features': [{'type_': vision.Feature.Type.TEXT_DETECTION}]
-    })
-    texts = response.text_annotations ## 0th index has the whole text detection as a string 
-    ##print("Texts:")
-    
-    
-    
+def _raise_for_vision_error(response):
+    if response.error.message:
+        raise Exception(
+            "{}\nFor more info on error messages, check: "
+            "https://cloud.google.com/apis/design/errors".format(response.error.message)
+        )
+
+
+def parse_text_annotations(texts):
+    """Split Vision text_annotations into the full text and a SegmentArray of words"""
     # Get the complete text from the first annotation (index 0)
     detected_text = texts[0].description if texts else ""
     
-    # Extract individual text segments with bounding boxes
-    text_segments = []
-    for text in texts[1:]:  # Skip first one (full text), process individual words
-        vertices = text.bounding_poly.vertices
-        bounding_box = {
-            "x1": vertices[0].x, "y1": vertices[0].y,  # Top-left
-            "x2": vertices[1].x, "y2": vertices[1].y,  # Top-right
-            "x3": vertices[2].x, "y3": vertices[2].y,  # Bottom-right
-            "x4": vertices[3].x, "y4": vertices[3].y   # Bottom-left
-        }
-        text_segments.append({
-            "text": text.description,
-            "bounding_box": bounding_box
-        })
-    
-    #regex for pattern matching 
-    pattern = r'\d+\.?\d+'  # this matches all digits
-    matches = re.findall(pattern, detected_text)  # returns list of all matches
-    print("the matches are : ",matches)
+    # One pass over the word annotations (index 1 onwards) into a packed array
+    return detected_text, SegmentArray.from_annotations(texts)
+
+
+def _cached_ocr(digest):
+    """(detected_text, SegmentArray, quality) from the OCR cache, or None"""
+    cache = get_ocr_cache()
+    if not cache:
+        return None
+    cached = cache.get(digest)
+    if cached is None:
+        return None
+    logger.info("OCR cache hit", extra=fields(digest=digest[:12], **cache.stats()))
+    return cached["detected_text"], SegmentArray.from_compact(cached["segments"]), cached["quality"]
+
+
+def _store_ocr(digest, detected_text, segments, quality):
+    cache = get_ocr_cache()
+    if cache:
+        cache.set(digest, {"detected_text": detected_text, "segments": segments.to_compact(), "quality": quality})
+
+
+def detect_text(content, render=RENDER_DEFAULT, digest=None):
+    """Detects text in an image, given its bytes (or a path to read them from).
+
+    digest is the content's SHA-256 when the caller already has it (the
+    streaming upload reader computes it on the way in).
+    """
+    if isinstance(content, str):
+        with open(content, "rb") as image_file:
+            content = image_file.read()
+
+    # Same bytes as an earlier upload - reuse its OCR output, skip Vision
+    with span('cache_lookup'):
+        digest = digest or content_hash(content)
+        cached = _cached_ocr(digest)
+    if cached is not None:
+        detected_text, segments, quality = cached
+        output_filename = _render_to_tmp(content, segments.polygons(), render)
+        return detected_text, segments, output_filename, True, quality
+
+    # Credentials and client are cached across warm invocations
+    with span('vision_client'):
+        client = get_vision_client()
+    logger.debug("Vision client cache stats", extra=fields(**get_cache_stats()))
+
+    # Oriented, downscaled grayscale JPEG - a fraction of the upload size
+    with span('preprocess'):
+        prepared = prepare_for_ocr(content)
+    if prepared.changed:
+        prepared.log()
     
+    # Times itself: vision_queue (rate limit / free slot) and vision (the call)
+    response = _call_vision(client.annotate_image, _text_detection_request(prepared.content))
+    logger.debug("Vision call stats", extra=fields(**get_vision_stats()))
+    _raise_for_vision_error(response)
+    texts = response.text_annotations ## 0th index has the whole text detection as a string 
     
-    # Print bounding boxes for debugging (optional)
-    for text in texts[1:]:  # Skip first one, process individual words for bounding boxes
-        vertices = [
-            f"({vertex.x},{vertex.y})" for vertex in text.bounding_poly.vertices
-        ]
-        print("bounds: {}".format(",".join(vertices)))
+    with span('parse'):
+        detected_text, segments = parse_text_annotations(texts)
+        segments = prepared.to_original(segments)
+    quality = ocr_quality(response, detected_text, segments, prepared)
+    with span('cache_store'):
+        _store_ocr(digest, detected_text, segments, quality)
+    logger.info("Detected words", extra=fields(words=len(segments)))
     
     # Draw boxes on the image and save it
-    output_filename = f"output_with_boxes_{int(time.time())}.jpg"
-    draw_boxes_on_image(path, texts, output_filename)
+    output_filename = _render_to_tmp(content, segments.polygons(), render)
     
-    if response.error.message:
-        raise Exception(
-            "{}\nFor more info on error messages, check: "
-            "https://cloud.google.com/apis/design/errors".format(response.error.message)
-        )
-    
-    return detected_text, text_segments, output_filename
+    return detected_text, segments, output_filename, False, quality
 
 
+def detect_text_batch(files, render=RENDER_DEFAULT):
+    """Run text detection over many (filename, bytes) pairs
 
-def draw_boxes_on_image(image_path, texts, output_filename):
-    try:
-        # Try multiple PIL opening methods
-        image = None
-        
-        # Method 1: Standard open
+    Cache hits are answered straight away. The remaining distinct images go
+    to Vision VISION_BATCH_SIZE at a time through batch_annotate_images,
+    with at most VISION_MAX_CONCURRENCY calls in flight. Yields
+    (index, result, ocr_ms) as each image completes, where result is either
+    (detected_text, segments, output_filename, cache_hit, quality) or the
+    exception raised for that image, and ocr_ms is the time spent on that
+    image itself: its preprocessing, the Vision call it went out in, and
+    its parsing and rendering (not the time it waited behind other chunks).
+    output_filename is None when render is 'none'.
+    """
+    # Group indices by content so duplicates within a batch cost one call
+    pending = {}
+    for i, (_, content) in enumerate(files):
+        start = time.perf_counter()
+        digest = content_hash(content)
+        cached = _cached_ocr(digest)
+        if cached is None:
+            pending.setdefault(digest, []).append(i)
+            continue
         try:
-            image = Image.open(image_path)
-            print("PIL Method 1 (standard) succeeded")
-        except:
-            print("PIL Method 1 failed, trying method 2")
-            
-            # Method 2: Force specific format
+            detected_text, segments, quality = cached
+            output_filename = _render_to_tmp(content, segments.polygons(), render)
+            yield i, (detected_text, segments, output_filename, True, quality), _elapsed_ms(start)
+        except Exception as e:
+            yield i, e, _elapsed_ms(start)
+
+    if not pending:
+        return
+
+    client = get_vision_client()
+    logger.debug("Vision client cache stats", extra=fields(**get_cache_stats()))
+
+    def annotate_chunk(digests):
+        results = []
+        # An upload that can't be decoded fails on its own, not the whole chunk
+        ready = []
+        prepared = []
+        prepare_ms = {}
+        for digest in digests:
+            start = time.perf_counter()
+            try:
+                image = prepare_for_ocr(files[pending[digest][0]][1])
+            except Exception as e:
+                results.extend((i, e, _elapsed_ms(start)) for i in pending[digest])
+                continue
+            if image.changed:
+                image.log()
+            prepare_ms[digest] = _elapsed_ms(start)
+            ready.append(digest)
+            prepared.append(image)
+        if not prepared:
+            return results
+        requests = [_text_detection_request(image.content) for image in prepared]
+        start = time.perf_counter()
+        try:
+            batch_response = _call_vision(client.batch_annotate_images, requests=requests, images=len(requests))
+        except Exception as e:
+            # The whole Vision call failed - every image sent in it failed
+            for digest in ready:
+                results.extend((i, e, prepare_ms[digest] + _elapsed_ms(start)) for i in pending[digest])
+            return results
+        # Every image in the call waited for all of it
+        call_ms = _elapsed_ms(start)
+        for digest, image, response in zip(ready, prepared, batch_response.responses):
+            start = time.perf_counter()
+            spent = prepare_ms[digest] + call_ms
             try:
-                with open(image_path, 'rb') as f:
-                    image = Image.open(f)
-                    image = image.convert('RGB')  # Force RGB mode
-                print("PIL Method 2 (RGB convert) succeeded")
-            except:
-                print("PIL Method 2 failed, trying method 3")
-                
-                # Method 3: Read raw bytes and recreate
+                _raise_for_vision_error(response)
+                detected_text, segments = parse_text_annotations(response.text_annotations)
+                segments = image.to_original(segments)
+                quality = ocr_quality(response, detected_text, segments, image)
+                _store_ocr(digest, detected_text, segments, quality)
+                polygons = segments.polygons()
+            except Exception as e:
+                results.extend((i, e, spent + _elapsed_ms(start)) for i in pending[digest])
+                continue
+            spent += _elapsed_ms(start)
+            for i in pending[digest]:
+                start = time.perf_counter()
                 try:
-                    import io
-                    with open(image_path, 'rb') as f:
-                        img_bytes = f.read()
-                    image = Image.open(io.BytesIO(img_bytes))
-                    image = image.convert('RGB')
-                    print("PIL Method 3 (BytesIO) succeeded")
+                    output_filename = _render_to_tmp(files[i][1], polygons, render)
+                    result = (detected_text, segments, output_filename, False, quality)
                 except Exception as e:
-                    print(f"All PIL methods failed: {e}")
-                    raise
-        
-        if image is None:
-            raise Exception("Could not open image with any method")
+                    result = e
+                results.append((i, result, spent + _elapsed_ms(start)))
+        return results
+
+    digests = list(pending)
+    chunks = [
+        digests[start:start + VISION_BATCH_SIZE]
+        for start in range(0, len(digests), VISION_BATCH_SIZE)
+    ]
+    with ThreadPoolExecutor(max_workers=VISION_MAX_CONCURRENCY) as pool:
+        futures = {pool.submit(annotate_chunk, chunk): chunk for chunk in chunks}
+        for future in as_completed(futures):
+            try:
+                yield from future.result()
+            except Exception as e:
+                # Anything annotate_chunk didn't catch fails the whole chunk
+                for digest in futures[future]:
+                    for i in pending[digest]:
+                        yield i, e, 0.0
+
+
+
+def _elapsed_ms(start):
+    return (time.perf_counter() - start) * 1000
+
+
+def detect_pdf_pages(document, render=RENDER_DEFAULT):
+    """OCR the pages of a PDFDocument, yielding (page_index, result) in page order
+
+    A page is only rasterized once one of the VISION_MAX_CONCURRENCY slots
+    is free, and its JPEG is dropped as soon as its result is yielded, so at
+    most that many pages are held in memory whatever the document length.
+    result is the detect_text tuple or the exception raised for that page.
+    """
+    with ThreadPoolExecutor(max_workers=VISION_MAX_CONCURRENCY) as pool:
+        in_flight = deque()
+        next_page = 0
+        while next_page < document.page_count or in_flight:
+            while next_page < document.page_count and len(in_flight) < VISION_MAX_CONCURRENCY:
+                # Rasterize on this thread only - pdfium is not thread safe
+                try:
+                    with span('rasterize'):
+                        page = document.render_page(next_page)
+                    in_flight.append((next_page, pool.submit(propagate(detect_text), page, render)))
+                except Exception as e:
+                    in_flight.append((next_page, e))
+                next_page += 1
             
-        # Draw bounding boxes
-        draw = ImageDraw.Draw(image)
-        for text in texts:
-            vertices = [(vertex.x, vertex.y) for vertex in text.bounding_poly.vertices]
-            if len(vertices) == 4:
-                draw.line(vertices + [vertices[0]], width=2, fill='red')
+            index, pending = in_flight.popleft()
+            if isinstance(pending, Exception):
+                yield index, pending
+                continue
+            try:
+                yield index, pending.result()
+            except Exception as e:
+                yield index, e
+
+
+def open_image(content):
+    """Open upload bytes with PIL without copying them (BytesIO shares the buffer)"""
+    return Image.open(io.BytesIO(content))
+
+
+def render_overlay(content, polygons, render='full'):
+    """Draw the word boxes over the image and return the result as JPEG bytes
+
+    The image is drawn upright (EXIF orientation applied), which is the frame
+    the word boxes are in. 'thumbnail' asks the JPEG decoder for a
+    reduced-scale decode (draft) and shrinks to THUMBNAIL_MAX_EDGE, so large
+    scans never get decoded at full resolution.
+    """
+    image = open_image(content)
+    original_width, original_height = upright_size(image)
+    width = 2
+    quality = 95
+    if render == 'thumbnail':
+        image.draft('RGB', (THUMBNAIL_MAX_EDGE, THUMBNAIL_MAX_EDGE))
+    image = ImageOps.exif_transpose(image)
+    if render == 'thumbnail':
+        image.thumbnail((THUMBNAIL_MAX_EDGE, THUMBNAIL_MAX_EDGE))
+        scale_x = image.width / original_width
+        scale_y = image.height / original_height
+        polygons = [[(x * scale_x, y * scale_y) for x, y in vertices] for vertices in polygons]
+        width = 1
+        quality = 80
+    
+    # RGB so the boxes stay red on grayscale scans and PDF pages (and JPEG
+    # output needs RGB/L - palette, alpha and CMYK scans get converted)
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+        
+    # Draw bounding boxes
+    draw = ImageDraw.Draw(image)
+    for vertices in polygons:
+        if len(vertices) == 4:
+            draw.line(vertices + [vertices[0]], width=width, fill='red')
+    
+    output = io.BytesIO()
+    image.save(output, 'JPEG', quality=quality)  # Force JPEG format
+    return output.getvalue()
+
+
+def draw_boxes_on_image(content, polygons, output_filename, render='full'):
+    try:
+        jpeg = render_overlay(content, polygons, render)
         
         # Save the image with boxes in tmp directory for Lambda
         output_path = f"/tmp/{output_filename}"
-        image.save(output_path, 'JPEG', quality=95)  # Force JPEG format
-        print(f"Image saved to: {output_path}")
+        with open(output_path, 'wb') as f:
+            f.write(jpeg)
+        logger.debug("Image saved", extra=fields(path=output_path))
         
     except Exception as e:
-        print(f"draw_boxes_on_image error: {e}")
+        logger.error(f"draw_boxes_on_image error: {e}")
         raise
 
+
+def _render_to_tmp(content, polygons, render):
+    """Render per the requested mode; returns the output filename or None"""
+    if render == 'none':
+        return None
+    output_filename = f"output_with_boxes_{uuid.uuid4().hex}.jpg"
+    with span('render'):
+        draw_boxes_on_image(content, polygons, output_filename, render)
+    return output_filename
+
 ##pip install flask-cors. this is to let 2 ports to talk to each other 
 
 
 
-def post_process(text_segments):
-    #this is where we will do the post processing of the detected text
-    #we will use the detected text to extract the data we need
-    #we will return the data we need
+def post_process(segments):
+    """Extract the line-item table and the typed header fields from the word boxes
+
+    Line items carry price, quantity and total; the fields are the invoice
+    number, dates, subtotal, tax, total and currency.
+    """
+    result = extract_line_items(segments)
+    result["fields"] = extract_fields(segments)
+    return result
+
+def new_invoice_id():
+    return f"inv_{uuid.uuid4().hex[:8]}_{int(time.time())}"
+
+
+def process_invoice(content, render=RENDER_DEFAULT, start_time=None, invoice_id=None, digest=None, filename=None):
+    """OCR one image, record its metrics and return the /receive response body"""
+    if start_time is None:
+        start_time = time.time()
+    timings = current_timings() or start_timings()
     
-    word_names = ["Price","Quantity","Total"]
-    headers = []
+    detected_text, segments, output_filename, cache_hit, quality = detect_text(content, render, digest)
+    logger.debug("Detection completed successfully")
+    with span('post_process'):
+        table = post_process(segments)
     
-    # Find header elements
-    for element in text_segments:
-        if element["text"] in word_names:
-            headers.append(element)
+    # Calculate processing time and accuracy for metrics
+    processing_time = int((time.time() - start_time) * 1000)  # Convert to milliseconds
+    accuracy_score = quality['score']
     
-    # Find column-aligned elements for each header
-    columns = {}
-    for header in headers:
-        column_name = header["text"]
-        columns[column_name] = [header]
-        
-        header_x1 = header["bounding_box"]["x1"]
-        header_x2 = header["bounding_box"]["x2"]
+    # Generate unique invoice ID and store metrics
+    invoice_id = invoice_id or new_invoice_id()
+    # Keep the text, boxes and fields so the invoice can be queried later
+    with span('store_result'):
+        save_results([build_record(invoice_id, [(1, detected_text, segments)], table["fields"], accuracy_score, filename)])
+    with span('store_metrics'):
+        store_metrics(invoice_id, processing_time, accuracy_score, timings.as_dict(), quality, cache_hit)
+    
+    # Broadcast updated metrics to connected dashboards
+    with span('broadcast'):
+        broadcast_metrics_to_all()
+    logger.info("Invoice processed", extra=fields(
+        invoice_id=invoice_id, processing_time_ms=processing_time, cache_hit=cache_hit, timings=timings.as_dict()
+    ))
+
+    ## processing text 
+    return {
+        "status": "success", 
+        "image_url": f"/tmp/{output_filename}" if output_filename else None,
+        "render": render,
+        "extracted_text": detected_text,
+        "text_segments": segments.to_json(),
+        "table_columns": table["columns"],
+        "line_items": table["line_items"],
+        "fields": table["fields"],
+        "processing_time_ms": processing_time,
+        "accuracy_score": accuracy_score,
+        "quality": quality,
+        "invoice_id": invoice_id,
+        "cache_hit": cache_hit,
+        "timings": timings.as_dict()
+    }
+
+def process_pdf(document, render=RENDER_DEFAULT, start_time=None, invoice_id=None, filename=None):
+    """OCR a PDF page by page, yielding one dict per page then a summary
+
+    Pages come out in order as soon as they (and every page before them)
+    are done. The whole document counts as one invoice in the metrics.
+    """
+    if start_time is None:
+        start_time = time.time()
+    timings = current_timings() or start_timings()
+    invoice_id = invoice_id or new_invoice_id()
+    
+    accuracy_scores = []
+    page_quality = []
+    page_cache_hits = []
+    # Successful pages as (page number, text, segments), and their fields
+    stored_pages = []
+    page_fields = []
+    for index, outcome in detect_pdf_pages(document, render):
+        page_number = index + 1
+        if isinstance(outcome, Exception):
+            logger.warning(f"PDF page failed: {outcome}", extra=fields(
+                invoice_id=invoice_id, page=page_number, page_count=document.page_count
+            ))
+            yield {"type": "page", "page": page_number, "status": "failed", "error": str(outcome)}
+            continue
         
-        # Find other elements that align with this header column
-        for element in text_segments:
-            if element == header:
-                continue
-                
-            elem_x1 = element["bounding_box"]["x1"]
-            elem_x2 = element["bounding_box"]["x2"]
-            
-            # Check if element aligns with header (overlap in x-range)
-            if (elem_x1 <= header_x2 and elem_x2 >= header_x1):
-                columns[column_name].append(element)
+        detected_text, segments, output_filename, cache_hit, quality = outcome
+        with span('post_process'):
+            table = post_process(segments)
+        accuracy_score = quality['score']
+        accuracy_scores.append(accuracy_score)
+        page_quality.append(quality)
+        page_cache_hits.append(cache_hit)
+        stored_pages.append((page_number, detected_text, segments))
+        page_fields.append(table["fields"])
+        yield {
+            "type": "page",
+            "page": page_number,
+            "status": "success",
+            "image_url": f"/tmp/{output_filename}" if output_filename else None,
+            "extracted_text": detected_text,
+            "text_segments": segments.to_json(),
+            "table_columns": table["columns"],
+            "line_items": table["line_items"],
+            "fields": table["fields"],
+            "processing_time_ms": int((time.time() - start_time) * 1000),
+            "accuracy_score": accuracy_score,
+            "quality": quality,
+            "cache_hit": cache_hit
+        }
     
-    return columns if columns else headers
+    processing_time = int((time.time() - start_time) * 1000)
+    # Pages weighted by their word count, so a near-empty page doesn't drag the score
+    document_quality = merge_quality(page_quality)
+    accuracy_score = document_quality['score'] if document_quality else 0
+    document_fields = merge_fields(page_fields)
+    if accuracy_scores:
+        with span('store_result'):
+            save_results([build_record(invoice_id, stored_pages, document_fields, accuracy_score, filename)])
+        with span('store_metrics'):
+            store_metrics(
+                invoice_id, processing_time, accuracy_score, timings.as_dict(), document_quality, all(page_cache_hits)
+            )
+        with span('broadcast'):
+            broadcast_metrics_to_all()
+    
+    yield {
+        "type": "summary",
+        "status": "success" if accuracy_scores else "failed",
+        "invoice_id": invoice_id,
+        "render": render,
+        "page_count": document.page_count,
+        "pages_succeeded": len(accuracy_scores),
+        "fields": document_fields,
+        "processing_time_ms": processing_time,
+        "accuracy_score": accuracy_score,
+        "quality": document_quality,
+        "timings": timings.as_dict()
+    }
+
+
+def _stream_pdf(content, render, start_time, filename=None):
+    """Chunked NDJSON response: a header line, one line per page, a summary line"""
+    # Opened up front so a broken or oversized PDF fails as a normal JSON error
+    with span('validate'):
+        document = PDFDocument(content)
+    invoice_id = new_invoice_id()
+    timings = current_timings()
+    logger.info("PDF received", extra=fields(invoice_id=invoice_id, page_count=document.page_count))
+    
+    def generate():
+        # The body is generated after the view returns - keep the request's timings
+        start_timings(timings)
+        try:
+            yield json.dumps({
+                "type": "document",
+                "invoice_id": invoice_id,
+                "page_count": document.page_count
+            }) + "\n"
+            for line in process_pdf(document, render, start_time, invoice_id, filename):
+                yield json.dumps(line) + "\n"
+        except Exception as e:
+            # Headers are already sent - report the failure in-band
+            logger.exception(f"PDF stream error: {e}", extra=fields(invoice_id=invoice_id))
+            yield json.dumps({"type": "summary", "status": "failed", "invoice_id": invoice_id, "error": str(e)}) + "\n"
+        finally:
+            document.close()
+    
+    resp = _with_cors(Response(stream_with_context(generate()), mimetype='application/x-ndjson'))
+    # Stop proxies from buffering the stream
+    resp.headers['X-Accel-Buffering'] = 'no'
+    return resp
+
 
 @upload_bp.route('/receive', methods=['GET','POST','OPTIONS'])
 def receive_image():
@@ -242,122 +658,344 @@ def receive_image():
     
     # Handle CORS preflight request - ADD THIS BLOCK
     if request.method == 'OPTIONS':
-        from flask import make_response
-        resp = make_response('')
-        resp.headers['Access-Control-Allow-Origin'] = '*'
-        resp.headers['Access-Control-Allow-Methods'] = 'POST, OPTIONS'
-        resp.headers['Access-Control-Allow-Headers'] = 'Content-Type'
-        return resp
+        return _cors_response('')
     
     try:
-        print("Request received")
+        logger.debug("Request received")
         
         # Start timing for metrics
         start_time = time.time()
+        start_timings()
         
-        if 'file' not in request.files:
-            from flask import make_response
-            resp = make_response({"status": "failed", "error": "No file uploaded"})
-            resp.headers['Access-Control-Allow-Origin'] = '*'
-            return resp
+        # Stream the multipart body straight off the socket: oversized or
+        # non-image uploads are refused before the rest arrives, and the
+        # SHA-256 for the OCR cache is computed as the bytes come in
+        upload = None
+        if request.mimetype == 'multipart/form-data':
+            with span('read'):
+                upload = read_upload(
+                    request.stream, request.mimetype_params.get('boundary'), request.content_length
+                )
+        if upload is None:
+            return _cors_response({"status": "failed", "error": "No file uploaded"})
         
-        file = request.files['file']
-        print(f"File received: {file.filename}")
-        if file.filename == '':
-            from flask import make_response
-            resp = make_response({"status": "failed", "error": "No file selected"})
-            resp.headers['Access-Control-Allow-Origin'] = '*'
-            return resp
+        render = _render_mode(upload.fields)
+        logger.info("File received", extra=fields(filename=upload.filename, kind=upload.kind))
+        if upload.filename == '':
+            return _cors_response({"status": "failed", "error": "No file selected"})
         
-        # Save the uploaded file temporarily
-        import os
-        # Get file extension from uploaded file
-        file_extension = os.path.splitext(file.filename)[1] or '.jpg'
-        temp_path = f"/tmp/temp_upload_{int(time.time())}{file_extension}"
+        # Validation, Vision and the renderer all share this one buffer,
+        # so nothing is written to /tmp
+        content = upload.content
+        logger.debug("File read into memory", extra=fields(bytes=len(content)))
+        
+        if not content:
+            raise Exception("Uploaded file is empty")
+        
+        async_mode = request.args.get('async') == '1' or upload.fields.get('async') == '1'
+        if async_mode:
+            # Refuse before any work is done if the job would never run
+            from jobs import check_async_available
+            check_async_available()
+        
+        if upload.kind == 'pdf':
+            # PDFs are OCR'd page by page and streamed back as NDJSON
+            if not async_mode:
+                return _stream_pdf(content, render, start_time, upload.filename)
+            # Opening parses the page tree, which is enough to reject junk
+            with span('validate'), PDFDocument(content) as document:
+                logger.debug("PDF verification successful", extra=fields(page_count=document.page_count))
+        else:
+            # Verify PIL can read it (only the header is parsed here)
+            try:
+                with span('validate'), open_image(content) as test_img:
+                    logger.debug("PIL verification successful", extra=fields(
+                        format=test_img.format, size=list(test_img.size)
+                    ))
+            except Exception as verify_error:
+                raise Exception(f"Uploaded file is not a readable image: {verify_error}")
 
-        # Save file with proper error handling
-        try:
-            # Save the file
-            file.save(temp_path)
-            
-            # Verify file was saved correctly
-            if not os.path.exists(temp_path):
-                raise Exception("File was not saved to disk")
-            
-            file_size = os.path.getsize(temp_path)
-            print(f"File saved successfully: {temp_path}, size: {file_size} bytes")
-            
-            if file_size == 0:
-                raise Exception("Saved file is empty")
-                
-            # Try to verify PIL can read it
-            from PIL import Image
-            with Image.open(temp_path) as test_img:
-                print(f"PIL verification successful: {test_img.format}, size: {test_img.size}")
-                
-        except Exception as save_error:
-            print(f"File saving/verification error: {save_error}")
-            # Try alternative saving method
-            temp_path = f"/tmp/temp_upload_alt_{int(time.time())}{file_extension}"
-            with open(temp_path, 'wb') as f:
-                file.seek(0)  # Reset file pointer
-                f.write(file.read())
-                f.flush()
-                os.fsync(f.fileno())  # Force write to disk
-            
-            file_size = os.path.getsize(temp_path)
-            print(f"Alternative save method: {temp_path}, size: {file_size} bytes")
+        # Async mode: queue the image and answer straight away; a worker
+        # runs OCR and pushes completion over the dashboard WebSocket
+        if async_mode:
+            from jobs import submit_job
+            invoice_id = submit_job(content, upload.filename, render)
+            return _cors_response({
+                "status": "queued",
+                "invoice_id": invoice_id,
+                "job_url": f"/jobs/{invoice_id}"
+            })
 
         # Process the uploaded file
-        detected_text, text_segments, output_filename = detect_text(temp_path)
-        print("Detection completed successfully")
+        response = process_invoice(content, render, start_time, digest=upload.digest, filename=upload.filename)
+        return _cors_response(response)
+    except JobsUnavailable as e:
+        logger.warning(f"Async upload refused: {e}")
+        resp = _cors_response({"status": "failed", "error": str(e)})
+        resp.status_code = 501
+        return resp
+    except VisionUnavailable as e:
+        logger.warning(f"Vision unavailable: {e}")
+        resp = _cors_response({"status": "failed", "error": str(e)})
+        resp.status_code = 503
+        if e.retry_after:
+            resp.headers['Retry-After'] = str(max(1, int(e.retry_after + 0.5)))
+        return resp
+    except UploadRejected as e:
+        logger.warning(f"Upload rejected: {e}", extra=fields(status=e.status_code))
+        resp = _cors_response({"status": "failed", "error": str(e)})
+        resp.status_code = e.status_code
+        # The rest of the body was never read - don't reuse the connection
+        resp.headers['Connection'] = 'close'
+        return resp
+    except Exception as e:
+        logger.exception(f"Exception error: {str(e)}")
+        return _cors_response({"status": "failed", "error": str(e)})
+        #Return a JSON response with the new image’s URL:
+
+
+
+def _cors_response(payload):
+    from flask import make_response
+    return _with_cors(make_response(payload))
+
+
+def _with_cors(resp):
+    resp.headers['Access-Control-Allow-Origin'] = '*'
+    resp.headers['Access-Control-Allow-Methods'] = 'POST, OPTIONS'
+    resp.headers['Access-Control-Allow-Headers'] = 'Content-Type'
+    return resp
+
+
+def _render_mode(form=None):
+    """render=none|thumbnail|full from the query string or form, else RENDER_DEFAULT
+
+    form defaults to request.form; /receive passes the fields it streamed.
+    """
+    form = request.form if form is None else form
+    render = request.args.get('render') or form.get('render') or RENDER_DEFAULT
+    if render not in RENDER_MODES:
+        raise Exception(f"Invalid render option '{render}', expected one of {', '.join(RENDER_MODES)}")
+    return render
+
+
+class _BatchBudget:
+    """Running file count and byte total for one /receive/batch request"""
+
+    def __init__(self):
+        self.files = 0
+        self.bytes = 0
+
+    def add_file(self):
+        self.files += 1
+        if self.files > BATCH_MAX_FILES:
+            raise UploadRejected(f"Too many files: more than {BATCH_MAX_FILES}", 413)
+
+    def add_bytes(self, size):
+        self.bytes += size
+        if self.bytes > BATCH_MAX_BYTES:
+            raise UploadRejected(f"Batch is over the {BATCH_MAX_BYTES} byte limit", 413)
+
+
+def _batch_entry(name, content):
+    """(name, bytes), or (name, UploadRejected) for a file refused on its own"""
+    if len(content) > MAX_UPLOAD_BYTES:
+        return name, UploadRejected(f"File is over the {MAX_UPLOAD_BYTES} byte limit", 413)
+    kind = sniff(content[:1024])
+    if kind is None:
+        return name, UploadRejected("File is not a supported image", 415)
+    if kind == 'pdf':
+        return name, UploadRejected("PDFs are not supported in a batch, post them to /receive", 415)
+    return name, content
+
+
+def _read_zip_members(content, budget):
+    """Entries for the members of a zip, refusing oversized ones before they are inflated"""
+    entries = []
+    with zipfile.ZipFile(io.BytesIO(content)) as archive:
+        for info in archive.infolist():
+            name = os.path.basename(info.filename)
+            # Skip folders and macOS resource forks / hidden files
+            if info.is_dir() or not name or name.startswith('.') or info.filename.startswith('__MACOSX'):
+                continue
+            budget.add_file()
+            if info.file_size > MAX_UPLOAD_BYTES:
+                entries.append((info.filename, UploadRejected(
+                    f"File is {info.file_size} bytes, over the {MAX_UPLOAD_BYTES} byte limit", 413
+                )))
+                continue
+            budget.add_bytes(info.file_size)
+            # The header's size can lie - never inflate more than the limit
+            with archive.open(info) as member:
+                data = member.read(MAX_UPLOAD_BYTES + 1)
+            budget.add_bytes(max(0, len(data) - info.file_size))
+            entries.append(_batch_entry(info.filename, data))
+    return entries
+
+
+def _collect_batch_files():
+    """Every uploaded file (and zip member) as (name, bytes) or (name, UploadRejected)
+
+    Raises UploadRejected (413) as soon as the request goes over
+    BATCH_MAX_FILES files or BATCH_MAX_BYTES bytes, uploads and decompressed
+    members together. A single file that is too large or not an image is
+    refused on its own and the rest still run.
+    """
+    if request.content_length and request.content_length > BATCH_MAX_BYTES + MULTIPART_OVERHEAD_BYTES:
+        raise UploadRejected(
+            f"Upload is {request.content_length} bytes, over the {BATCH_MAX_BYTES} byte limit", 413
+        )
+    uploads = request.files.getlist('files') + request.files.getlist('file')
+    budget = _BatchBudget()
+    entries = []
+    for upload in uploads:
+        if upload.filename == '':
+            continue
+        content = upload.read(BATCH_MAX_BYTES + 1)
+        if zipfile.is_zipfile(io.BytesIO(content)):
+            # The archive itself is transient; its members count
+            if len(content) > BATCH_MAX_BYTES:
+                raise UploadRejected(f"Archive is over the {BATCH_MAX_BYTES} byte limit", 413)
+            entries.extend(_read_zip_members(content, budget))
+        else:
+            budget.add_file()
+            budget.add_bytes(len(content))
+            entries.append(_batch_entry(upload.filename, content))
+    return entries
+
+
+@upload_bp.route('/receive/batch', methods=['POST','OPTIONS'])
+def receive_batch():
+    """Process many invoices (multiple `files` fields and/or zip archives) in one request"""
+    if request.method == 'OPTIONS':
+        return _cors_response('')
+    
+    try:
+        start_time = time.time()
+        timings = start_timings()
+        render = _render_mode()
+        with span('read'):
+            entries = _collect_batch_files()
+        logger.info("Batch received", extra=fields(files=len(entries)))
         
-        # Calculate processing time and accuracy for metrics
-        processing_time = int((time.time() - start_time) * 1000)  # Convert to milliseconds
-        accuracy_score = calculate_accuracy_score(detected_text)
+        if not entries:
+            return _cors_response({"status": "failed", "error": "No files uploaded"})
         
-        # Generate unique invoice ID and store metrics
-        invoice_id = f"inv_{uuid.uuid4().hex[:8]}_{int(time.time())}"
-        store_metrics(invoice_id, processing_time, accuracy_score)
+        # Files refused on their own (too large, not an image) fail in place
+        results = [None] * len(entries)
+        files = []
+        positions = []
+        for position, (filename, content) in enumerate(entries):
+            if isinstance(content, UploadRejected):
+                logger.warning(f"Batch item rejected: {content}", extra=fields(filename=filename))
+                results[position] = {
+                    "filename": filename, "status": "failed", "error": str(content),
+                    "status_code": content.status_code
+                }
+                continue
+            positions.append(position)
+            files.append((filename, content))
         
-        # Broadcast updated metrics to connected dashboards
-        from app import broadcast_metrics_to_all
-        broadcast_metrics_to_all()
-
-        # Clean up temporary file
-        if os.path.exists(temp_path):
-            os.remove(temp_path)
+        metrics_records = []
+        result_records = []
+        ocr_start = time.perf_counter()
+        for index, outcome, ocr_ms in detect_text_batch(files, render):
+            filename = files[index][0]
+            index = positions[index]
+            if isinstance(outcome, Exception):
+                logger.warning(f"Batch item failed: {outcome}", extra=fields(filename=filename))
+                results[index] = {"filename": filename, "status": "failed", "error": str(outcome)}
+                continue
+            
+            detected_text, segments, output_filename, cache_hit, quality = outcome
+            accuracy_score = quality['score']
+            post_start = time.perf_counter()
+            table = post_process(segments)
+            # This file's own OCR and post-processing time, not the time since
+            # the batch started (which would inflate every later file's latency)
+            processing_time = int(ocr_ms + _elapsed_ms(post_start))
+            invoice_id = new_invoice_id()
+            metrics_records.append((invoice_id, processing_time, accuracy_score, quality, cache_hit))
+            result_records.append(build_record(
+                invoice_id, [(1, detected_text, segments)], table["fields"], accuracy_score, filename
+            ))
+            results[index] = {
+                "filename": filename,
+                "status": "success",
+                "image_url": f"/tmp/{output_filename}" if output_filename else None,
+                "extracted_text": detected_text,
+                "text_segments": segments.to_json(),
+                "table_columns": table["columns"],
+                "line_items": table["line_items"],
+                "fields": table["fields"],
+                "processing_time_ms": processing_time,
+                "accuracy_score": accuracy_score,
+                "quality": quality,
+                "invoice_id": invoice_id,
+                "cache_hit": cache_hit
+            }
         
-        ## processing text 
-        from flask import make_response
-        response = {
-            "status": "success", 
-            "image_url": f"/tmp/{output_filename}", 
-            "extracted_text": detected_text,
-            "text_segments": text_segments,
-            "processing_time_ms": processing_time,
-            "accuracy_score": accuracy_score,
-            "invoice_id": invoice_id
-        }
-        resp = make_response(response)
-        resp.headers['Access-Control-Allow-Origin'] = '*'
-        resp.headers['Access-Control-Allow-Methods'] = 'POST, OPTIONS'
-        resp.headers['Access-Control-Allow-Headers'] = 'Content-Type'
+        # Wall time from the first OCR request to the last result
+        timings.add('ocr', (time.perf_counter() - ocr_start) * 1000)
+        
+        # One write for every result in the batch
+        with span('store_result'):
+            save_results(result_records)
+        
+        with span('store_metrics'):
+            store_metrics_batch(metrics_records)
+        
+        # One dashboard update for the whole batch
+        with span('broadcast'):
+            broadcast_metrics_to_all()
+        
+        succeeded = len(metrics_records)
+        return _cors_response({
+            "status": "success" if succeeded else "failed",
+            "total": len(entries),
+            "succeeded": succeeded,
+            "failed": len(entries) - succeeded,
+            "processing_time_ms": int((time.time() - start_time) * 1000),
+            "render": render,
+            "timings": timings.as_dict(),
+            "results": results
+        })
+    except UploadRejected as e:
+        logger.warning(f"Batch rejected: {e}", extra=fields(status=e.status_code))
+        resp = _cors_response({"status": "failed", "error": str(e)})
+        resp.status_code = e.status_code
         return resp
     except Exception as e:
-        print(f"Exception error: {str(e)}")
-        import traceback 
-        traceback.print_exc()
-        from flask import make_response
-        error_response = {"status": "failed", "error": str(e)}
-        resp = make_response(error_response)
-        resp.headers['Access-Control-Allow-Origin'] = '*'
-        resp.headers['Access-Control-Allow-Methods'] = 'POST, OPTIONS'
-        resp.headers['Access-Control-Allow-Headers'] = 'Content-Type'
-        return resp
-        #Return a JSON response with the new image’s URL:
+        logger.exception(f"Batch exception error: {str(e)}")
+        return _cors_response({"status": "failed", "error": str(e)})
 
 
-##Those ADC tokens only live for a short time (often an hour, or up to a week if you used gcloud auth application-default login). After that, they’re dead—and any API call using them will fail with invalid_grant.
 
+@upload_bp.route('/render', methods=['POST','OPTIONS'])
+def render_image():
+    """Render the box overlay for an already-processed image from its cached segments"""
+    if request.method == 'OPTIONS':
+        return _cors_response('')
+    
+    try:
+        if 'file' not in request.files or request.files['file'].filename == '':
+            return _cors_response({"status": "failed", "error": "No file uploaded"})
+        render = _render_mode()
+        if render == 'none':
+            render = 'full'
+        
+        content = request.files['file'].read()
+        cached = _cached_ocr(content_hash(content))
+        if cached is None:
+            # Rendering never triggers OCR - the image has to go through /receive first
+            return _cors_response({"status": "failed", "error": "No cached segments for this image, upload it to /receive first"})
+        
+        jpeg = render_overlay(content, cached[1].polygons(), render)
+        resp = _cors_response(jpeg)
+        resp.headers['Content-Type'] = 'image/jpeg'
+        return resp
+    except Exception as e:
+        logger.error(f"Render exception error: {str(e)}")
+        return _cors_response({"status": "failed", "error": str(e)})
 
+##Those ADC tokens only live for a short time (often an hour, or up to a week if you used gcloud auth application-default login). After that, they’re dead—and any API call using them will fail with invalid_grant.
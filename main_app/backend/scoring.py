@@ -0,0 +1,88 @@
+import os
+
+import numpy as np
+
+# OCR quality score from Vision's own confidences. With DOCUMENT_TEXT_DETECTION
+# the response carries full_text_annotation: pages -> blocks -> paragraphs
+# -> words, each with a 0-1 confidence. The tree is walked once to copy the
+# word and block confidences into flat arrays (on the raw protobuf, not the
+# proto-plus wrappers), and everything else is array arithmetic on those:
+#   - word_confidence: mean word confidence weighted by symbol count, so a
+#     misread 12-digit amount weighs more than a misread "of",
+#   - block_confidence: mean block confidence weighted by words per block,
+#   - low_confidence_share: share of words under OCR_LOW_CONFIDENCE.
+# score (0-100) is the geometric mean of the first two, so it is only high
+# when both the words and the layout blocks were read confidently.
+
+OCR_LOW_CONFIDENCE = float(os.environ.get('OCR_LOW_CONFIDENCE', '0.6'))
+
+
+def collect_confidences(full_text_annotation):
+    """(word confidence, symbols per word, block confidence, words per block) arrays"""
+    annotation = type(full_text_annotation).pb(full_text_annotation)
+    words = []
+    block_confidence = []
+    block_words = []
+    for page in annotation.pages:
+        for block in page.blocks:
+            in_block = [word for paragraph in block.paragraphs for word in paragraph.words]
+            words.extend(in_block)
+            block_confidence.append(block.confidence)
+            block_words.append(len(in_block))
+    count = len(words)
+    return (
+        np.fromiter((word.confidence for word in words), np.float32, count),
+        np.fromiter((len(word.symbols) for word in words), np.float32, count),
+        np.array(block_confidence, dtype=np.float32),
+        np.array(block_words, dtype=np.float32),
+    )
+
+
+def score_confidences(word_confidence, symbols, block_confidence, block_words):
+    """Quality dict from the arrays collect_confidences returns, or None if no words"""
+    words = len(word_confidence)
+    if not words or not symbols.sum() or not block_words.sum():
+        return None
+    word_mean = float(np.dot(word_confidence, symbols) / symbols.sum())
+    block_mean = float(np.dot(block_confidence, block_words) / block_words.sum())
+    return {
+        'source': 'confidence',
+        'score': int(round(100 * np.sqrt(word_mean * block_mean))),
+        'word_confidence': round(word_mean, 4),
+        'block_confidence': round(block_mean, 4),
+        'low_confidence_share': round(float(np.count_nonzero(word_confidence < OCR_LOW_CONFIDENCE)) / words, 4),
+        'words': words,
+    }
+
+
+def score_response(response):
+    """Quality dict for an AnnotateImageResponse, or None without confidences
+
+    TEXT_DETECTION responses (and empty pages) have no full_text_annotation
+    words; the caller falls back to the text heuristic for those.
+    """
+    if not response.full_text_annotation.pages:
+        return None
+    return score_confidences(*collect_confidences(response.full_text_annotation))
+
+
+def merge_quality(pages):
+    """One quality dict for a multi-page document, pages weighted by word count"""
+    scored = [quality for quality in pages if quality]
+    if not scored:
+        return None
+    weights = np.array([max(quality.get('words', 0), 1) for quality in scored], dtype=np.float64)
+    merged = {
+        'source': scored[0]['source'] if len({q['source'] for q in scored}) == 1 else 'mixed',
+        'score': int(round(float(np.dot([q['score'] for q in scored], weights) / weights.sum()))),
+        'words': int(sum(quality.get('words', 0) for quality in scored)),
+    }
+    for name in ('word_confidence', 'block_confidence', 'low_confidence_share'):
+        values = [(quality[name], weight) for quality, weight in zip(scored, weights) if name in quality]
+        if values:
+            merged[name] = round(float(sum(v * w for v, w in values) / sum(w for _, w in values)), 4)
+    scales = [quality['preprocess_scale'] for quality in scored if 'preprocess_scale' in quality]
+    if scales:
+        # The most downscaled page bounds what the document could score
+        merged['preprocess_scale'] = min(scales)
+    return merged
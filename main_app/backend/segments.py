@@ -0,0 +1,148 @@
+import numpy as np
+
+# Compact word-box storage. Vision gives us one protobuf per word; instead
+# of turning each into an eight-key dict we copy the vertices once into a
+# single (n, 4, 2) int32 array and keep the strings in a parallel list.
+# Geometry runs as array operations on that, and the JSON dict form is
+# only built at the response boundary (to_json).
+
+# Vertex order as Vision returns it: top-left, top-right, bottom-right, bottom-left
+VERTEX_COUNT = 4
+
+
+class SegmentArray:
+    """Word texts plus an (n, 4, 2) int32 array of their box vertices"""
+
+    __slots__ = ('texts', 'boxes')
+
+    def __init__(self, texts, boxes):
+        self.texts = texts
+        self.boxes = boxes
+
+    @classmethod
+    def empty(cls):
+        return cls([], np.zeros((0, VERTEX_COUNT, 2), dtype=np.int32))
+
+    @classmethod
+    def from_annotations(cls, texts):
+        """Build from Vision text_annotations in one pass, skipping the full-text entry"""
+        words = []
+        coords = []
+        for text in texts[1:]:
+            words.append(text.description)
+            vertices = text.bounding_poly.vertices
+            if len(vertices) == VERTEX_COUNT:
+                for vertex in vertices:
+                    coords.append(vertex.x)
+                    coords.append(vertex.y)
+            else:
+                # Vision omits vertices it could not place; keep the row aligned
+                points = [(v.x, v.y) for v in vertices][:VERTEX_COUNT]
+                points += [(0, 0)] * (VERTEX_COUNT - len(points))
+                for x, y in points:
+                    coords.append(x)
+                    coords.append(y)
+        if not words:
+            return cls.empty()
+        boxes = np.array(coords, dtype=np.int32).reshape(len(words), VERTEX_COUNT, 2)
+        return cls(words, boxes)
+
+    @classmethod
+    def from_json(cls, text_segments):
+        """Build from the text_segments response format"""
+        if not text_segments:
+            return cls.empty()
+        words = [segment["text"] for segment in text_segments]
+        boxes = np.array([
+            [segment["bounding_box"][k] for k in ("x1", "y1", "x2", "y2", "x3", "y3", "x4", "y4")]
+            for segment in text_segments
+        ], dtype=np.int32).reshape(len(words), VERTEX_COUNT, 2)
+        return cls(words, boxes)
+
+    @classmethod
+    def from_compact(cls, data):
+        """Inverse of to_compact"""
+        if not data["texts"]:
+            return cls.empty()
+        boxes = np.array(data["boxes"], dtype=np.int32).reshape(len(data["texts"]), VERTEX_COUNT, 2)
+        return cls(list(data["texts"]), boxes)
+
+    def __len__(self):
+        return len(self.texts)
+
+    def to_json(self):
+        """text_segments response format: [{"text", "bounding_box": {x1..y4}}]"""
+        rows = self.boxes.reshape(len(self.texts), VERTEX_COUNT * 2).tolist()
+        return [
+            {
+                "text": text,
+                "bounding_box": {
+                    "x1": r[0], "y1": r[1],  # Top-left
+                    "x2": r[2], "y2": r[3],  # Top-right
+                    "x3": r[4], "y3": r[5],  # Bottom-right
+                    "x4": r[6], "y4": r[7]   # Bottom-left
+                }
+            }
+            for text, r in zip(self.texts, rows)
+        ]
+
+    def to_compact(self):
+        """Flat lists for caching/storage - much smaller than to_json"""
+        return {"texts": list(self.texts), "boxes": self.boxes.ravel().tolist()}
+
+    def polygons(self):
+        """Vertex lists for ImageDraw"""
+        return [[tuple(point) for point in box] for box in self.boxes.tolist()]
+
+    def bounds(self):
+        """(left, right, top, bottom) arrays of axis-aligned extents"""
+        # Pairwise over the four vertices - a reduction along an axis of
+        # length 4 is several times slower for large n
+        xs = [self.boxes[:, k, 0] for k in range(VERTEX_COUNT)]
+        ys = [self.boxes[:, k, 1] for k in range(VERTEX_COUNT)]
+        return (
+            np.minimum(np.minimum(xs[0], xs[1]), np.minimum(xs[2], xs[3])),
+            np.maximum(np.maximum(xs[0], xs[1]), np.maximum(xs[2], xs[3])),
+            np.minimum(np.minimum(ys[0], ys[1]), np.minimum(ys[2], ys[3])),
+            np.maximum(np.maximum(ys[0], ys[1]), np.maximum(ys[2], ys[3])),
+        )
+
+    def centers(self):
+        """(n, 2) float array of box centres"""
+        return self.boxes.mean(axis=1)
+
+    def heights(self):
+        _, _, top, bottom = self.bounds()
+        return np.maximum(bottom - top, 1)
+
+    def angles(self):
+        """Text baseline angle per word in degrees (top-left -> top-right edge)"""
+        boxes = self.boxes
+        return np.degrees(np.arctan2(boxes[:, 1, 1] - boxes[:, 0, 1], boxes[:, 1, 0] - boxes[:, 0, 0]))
+
+    def scaled(self, scale_x, scale_y):
+        """Copy with every vertex scaled (e.g. to map between image sizes)"""
+        factors = np.array([scale_x, scale_y], dtype=np.float64)
+        boxes = np.rint(self.boxes * factors).astype(np.int32)
+        return SegmentArray(self.texts, boxes)
+
+    def deskewed(self, min_degrees=0.5):
+        """Copy rotated about the page centre so the median baseline is horizontal
+
+        Phone photos are often a few degrees off; row clustering by y works
+        much better once that skew is removed. Returns self when the skew is
+        below min_degrees.
+        """
+        if not len(self):
+            return self
+        angle = float(np.median(self.angles()))
+        if abs(angle) < min_degrees:
+            return self
+        theta = np.radians(-angle)
+        rotation = np.array([[np.cos(theta), -np.sin(theta)],
+                             [np.sin(theta), np.cos(theta)]])
+        points = self.boxes.reshape(-1, 2).astype(np.float64)
+        origin = points.mean(axis=0)
+        rotated = (points - origin) @ rotation.T + origin
+        boxes = np.rint(rotated).astype(np.int32).reshape(self.boxes.shape)
+        return SegmentArray(self.texts, boxes)
@@ -0,0 +1,167 @@
+import re
+
+import numpy as np
+
+from segments import SegmentArray
+
+# Line-item table extraction over OCR word boxes.
+#
+# Words are sorted once by vertical centre and swept into rows, the header
+# row is picked by keyword lookup, and every word is dropped into a column
+# by one vectorised binary search over the sorted column boundaries -
+# O(n log n) overall instead of re-scanning every segment for every header.
+
+# Header words (lowercased, punctuation stripped) -> output column name
+HEADER_ALIASES = {
+    'description': 'description',
+    'item': 'description',
+    'items': 'description',
+    'product': 'description',
+    'price': 'price',
+    'rate': 'price',
+    'unit': 'price',
+    'quantity': 'quantity',
+    'qty': 'quantity',
+    'hours': 'quantity',
+    'total': 'total',
+    'amount': 'total',
+}
+
+NUMERIC_COLUMNS = ('price', 'quantity', 'total')
+
+# A row whose leading words are one of these ends the line-item table
+SUMMARY_WORDS = {'subtotal', 'sub-total', 'total', 'tax', 'vat', 'gst', 'balance', 'discount', 'shipping'}
+
+# Rows are split when a word's centre sits more than this many word
+# heights below the current row's centre
+ROW_TOLERANCE = 0.5
+
+_number_pattern = re.compile(r'-?\d[\d,]*(?:\.\d+)?')
+_strip_pattern = re.compile(r'[^\w\-]')
+
+
+def _normalize(text):
+    return _strip_pattern.sub('', text).lower()
+
+
+def parse_number(text):
+    """'$1,234.50' -> 1234.5; None when the text holds no number"""
+    match = _number_pattern.search(text)
+    if not match:
+        return None
+    try:
+        return float(match.group().replace(',', ''))
+    except ValueError:
+        return None
+
+
+def cluster_rows(segments):
+    """Group word indices into rows by vertical centre; each row is sorted by x
+
+    Takes a SegmentArray and returns a list of rows, each a list of word
+    indices into it.
+    """
+    if not len(segments):
+        return []
+    left, _, top, bottom = segments.bounds()
+    centers = (top + bottom) / 2
+    heights = np.maximum(bottom - top, 1)
+    order = np.argsort(centers, kind='stable')
+
+    rows = []
+    current = []
+    row_center = row_height = 0
+    # The sweep itself is sequential; plain floats are much faster than
+    # numpy scalars here
+    for index, center, height in zip(order.tolist(), centers[order].tolist(), heights[order].tolist()):
+        if current and center - row_center > ROW_TOLERANCE * row_height:
+            rows.append(current)
+            current = []
+        if not current:
+            row_center, row_height = center, height
+        else:
+            # Running mean keeps slightly skewed scans on one row
+            row_center += (center - row_center) / (len(current) + 1)
+            row_height = max(row_height, height)
+        current.append(index)
+    if current:
+        rows.append(current)
+
+    left = left.tolist()
+    for row in rows:
+        row.sort(key=left.__getitem__)
+    return rows
+
+
+def _find_header_row(segments, rows, left, right):
+    """Index of the row with the most header words, with its columns"""
+    best_index, best_columns = None, []
+    for row_index, row in enumerate(rows):
+        columns = []
+        seen = set()
+        for i in row:
+            name = HEADER_ALIASES.get(_normalize(segments.texts[i]))
+            if name and name not in seen:
+                seen.add(name)
+                columns.append((left[i], right[i], name))
+        # A table header needs at least two columns, one of them numeric
+        if len(columns) >= 2 and any(c[2] in NUMERIC_COLUMNS for c in columns):
+            if len(columns) > len(best_columns):
+                best_index, best_columns = row_index, columns
+    return best_index, best_columns
+
+
+def _column_index(columns):
+    """Sorted column boundaries (midpoints between header centres) for searchsorted"""
+    columns = sorted(columns, key=lambda c: c[0])
+    centers = np.array([(left + right) / 2 for left, right, _ in columns])
+    boundaries = (centers[:-1] + centers[1:]) / 2
+    return boundaries, [name for _, _, name in columns]
+
+
+def extract_line_items(segments):
+    """Find the line-item table and return its columns and typed rows
+
+    Accepts a SegmentArray (or text_segments JSON).
+    """
+    if not isinstance(segments, SegmentArray):
+        segments = SegmentArray.from_json(segments)
+    # Row clustering by y assumes horizontal baselines
+    segments = segments.deskewed()
+    rows = cluster_rows(segments)
+    if not rows:
+        return {"columns": [], "line_items": []}
+
+    left, right, _, _ = segments.bounds()
+    header_index, header_columns = _find_header_row(segments, rows, left.tolist(), right.tolist())
+    if header_index is None:
+        return {"columns": [], "line_items": []}
+
+    boundaries, names = _column_index(header_columns)
+    # Column of every word at once: words left of the first boundary land in
+    # the first column (usually the description), right of the last in the
+    # last one
+    column_of = np.searchsorted(boundaries, (left + right) / 2, side='right').tolist()
+
+    texts = segments.texts
+    line_items = []
+    for row in rows[header_index + 1:]:
+        if _normalize(texts[row[0]]) in SUMMARY_WORDS:
+            break
+
+        cells = {}
+        for i in row:
+            cells.setdefault(names[column_of[i]], []).append(texts[i])
+        cells = {name: " ".join(words) for name, words in cells.items()}
+
+        item = {name: cells.get(name) for name in names}
+        for name in NUMERIC_COLUMNS:
+            if name in item and item[name] is not None:
+                item[name] = parse_number(item[name])
+        # Rows without any number in a numeric column are notes, not items
+        if not any(item.get(name) is not None for name in NUMERIC_COLUMNS):
+            continue
+        item["row_text"] = " ".join(texts[i] for i in row)
+        line_items.append(item)
+
+    return {"columns": names, "line_items": line_items}
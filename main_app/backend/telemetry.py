@@ -0,0 +1,134 @@
+import contextvars
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+# Structured logging and per-stage timings.
+#
+# Every log line is one JSON object (level, logger, message plus any
+# fields passed through extra=fields(...)) so CloudWatch Logs Insights can
+# filter and aggregate them. LOG_LEVEL drops the chatty DEBUG lines in
+# production instead of paying to ingest them.
+#
+# Timings hangs off a context variable: a request starts one and any code
+# underneath can wrap a stage in span('name') without threading the object
+# through every call. Spans with the same name add up, so stages run once
+# per page of a PDF report their total.
+
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+# json | text (text is easier to read on a local dev server)
+LOG_FORMAT = os.environ.get('LOG_FORMAT', 'json')
+
+LOGGER_ROOT = 'invoice'
+
+_configured = False
+_configure_lock = threading.Lock()
+_current = contextvars.ContextVar('timings', default=None)
+
+
+class JSONFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(record.created)) + f".{int(record.msecs):03d}Z",
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        extra = getattr(record, 'fields', None)
+        if extra:
+            entry.update(extra)
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def _configure():
+    global _configured
+    with _configure_lock:
+        if _configured:
+            return
+        handler = logging.StreamHandler(sys.stdout)
+        if LOG_FORMAT == 'json':
+            handler.setFormatter(JSONFormatter())
+        else:
+            handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(name)s %(message)s'))
+        root = logging.getLogger(LOGGER_ROOT)
+        root.addHandler(handler)
+        root.setLevel(LOG_LEVEL)
+        # The Lambda runtime puts its own handler on the root logger
+        root.propagate = False
+        _configured = True
+
+
+def get_logger(name):
+    """Logger under the 'invoice' namespace, e.g. get_logger('upload')"""
+    if not _configured:
+        _configure()
+    return logging.getLogger(f"{LOGGER_ROOT}.{name}")
+
+
+def fields(**values):
+    """extra= argument that attaches structured fields to one log line"""
+    return {'fields': values}
+
+
+class Timings:
+    """Milliseconds spent per named stage of one request"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._spans = {}
+
+    def add(self, name, elapsed_ms):
+        with self._lock:
+            self._spans[name] = self._spans.get(name, 0.0) + elapsed_ms
+
+    @contextmanager
+    def span(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, (time.perf_counter() - start) * 1000)
+
+    def as_dict(self):
+        """Stage -> whole milliseconds, in the order the stages first ran"""
+        with self._lock:
+            return {name: int(round(ms)) for name, ms in self._spans.items()}
+
+
+def start_timings(timings=None):
+    """Make timings (a fresh Timings by default) current for this request or job"""
+    if timings is None:
+        timings = Timings()
+    _current.set(timings)
+    return timings
+
+
+def current_timings():
+    return _current.get()
+
+
+@contextmanager
+def span(name):
+    """Time a stage into the current Timings; a no-op outside a request"""
+    timings = _current.get()
+    if timings is None:
+        yield
+        return
+    with timings.span(name):
+        yield
+
+
+def propagate(fn):
+    """Wrap fn to run in a copy of the calling context (for thread pool work)
+
+    Wrap once per submitted task - a copied context cannot be entered by
+    two threads at the same time.
+    """
+    context = contextvars.copy_context()
+    return lambda *args, **kwargs: context.run(fn, *args, **kwargs)
@@ -0,0 +1,61 @@
+import io
+import os
+import sys
+
+import pytest
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Before any backend module is imported: they read these at import time
+os.environ.setdefault('LOG_LEVEL', 'WARNING')
+os.environ.setdefault('OCR_CACHE_BACKEND', 'none')
+os.environ.setdefault('RESULTS_STORE_BACKEND', 'none')
+os.environ.setdefault('JOB_WORKERS', '0')
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+os.environ.setdefault('AWS_ACCESS_KEY_ID', 'testing')
+os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'testing')
+
+# The backend modules, and the offline fakes as benchmarks.fakes
+sys.path.insert(0, BACKEND_DIR)
+
+
+def make_jpeg(color='white', size=(200, 200)):
+    from PIL import Image
+    buffer = io.BytesIO()
+    Image.new('RGB', size, color).save(buffer, 'JPEG')
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def jpeg():
+    return make_jpeg
+
+
+@pytest.fixture
+def fake_services(monkeypatch):
+    """Vision, DynamoDB and API Gateway fakes installed in the app's client caches
+
+    The caches fakes.install() writes into are swapped for copies first, so
+    the next test starts from the real ones again.
+    """
+    import aws_clients
+    import dashboard
+    import ocr_cache
+    import vision_client
+    from benchmarks import fakes
+
+    monkeypatch.setattr(aws_clients, '_handles', dict(aws_clients._handles))
+    monkeypatch.setattr(vision_client, '_cache', dict(vision_client._cache))
+    monkeypatch.setattr(ocr_cache, '_cache', None)
+    monkeypatch.setattr(dashboard, '_metrics_snapshots', {})
+    monkeypatch.setenv('WS_ENDPOINT', fakes.WS_ENDPOINT)
+    yield fakes.install(fakes.build_vision_response(fakes.synthetic_annotations(50)))
+    # A coalesced broadcast still waiting goes out now, against the fakes,
+    # instead of on a timer after they are gone
+    dashboard.flush_metrics_broadcast()
+
+
+@pytest.fixture
+def client(fake_services):
+    import app
+    return app.get_app().test_client()
@@ -0,0 +1,118 @@
+import io
+import zipfile
+
+import pytest
+
+
+def test_undecodable_file_fails_alone(fake_services, jpeg):
+    from routes.upload import detect_text_batch
+    files = [
+        ('a.jpg', jpeg('red')),
+        ('b.jpg', jpeg('green')),
+        ('notes.txt', b'not an image at all'),
+        ('c.jpg', jpeg('blue')),
+        # Right signature, body cut off - only fails when decoded
+        ('cut.jpg', jpeg('yellow')[:200]),
+    ]
+    results = {i: result for i, result, _ in detect_text_batch(files, 'none')}
+
+    assert sorted(results) == [0, 1, 2, 3, 4]
+    failed = sorted(i for i, result in results.items() if isinstance(result, Exception))
+    assert failed == [2, 4]
+    # The good images still went to Vision, in one call
+    assert fake_services['vision'].images == 3
+
+
+def test_whole_batch_call_failure_fails_every_image(fake_services, jpeg, monkeypatch):
+    from routes.upload import detect_text_batch
+
+    def unavailable(*args, **kwargs):
+        raise RuntimeError("Vision down")
+
+    monkeypatch.setattr(fake_services['vision'], 'batch_annotate_images', unavailable)
+    files = [('a.jpg', jpeg('red')), ('notes.txt', b'text')]
+    results = {i: result for i, result, _ in detect_text_batch(files, 'none')}
+
+    assert str(results[0]) == "Vision down"
+    assert "Vision down" not in str(results[1])
+
+
+def test_receive_batch_reports_bad_file_individually(client, jpeg):
+    data = {'files': [
+        (io.BytesIO(jpeg('red')), 'a.jpg'),
+        (io.BytesIO(jpeg('green')), 'b.jpg'),
+        (io.BytesIO(jpeg('blue')), 'c.jpg'),
+        (io.BytesIO(b'plain text'), 'notes.txt'),
+    ]}
+    response = client.post('/receive/batch?render=none', data=data, content_type='multipart/form-data')
+
+    statuses = {result['filename']: result['status'] for result in response.json['results']}
+    assert statuses == {'a.jpg': 'success', 'b.jpg': 'success', 'c.jpg': 'success', 'notes.txt': 'failed'}
+
+
+def _zip(members):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for name, content in members.items():
+            archive.writestr(name, content)
+    return buffer.getvalue()
+
+
+def _post_batch(client, *uploads):
+    data = {'files': [(io.BytesIO(content), name) for name, content in uploads]}
+    return client.post('/receive/batch?render=none', data=data, content_type='multipart/form-data')
+
+
+def test_oversized_zip_member_is_refused_before_it_is_inflated(client, jpeg, monkeypatch):
+    import routes.upload
+    monkeypatch.setattr(routes.upload, 'MAX_UPLOAD_BYTES', 64 * 1024)
+    archive = _zip({'a.jpg': jpeg('red'), 'bomb.jpg': b'\0' * (10 * 1024 * 1024)})
+
+    response = _post_batch(client, ('invoices.zip', archive))
+
+    results = {result['filename']: result for result in response.json['results']}
+    assert results['a.jpg']['status'] == 'success'
+    assert results['bomb.jpg']['status_code'] == 413
+
+
+def test_batch_over_the_decompressed_byte_budget_is_rejected(client, jpeg, monkeypatch):
+    import routes.upload
+    monkeypatch.setattr(routes.upload, 'BATCH_MAX_BYTES', 100 * 1024)
+    archive = _zip({f"{i}.jpg": jpeg(size=(400, 400)) + b'\0' * 30000 for i in range(5)})
+
+    response = _post_batch(client, ('invoices.zip', archive))
+
+    assert response.status_code == 413
+
+
+def test_batch_over_the_file_count_is_rejected(client, jpeg, monkeypatch):
+    import routes.upload
+    monkeypatch.setattr(routes.upload, 'BATCH_MAX_FILES', 2)
+
+    response = _post_batch(client, *[(f"{i}.jpg", jpeg()) for i in range(3)])
+
+    assert response.status_code == 413
+
+
+@pytest.mark.parametrize('name, content', [('notes.txt', b'plain text'), ('doc.pdf', b'%PDF-1.7\n...')])
+def test_unsupported_type_is_refused_individually(client, jpeg, name, content):
+    response = _post_batch(client, ('a.jpg', jpeg()), (name, content))
+
+    results = {result['filename']: result for result in response.json['results']}
+    assert results['a.jpg']['status'] == 'success'
+    assert results[name]['status_code'] == 415
+
+
+def test_processing_time_is_per_file(client, fake_services, jpeg, monkeypatch):
+    import routes.upload
+    # Two Vision calls of 0.2 s each, one after the other
+    fake_services['vision'].latency_seconds = 0.2
+    monkeypatch.setattr(routes.upload, 'VISION_BATCH_SIZE', 2)
+    monkeypatch.setattr(routes.upload, 'VISION_MAX_CONCURRENCY', 1)
+
+    response = _post_batch(client, *[(f"{i}.jpg", jpeg((i * 50, 0, 0))) for i in range(4)])
+
+    times = [result['processing_time_ms'] for result in response.json['results']]
+    assert response.json['processing_time_ms'] >= 400
+    # Files from the second call don't carry the first call's time
+    assert max(times) < 400
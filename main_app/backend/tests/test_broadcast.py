@@ -0,0 +1,109 @@
+import threading
+import time
+
+from broadcast import Coalescer
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def _counting():
+    ran = []
+    done = threading.Event()
+
+    def task():
+        ran.append(time.monotonic())
+        done.set()
+    return ran, done, task
+
+
+def test_first_notify_runs_straight_away():
+    ran, done, task = _counting()
+    coalescer = Coalescer(task, window_seconds=5)
+    start = time.monotonic()
+    coalescer.notify()
+    assert done.wait(1)
+    assert ran[0] - start < 0.5
+
+
+def test_notifies_inside_the_window_fold_into_one_trailing_run():
+    ran, done, task = _counting()
+    coalescer = Coalescer(task, window_seconds=0.2)
+    coalescer.notify()
+    assert done.wait(1)
+    for _ in range(5):
+        coalescer.notify()
+    time.sleep(0.05)
+    assert len(ran) == 1
+    deadline = time.monotonic() + 2
+    while len(ran) < 2 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert len(ran) == 2
+    assert ran[1] - ran[0] >= 0.19
+    assert (coalescer.notified, coalescer.runs) == (6, 2)
+
+
+def test_flush_runs_scheduled_work_once():
+    ran, _, task = _counting()
+    coalescer = Coalescer(task, window_seconds=5)
+    coalescer._last_run = time.monotonic()
+    coalescer.notify()
+    coalescer.flush()
+    coalescer.flush()
+    assert len(ran) == 1
+
+
+def test_deferred_flush_holds_work_inside_the_window():
+    clock = _Clock()
+    ran, _, task = _counting()
+    coalescer = Coalescer(task, window_seconds=1, deferred=True, clock=clock)
+
+    coalescer.flush()
+    assert not ran
+
+    coalescer.notify()
+    coalescer.flush()
+    assert len(ran) == 1
+
+    # Invocations inside the window leave their update pending
+    for _ in range(3):
+        clock.now += 0.2
+        coalescer.notify()
+        coalescer.flush()
+    assert len(ran) == 1
+
+    # The next invocation after the window sends it, with nothing new to add
+    clock.now += 0.5
+    coalescer.flush()
+    assert len(ran) == 2
+    coalescer.flush()
+    assert len(ran) == 2
+
+
+def test_deferred_flush_defers_to_a_claim_held_elsewhere():
+    clock = _Clock()
+    ran, _, task = _counting()
+    claims = []
+    coalescer = Coalescer(task, window_seconds=1, deferred=True, clock=clock,
+                          claim=lambda window: claims.append(window) or len(claims) > 1)
+    coalescer.notify()
+    coalescer.flush()
+    assert not ran and claims == [1]
+
+    clock.now += 1.5
+    coalescer.flush()
+    assert len(ran) == 1
+
+
+def test_claim_row_collapses_broadcasts_across_containers(fake_services):
+    import dashboard
+    assert dashboard._claim_broadcast(60) is True
+    # A second container inside the window loses the claim
+    assert dashboard._claim_broadcast(60) is False
+    time.sleep(0.01)
+    assert dashboard._claim_broadcast(0.005) is True
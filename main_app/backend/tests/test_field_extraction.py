@@ -0,0 +1,47 @@
+import pytest
+
+from field_extraction import extract_fields, parse_amount
+
+
+@pytest.mark.parametrize('text, expected', [
+    ('$1,234.56', (1234.56, 'USD')),
+    ('1,234', (1234.0, None)),
+    ('1,234,567.89', (1234567.89, None)),
+    ('EUR 1.234,56', (1234.56, 'EUR')),
+    ('Total Due: EUR 1.234,56', (1234.56, 'EUR')),
+    ('1.234.567', (1234567.0, None)),
+    ('€ 12,50', (12.5, 'EUR')),
+    ('gbp 99.5', (99.5, 'GBP')),
+    ('Tax (8%) $8.00', (8.0, 'USD')),
+    ('Tax (7,5%) EUR 8,00', (8.0, 'EUR')),
+    ('-12.50', (-12.5, None)),
+])
+def test_parse_amount(text, expected):
+    assert parse_amount(text) == expected
+
+
+@pytest.mark.parametrize('text', ['1.234', '1.2345', '12%', 'no amount'])
+def test_ambiguous_or_missing_amount_is_none(text):
+    assert parse_amount(text) is None
+
+
+def _annotation(text, x, y, width, height=28):
+    return {'description': text, 'bounding_poly': {'vertices': [
+        {'x': x, 'y': y}, {'x': x + width, 'y': y},
+        {'x': x + width, 'y': y + height}, {'x': x, 'y': y + height},
+    ]}}
+
+
+def test_comma_decimal_total_on_a_page():
+    from benchmarks import fakes
+    from segments import SegmentArray
+    words = []
+    x = 100
+    for text in ('Total', 'Due:', 'EUR', '1.234,56'):
+        words.append(_annotation(text, x, 1000, 20 * len(text)))
+        x += 20 * len(text) + 10
+    response = fakes.build_vision_response([_annotation('Total Due: EUR 1.234,56', 0, 0, x, 1100)] + words)
+    segments = SegmentArray.from_annotations(response.text_annotations)
+    fields = extract_fields(segments)
+    assert fields['total'] == 1234.56
+    assert fields['currency'] == 'EUR'
@@ -0,0 +1,98 @@
+import hashlib
+import io
+
+import pytest
+
+import ingest
+from ingest import UploadRejected, read_upload
+
+BOUNDARY = 'test-boundary'
+
+
+def _part(name, content, filename=None, content_type='application/octet-stream'):
+    if filename is None:
+        header = f'Content-Disposition: form-data; name="{name}"\r\n\r\n'
+    else:
+        header = (f'Content-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+                  f'Content-Type: {content_type}\r\n\r\n')
+    if isinstance(content, str):
+        content = content.encode()
+    return f'--{BOUNDARY}\r\n'.encode() + header.encode() + content + b'\r\n'
+
+
+def _body(*parts, closed=True):
+    return b''.join(parts) + (f'--{BOUNDARY}--\r\n'.encode() if closed else b'')
+
+
+@pytest.fixture(params=[7, 64 * 1024], ids=['tiny-chunks', 'default-chunks'])
+def chunk_size(request, monkeypatch):
+    # Tiny reads put part boundaries and the sniffed head across chunks
+    monkeypatch.setattr(ingest, 'INGEST_CHUNK_BYTES', request.param)
+    return request.param
+
+
+def test_reads_file_with_digest_and_kind(jpeg, chunk_size):
+    image = jpeg()
+    upload = read_upload(io.BytesIO(_body(_part('file', image, 'a.jpg', 'image/jpeg'))), BOUNDARY)
+    assert upload.content == image
+    assert upload.digest == hashlib.sha256(image).hexdigest()
+    assert (upload.kind, upload.filename) == ('jpeg', 'a.jpg')
+
+
+def test_fields_after_the_file_part_are_kept(jpeg, chunk_size):
+    body = _body(_part('async', '1'), _part('file', jpeg(), 'a.jpg'), _part('render', 'none'))
+    upload = read_upload(io.BytesIO(body), BOUNDARY)
+    assert upload.fields == {'async': '1', 'render': 'none'}
+
+
+def test_content_length_over_the_limit_is_refused_unread():
+    stream = io.BytesIO(b'x' * 100)
+    with pytest.raises(UploadRejected) as rejected:
+        read_upload(stream, BOUNDARY, content_length=10 * 1024 * 1024, max_bytes=1024)
+    assert rejected.value.status_code == 413
+    assert stream.tell() == 0
+
+
+def test_oversized_file_is_refused_while_streaming(jpeg, chunk_size):
+    image = jpeg(size=(400, 400))
+    # No Content-Length (chunked transfer): the limit is enforced as bytes arrive
+    with pytest.raises(UploadRejected) as rejected:
+        read_upload(io.BytesIO(_body(_part('file', image, 'a.jpg'))), BOUNDARY, max_bytes=len(image) - 1)
+    assert rejected.value.status_code == 413
+
+
+def test_non_image_is_refused_from_its_first_bytes(chunk_size):
+    text = b'Plain text, not an invoice image. ' * 10000
+    stream = io.BytesIO(_body(_part('file', text, 'notes.txt', 'image/jpeg')))
+    with pytest.raises(UploadRejected) as rejected:
+        read_upload(stream, BOUNDARY)
+    assert rejected.value.status_code == 415
+    # Refused after the sniffed head, not after the whole file
+    assert stream.tell() < len(text)
+
+
+def test_truncated_file_part_is_rejected(jpeg, chunk_size):
+    body = _body(_part('file', jpeg(), 'a.jpg'))
+    with pytest.raises(UploadRejected) as rejected:
+        read_upload(io.BytesIO(body[:len(body) // 2]), BOUNDARY)
+    assert rejected.value.status_code == 400
+
+
+def test_missing_final_boundary_is_rejected(jpeg, chunk_size):
+    image = jpeg()
+    body = f'--{BOUNDARY}\r\n'.encode() + (
+        b'Content-Disposition: form-data; name="file"; filename="a.jpg"\r\n\r\n'
+    ) + image
+    with pytest.raises(UploadRejected) as rejected:
+        read_upload(io.BytesIO(body), BOUNDARY)
+    assert rejected.value.status_code == 400
+
+
+def test_body_without_the_file_field_returns_none(chunk_size):
+    assert read_upload(io.BytesIO(_body(_part('render', 'none'))), BOUNDARY) is None
+
+
+def test_missing_boundary_is_a_bad_request():
+    with pytest.raises(UploadRejected) as rejected:
+        read_upload(io.BytesIO(b''), '')
+    assert rejected.value.status_code == 400
@@ -0,0 +1,96 @@
+import io
+
+import pytest
+
+
+@pytest.fixture
+def queue(tmp_path, monkeypatch):
+    import jobs
+    queue = jobs.JobQueue(str(tmp_path / 'jobs.sqlite3'))
+    monkeypatch.setattr(jobs, '_queue', queue)
+    return queue
+
+
+def _broken_pdf_pages(document, render):
+    for index in range(document.page_count):
+        yield index, RuntimeError(f"page {index + 1} unreadable")
+
+
+def _pdf(pages=2):
+    import pypdfium2 as pdfium
+    document = pdfium.PdfDocument.new()
+    for _ in range(pages):
+        document.new_page(300, 400)
+    buffer = io.BytesIO()
+    document.save(buffer)
+    return buffer.getvalue()
+
+
+def test_pdf_job_with_every_page_failed_is_failed(queue, fake_services, monkeypatch):
+    import jobs
+    import routes.upload
+    monkeypatch.setattr(routes.upload, 'detect_pdf_pages', _broken_pdf_pages)
+    monkeypatch.setattr(jobs, 'JOB_MAX_ATTEMPTS', 1)
+    queue.enqueue('inv_pdf', _pdf(), 'scan.pdf', 'none')
+
+    jobs.process_job(queue, queue.claim())
+
+    job = queue.get('inv_pdf')
+    assert job['status'] == jobs.STATUS_FAILED
+    assert 'page 1 unreadable' in job['error']
+
+
+def test_image_job_is_done(queue, fake_services, jpeg):
+    import jobs
+    queue.enqueue('inv_img', jpeg(), 'a.jpg', 'none')
+
+    jobs.process_job(queue, queue.claim())
+
+    assert queue.get('inv_img')['status'] == jobs.STATUS_DONE
+
+
+def test_start_workers_resumes_interrupted_jobs(queue, monkeypatch):
+    import jobs
+    queue.enqueue('inv_cut', b'...', 'a.jpg', 'none')
+    queue.claim()
+    started = []
+    monkeypatch.setattr(jobs, 'JOB_WORKERS', 1)
+    monkeypatch.setattr(jobs, 'JOB_QUEUE_SHARED', False)
+    monkeypatch.setattr(jobs, '_workers', [])
+    monkeypatch.setattr(jobs.threading, 'Thread', lambda **kwargs: type('T', (), {
+        'start': lambda self: started.append(kwargs['name'])
+    })())
+
+    jobs.start_workers()
+
+    assert queue.get('inv_cut')['status'] == jobs.STATUS_QUEUED
+    assert started == ['job-worker-0']
+
+
+@pytest.mark.parametrize('shared, workers', [(False, 0), (True, 1)])
+def test_async_is_refused_on_lambda_without_a_shared_queue(client, jpeg, monkeypatch, shared, workers):
+    import jobs
+    monkeypatch.setattr(jobs, 'ON_LAMBDA', True)
+    monkeypatch.setattr(jobs, 'JOB_QUEUE_SHARED', shared)
+    monkeypatch.setattr(jobs, 'JOB_WORKERS', workers)
+
+    response = client.post(
+        '/receive?async=1', data={'file': (io.BytesIO(jpeg()), 'a.jpg')}, content_type='multipart/form-data'
+    )
+
+    assert response.status_code == 501
+    assert client.get('/jobs/inv_x').status_code == 501
+
+
+def test_async_on_lambda_with_shared_queue_and_standalone_worker(client, queue, jpeg, monkeypatch):
+    import jobs
+    monkeypatch.setattr(jobs, 'ON_LAMBDA', True)
+    monkeypatch.setattr(jobs, 'JOB_QUEUE_SHARED', True)
+    monkeypatch.setattr(jobs, 'JOB_WORKERS', 0)
+
+    response = client.post(
+        '/receive?async=1', data={'file': (io.BytesIO(jpeg()), 'a.jpg')}, content_type='multipart/form-data'
+    )
+
+    assert response.json['status'] == 'queued'
+    assert client.get(response.json['job_url']).json['status'] == jobs.STATUS_QUEUED
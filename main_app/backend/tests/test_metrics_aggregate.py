@@ -0,0 +1,111 @@
+import threading
+
+import pytest
+
+import metrics_aggregate
+from metrics_aggregate import (
+    AGGREGATE_KEY, bucket_id, bucket_start, histogram_percentile, latency_bucket_attribute, read_aggregate,
+    record_samples, summarize_aggregate, summarize_window,
+)
+
+
+@pytest.fixture
+def table():
+    from benchmarks import fakes
+    return fakes.FakeTable('InvoiceMetrics', ['invoiceId', 'timestamp'])
+
+
+def test_percentiles_stay_within_min_and_max():
+    histogram = {latency_bucket_attribute(ms): 0 for ms in (12, 17)}
+    histogram[latency_bucket_attribute(12)] = 10
+    for _, q in metrics_aggregate.PERCENTILES:
+        assert 12 <= histogram_percentile(histogram, q, 12, 17) <= 17
+    # Without bounds it interpolates across the whole 0-50 ms bucket
+    assert histogram_percentile(histogram, 0.5) == 25
+
+
+def test_aggregate_percentiles_bounded_by_observed_latencies(table):
+    record_samples(table, [(12, 90), (15, 90), (17, 90)])
+    summary = summarize_aggregate(read_aggregate(table))
+    assert (summary['minLatency'], summary['maxLatency']) == (12, 17)
+    for name, _ in metrics_aggregate.PERCENTILES:
+        assert 12 <= summary[name] <= 17
+
+
+def test_window_rate_uses_the_span_the_buckets_cover(table):
+    # 30 s into a minute
+    now_ms = 1_699_999_980_000 + 30_000
+    record_samples(table, [(300, 90)] * 6, at_ms=now_ms)
+    record_samples(table, [(40, 90)] * 4, at_ms=now_ms - 5 * 60 * 1000)
+    summary = summarize_window(table, '5m', now_ms=now_ms)
+
+    since = bucket_start('minute', now_ms - 5 * 60 * 1000)
+    assert summary['since'] == since
+    assert summary['total'] == 10
+    # Six minute buckets, the last half over: 5.5 minutes, not the nominal 5
+    assert now_ms - since == 330_000
+    assert summary['invoicesPerMinute'] == round(10 / ((now_ms - since) / 60000), 2)
+    assert (summary['minLatency'], summary['maxLatency']) == (40, 300)
+    for name, _ in metrics_aggregate.PERCENTILES:
+        assert 40 <= summary[name] <= 300
+
+
+def test_bucket_extremes_follow_later_writes(table):
+    now_ms = 1_700_000_000_000
+    record_samples(table, [(200, 90)], at_ms=now_ms)
+    record_samples(table, [(80, 90), (900, 90)], at_ms=now_ms)
+    summary = summarize_window(table, '5m', now_ms=now_ms)
+    assert (summary['minLatency'], summary['maxLatency']) == (80, 900)
+
+
+def test_row_aggregate_and_buckets(table):
+    item = {'invoiceId': 'inv-1', 'timestamp': 1_700_000_000_000, 'latency': 120, 'accuracy': 90}
+    record_samples(table, [(120, 90)], items=[item], at_ms=item['timestamp'])
+    # The row, then one ADD per counter row; the first write sets min/max itself
+    assert table.calls == 1 + 4
+    assert table.get_item(Key={'invoiceId': 'inv-1', 'timestamp': item['timestamp']})['Item'] == item
+    aggregate = read_aggregate(table)
+    assert (aggregate['invoiceCount'], aggregate['minLatency'], aggregate['maxLatency']) == (1, 120, 120)
+    for granularity in metrics_aggregate.BUCKET_SECONDS:
+        key = {'invoiceId': bucket_id(granularity), 'timestamp': bucket_start(granularity, item['timestamp'])}
+        assert table.get_item(Key=key)['Item']['invoiceCount'] == 1
+
+
+def test_row_survives_a_failed_counter_update(table, monkeypatch):
+    def unavailable(**kwargs):
+        raise RuntimeError("ProvisionedThroughputExceededException")
+    monkeypatch.setattr(table, 'update_item', unavailable)
+
+    item = {'invoiceId': 'inv-1', 'timestamp': 1_700_000_000_000, 'latency': 120, 'accuracy': 90}
+    with pytest.raises(RuntimeError):
+        record_samples(table, [(120, 90)], items=[item])
+    assert table.get_item(Key={'invoiceId': 'inv-1', 'timestamp': item['timestamp']})['Item'] == item
+
+
+def test_new_extreme_costs_one_conditional_write_and_counts_once(table):
+    record_samples(table, [(100, 90), (200, 90)])
+    table.calls = 0
+    record_samples(table, [(150, 90)])
+    # Inside the stored min/max: the ADDs alone
+    assert table.calls == 4
+    table.calls = 0
+    record_samples(table, [(50, 90), (150, 90)])
+    assert table.calls == 4 * 2
+    aggregate = table.get_item(Key=AGGREGATE_KEY)['Item']
+    assert aggregate['invoiceCount'] == 5
+    assert (aggregate['minLatency'], aggregate['maxLatency']) == (50, 200)
+
+
+def test_concurrent_writers_keep_exact_counts_and_extremes(table):
+    def write(latency):
+        for _ in range(20):
+            record_samples(table, [(latency, 90)])
+
+    threads = [threading.Thread(target=write, args=(latency,)) for latency in (30, 60, 900, 400)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    summary = summarize_aggregate(read_aggregate(table))
+    assert summary['total'] == 80
+    assert (summary['minLatency'], summary['maxLatency']) == (30, 900)
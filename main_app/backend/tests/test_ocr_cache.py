@@ -0,0 +1,40 @@
+import time
+
+from ocr_cache import SQLiteBackend
+
+
+def _value(size):
+    return {'detected_text': 'x' * size}
+
+
+def test_sqlite_tier_keeps_the_newest_rows_under_the_row_cap(tmp_path):
+    backend = SQLiteBackend(str(tmp_path / 'cache.sqlite3'), max_rows=3, prune_every=2)
+    now = time.time()
+    for i in range(6):
+        backend.set(f"k{i}", _value(10), now + i)
+    assert [backend.get(f"k{i}") is not None for i in range(6)] == [False, False, False, True, True, True]
+
+
+def test_sqlite_tier_is_pruned_to_the_byte_cap(tmp_path):
+    # Each stored value is a little over 1000 bytes of JSON
+    backend = SQLiteBackend(str(tmp_path / 'cache.sqlite3'), max_bytes=2500, prune_every=1)
+    now = time.time()
+    for i in range(5):
+        backend.set(f"k{i}", _value(1000), now + i)
+    kept = [i for i in range(5) if backend.get(f"k{i}") is not None]
+    assert kept == [3, 4]
+
+
+def test_sqlite_tier_drops_expired_rows_when_pruning_and_on_open(tmp_path):
+    path = str(tmp_path / 'cache.sqlite3')
+    backend = SQLiteBackend(path, ttl_seconds=60, prune_every=2)
+    backend.set('old', _value(1), time.time() - 120)
+    assert backend.get('old') is not None
+    backend.set('new', _value(1), time.time())
+    assert backend.get('old') is None
+    assert backend.get('new') is not None
+
+    backend.set('old', _value(1), time.time() - 120)
+    reopened = SQLiteBackend(path, ttl_seconds=60)
+    assert reopened.get('old') is None
+    assert reopened.get('new') is not None
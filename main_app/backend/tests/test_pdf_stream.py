@@ -0,0 +1,101 @@
+import io
+import json
+import threading
+
+import pytest
+from PIL import Image, ImageDraw
+
+import pdf_pages
+
+
+def make_pdf(pages):
+    images = []
+    for number in range(1, pages + 1):
+        image = Image.new('RGB', (600, 800), 'white')
+        ImageDraw.Draw(image).text((50, 50), f"Invoice page {number}", fill='black')
+        images.append(image)
+    buffer = io.BytesIO()
+    images[0].save(buffer, 'PDF', save_all=True, append_images=images[1:])
+    return buffer.getvalue()
+
+
+def _post(client, content):
+    return client.post('/receive?render=none', data={'file': (io.BytesIO(content), 'invoice.pdf')},
+                       content_type='multipart/form-data')
+
+
+def test_stream_is_document_then_pages_in_order_then_summary(client, fake_services):
+    response = _post(client, make_pdf(5))
+    assert response.mimetype == 'application/x-ndjson'
+    assert response.headers['Access-Control-Allow-Origin'] == '*'
+    lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+
+    assert [line['type'] for line in lines] == ['document'] + ['page'] * 5 + ['summary']
+    assert lines[0]['page_count'] == 5
+    assert [line['page'] for line in lines[1:-1]] == [1, 2, 3, 4, 5]
+    assert all(line['status'] == 'success' for line in lines[1:])
+    assert lines[-1]['pages_succeeded'] == 5
+    assert lines[-1]['invoice_id'] == lines[0]['invoice_id']
+    assert fake_services['vision'].images == 5
+
+
+def test_too_many_pages_is_a_json_error_before_streaming(client, monkeypatch):
+    monkeypatch.setattr(pdf_pages, 'PDF_MAX_PAGES', 2)
+    response = _post(client, make_pdf(3))
+    assert response.mimetype == 'application/json'
+    assert response.json['status'] == 'failed'
+    assert "limit 2" in response.json['error']
+
+
+def test_broken_pdf_is_a_json_error_before_streaming(client, fake_services):
+    response = _post(client, b'%PDF-1.4 not really a pdf')
+    assert response.mimetype == 'application/json'
+    assert response.json['status'] == 'failed'
+    assert "not a readable PDF" in response.json['error']
+    assert fake_services['vision'].calls == 0
+
+
+class _Document:
+    """PDFDocument stand-in that counts pages rendered but not yet handed back"""
+
+    def __init__(self, page_count):
+        self.page_count = page_count
+        self.rendered = 0
+        self.consumed = 0
+        self.peak_held = 0
+
+    def render_page(self, index):
+        self.rendered += 1
+        self.peak_held = max(self.peak_held, self.rendered - self.consumed)
+        return f"page-{index}".encode()
+
+
+def test_pages_in_flight_stay_within_the_vision_concurrency(monkeypatch):
+    import routes.upload as upload
+    limit = 3
+    monkeypatch.setattr(upload, 'VISION_MAX_CONCURRENCY', limit)
+    # Each call waits until `limit` are running at once: the pool must
+    # reach the limit, and never gets past it
+    barrier = threading.Barrier(limit, timeout=5)
+    lock = threading.Lock()
+    running = [0, 0]
+
+    def detect_text(page, render):
+        with lock:
+            running[0] += 1
+            running[1] = max(running[1], running[0])
+        barrier.wait()
+        with lock:
+            running[0] -= 1
+        return page
+
+    monkeypatch.setattr(upload, 'detect_text', detect_text)
+    document = _Document(9)
+    results = []
+    for index, result in upload.detect_pdf_pages(document, 'none'):
+        document.consumed += 1
+        results.append((index, result))
+
+    assert results == [(i, f"page-{i}".encode()) for i in range(9)]
+    assert running[1] == limit
+    assert document.peak_held == limit
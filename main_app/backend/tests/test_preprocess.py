@@ -0,0 +1,88 @@
+import io
+
+import numpy as np
+import pytest
+from PIL import Image
+
+import preprocess
+from preprocess import EXIF_ORIENTATION_TAG, prepare_for_ocr
+
+
+def _noisy(size, fmt='JPEG', orientation=None):
+    """An image that doesn't compress away, so its byte size is realistic"""
+    pixels = (np.random.default_rng(0).random((size[1] // 8, size[0] // 8, 3)) * 255).astype('uint8')
+    image = Image.fromarray(pixels).resize(size, Image.BILINEAR)
+    buffer = io.BytesIO()
+    if orientation is None:
+        image.save(buffer, fmt)
+    else:
+        exif = Image.Exif()
+        exif[EXIF_ORIENTATION_TAG] = orientation
+        image.save(buffer, fmt, exif=exif)
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def budget(monkeypatch):
+    monkeypatch.setattr(preprocess, 'PREPROCESS_MAX_EDGE', 400)
+    monkeypatch.setattr(preprocess, 'PREPROCESS_MIN_BYTES', 1024)
+    # Images this small only pay for their preprocessing on a slow link
+    monkeypatch.setattr(preprocess, 'PREPROCESS_ASSUMED_MBPS', 1)
+    monkeypatch.setattr(preprocess, '_costs', preprocess._CostModel())
+
+
+def test_small_file_goes_out_untouched(budget):
+    content = _noisy((800, 600), 'PNG')
+    prepared = prepare_for_ocr(content)
+    assert len(content) > 1024 and prepared.changed
+    tiny = _noisy((16, 16))
+    assert prepare_for_ocr(tiny).content is tiny
+
+
+def test_upright_jpeg_within_the_pixel_budget_is_not_reencoded(budget):
+    content = _noisy((400, 300))
+    assert len(content) > 1024
+    prepared = prepare_for_ocr(content)
+    assert prepared.content is content
+    assert not prepared.changed
+
+
+def test_png_within_the_pixel_budget_is_still_converted(budget):
+    content = _noisy((400, 300), 'PNG')
+    prepared = prepare_for_ocr(content)
+    assert prepared.bytes_saved > 0
+    assert Image.open(io.BytesIO(prepared.content)).format == 'JPEG'
+    assert (prepared.scale_x, prepared.scale_y) == (1.0, 1.0)
+
+
+def test_oversized_image_is_downscaled_to_the_long_edge(budget):
+    prepared = prepare_for_ocr(_noisy((800, 600)))
+    assert Image.open(io.BytesIO(prepared.content)).size == (400, 300)
+    assert prepared.scale_x == pytest.approx(0.5)
+
+
+def test_rotated_jpeg_within_the_budget_is_still_turned_upright(budget):
+    prepared = prepare_for_ocr(_noisy((400, 300), orientation=6))
+    assert Image.open(io.BytesIO(prepared.content)).size == (300, 400)
+
+
+def test_image_is_sent_as_is_when_the_transfer_saved_would_not_pay_for_the_work(budget, monkeypatch):
+    content = _noisy((800, 600), 'PNG')
+    monkeypatch.setattr(preprocess, 'PREPROCESS_ASSUMED_MBPS', 10_000)
+    assert prepare_for_ocr(content).content is content
+    # Turning it upright is needed whatever it costs
+    assert prepare_for_ocr(_noisy((800, 600), 'PNG', orientation=6)).changed
+
+
+def test_cost_estimates_follow_measured_runs(monkeypatch):
+    monkeypatch.setattr(preprocess, 'PREPROCESS_ASSUMED_MBPS', 100)
+    costs = preprocess._CostModel()
+    # Observed: 100 ms per source megapixel, 50 KB per megapixel sent
+    for _ in range(50):
+        costs.observe('PNG', 2.0, 1.0, 200, 50_000)
+    assert costs.ms_per_megapixel[None] == pytest.approx(100, rel=0.01)
+    assert costs.bytes_per_megapixel == pytest.approx(50_000, rel=0.01)
+    assert costs.ms_per_megapixel['JPEG'] == preprocess._COST_SEED_MS_PER_MEGAPIXEL['JPEG']
+    # 1 MB - 50 KB at 100 Mbps is ~76 ms saved: worth 0.5 MP of PNG work, not 1 MP
+    assert costs.worth_it('PNG', 1_000_000, 0.5, 1.0)
+    assert not costs.worth_it('PNG', 1_000_000, 1.0, 1.0)
@@ -0,0 +1,209 @@
+from decimal import Decimal
+
+import numpy as np
+import pytest
+
+from benchmarks import fakes
+import results_store
+from results_store import (
+    DynamoDBResultsBackend,
+    SQLiteResultsBackend,
+    build_record,
+    decode_cursor,
+    decode_segments,
+    encode_cursor,
+    encode_segments,
+)
+from segments import SegmentArray
+
+VENDORS = ['Acme Ltd', 'Globex, Inc.', 'Initech']
+
+
+def _segments(words, offset=0):
+    boxes = np.arange(len(words) * 8, dtype=np.int32).reshape(len(words), 4, 2) + offset
+    return SegmentArray(words, boxes)
+
+
+def _record(i, text=None, vendor=None):
+    invoice_fields = {
+        'vendor': vendor or VENDORS[i % 3],
+        'invoice_date': f'2024-0{1 + i % 9}-1{i % 9}',
+        'total': float(i * 10),
+        'currency': 'USD',
+    }
+    text = text if text is not None else f'invoice {i} widget alpha{i % 5}'
+    return build_record(
+        f'inv_{i:03d}', [(1, text, _segments(text.split(), i))], invoice_fields, 90, f'f{i}.png',
+        created_at=1000 + i,
+    )
+
+
+@pytest.fixture
+def store(tmp_path):
+    backend = SQLiteResultsBackend(str(tmp_path / 'results.sqlite3'))
+    backend.put_many([_record(i) for i in range(30)])
+    return backend
+
+
+def _all_pages(store, **filters):
+    ids, cursor = [], None
+    while True:
+        page = store.query(limit=7, cursor=cursor, **filters)
+        assert len(page['items']) == 7 or page['next_cursor'] is None
+        ids += [item['invoice_id'] for item in page['items']]
+        cursor = page['next_cursor']
+        if cursor is None:
+            return ids
+
+
+def test_segments_round_trip_through_the_compressed_columns():
+    segments = _segments(['Invoice', 'Total', '12.50'], offset=100)
+    texts, boxes = encode_segments(segments)
+    decoded = decode_segments(texts, boxes)
+    assert decoded.texts == segments.texts
+    assert np.array_equal(decoded.boxes, segments.boxes)
+    assert decoded.boxes.flags['C_CONTIGUOUS']
+
+    empty = decode_segments(*encode_segments(SegmentArray.empty()))
+    assert len(empty) == 0
+
+
+@pytest.mark.parametrize('filters, expected', [
+    ({}, [f'inv_{i:03d}' for i in reversed(range(30))]),
+    ({'vendor': 'GLOBEX inc'}, [f'inv_{i:03d}' for i in reversed(range(1, 30, 3))]),
+    ({'min_total': 100, 'max_total': 200}, [f'inv_{i:03d}' for i in reversed(range(10, 21))]),
+])
+def test_keyset_cursor_pages_through_every_match_once_in_order(store, filters, expected):
+    assert _all_pages(store, **filters) == expected
+
+
+def test_keyset_cursor_pages_through_a_date_range(store):
+    ids = _all_pages(store, date_from='2024-03-01', date_to='2024-04-30')
+    dates = [store.get(invoice_id)['invoice_date'] for invoice_id in ids]
+    assert len(ids) == len(set(ids)) == sum(1 for i in range(30) if i % 9 in (2, 3))
+    assert dates == sorted(dates, reverse=True)
+
+
+def test_keyset_cursor_pages_through_full_text_matches(store):
+    if not store.full_text:
+        pytest.skip("SQLite without FTS5")
+    assert _all_pages(store, text='alpha3') == [f'inv_{i:03d}' for i in reversed(range(3, 30, 5))]
+
+
+def test_cursor_from_another_listing_order_is_rejected(store):
+    cursor = store.query(limit=2)['next_cursor']
+    assert decode_cursor(cursor)[0] == 'created'
+    with pytest.raises(ValueError, match="does not belong"):
+        store.query(vendor='acme ltd', cursor=cursor)
+    with pytest.raises(ValueError, match="Invalid cursor"):
+        store.query(cursor='not a cursor')
+
+
+def test_restoring_an_invoice_replaces_its_full_text_entry(store):
+    if not store.full_text:
+        pytest.skip("SQLite without FTS5")
+    store.put_many([_record(3, text='replaced zeta')])
+    assert _all_pages(store, text='zeta') == ['inv_003']
+    assert 'inv_003' not in _all_pages(store, text='alpha3')
+    assert store.get('inv_003')['pages'][0]['extracted_text'] == 'replaced zeta'
+
+    # Deleting replays the indexed text, so a second replacement stays clean
+    store.put_many([_record(3, text='replaced again')])
+    assert _all_pages(store, text='zeta') == []
+    assert _all_pages(store, text='again') == ['inv_003']
+
+
+# --- DynamoDB -------------------------------------------------------------
+
+def test_dynamodb_item_round_trips_through_the_table():
+    table = fakes.FakeTable('InvoiceResults', ['invoiceId'])
+    backend = DynamoDBResultsBackend(table)
+    record = build_record('inv_1', [(1, 'Acme total 12.50', _segments(['Acme', 'total', '12.50']))],
+                          {'vendor': 'Acme Ltd', 'total': 12.5, 'invoice_date': None}, 88, 'a.png', created_at=5)
+    backend.put_many([record])
+
+    stored = table.get_item(Key={'invoiceId': 'inv_1'})['Item']
+    assert stored['recordType'] == results_store.RECORD_TYPE
+    assert stored['vendorKey'] == 'acme ltd'
+    assert stored['total'] == Decimal('12.5')
+    # Left out, so the invoice stays out of the sparse byDate index
+    assert 'invoiceDate' not in stored
+
+    found = backend.get('inv_1', include_segments=True)
+    assert found['total'] == 12.5 and found['created_at'] == 5 and found['accuracy_score'] == 88
+    assert found['fields']['vendor'] == 'Acme Ltd'
+    assert found['pages'][0]['extracted_text'] == 'Acme total 12.50'
+    assert found['pages'][0]['text_segments'] == _segments(['Acme', 'total', '12.50']).to_json()
+
+
+def test_dynamodb_item_drops_word_boxes_past_the_item_limit(monkeypatch):
+    monkeypatch.setattr(results_store, 'DYNAMODB_MAX_ITEM_BYTES', 10)
+    table = fakes.FakeTable('InvoiceResults', ['invoiceId'])
+    backend = DynamoDBResultsBackend(table)
+    backend.put_many([_record(1)])
+
+    assert set(table.get_item(Key={'invoiceId': 'inv_001'})['Item']['pages'][0]) == {'page', 'text'}
+    found = backend.get('inv_001', include_segments=True)
+    assert 'text_segments' not in found['pages'][0]
+    assert found['pages'][0]['extracted_text'] == 'invoice 1 widget alpha1'
+
+
+class _FilteredIndex:
+    """byCreated stand-in: Limit counts items read, the filter then drops some"""
+
+    def __init__(self, items, keep):
+        self.items = sorted(items, key=lambda item: item['createdAt'], reverse=True)
+        self.keep = keep
+        self.limits = []
+
+    def query(self, Limit, ExclusiveStartKey=None, **kwargs):
+        self.limits.append(Limit)
+        start = 0
+        if ExclusiveStartKey:
+            start = 1 + next(i for i, item in enumerate(self.items)
+                             if item['invoiceId'] == ExclusiveStartKey['invoiceId'])
+        read = self.items[start:start + Limit]
+        response = {'Items': [item for item in read if self.keep(item)]}
+        if start + Limit < len(self.items):
+            response['LastEvaluatedKey'] = {
+                name: read[-1][name] for name in ('invoiceId', 'recordType', 'createdAt')
+            }
+        return response
+
+
+def test_dynamodb_query_fills_short_filtered_pages():
+    items = [
+        {'invoiceId': f'inv_{i:02d}', 'recordType': 'invoice', 'createdAt': Decimal(i), 'fields': '{}'}
+        for i in range(40)
+    ]
+    # One item in four passes the filter
+    index = _FilteredIndex(items, keep=lambda item: int(item['createdAt']) % 4 == 0)
+    backend = DynamoDBResultsBackend(index)
+
+    ids, cursor, pages = [], None, 0
+    while True:
+        page = backend.query(limit=3, cursor=cursor)
+        pages += 1
+        assert len(page['items']) == 3 or page['next_cursor'] is None
+        ids += [item['invoice_id'] for item in page['items']]
+        cursor = page['next_cursor']
+        if cursor is None:
+            break
+    assert ids == [f'inv_{i:02d}' for i in range(36, -1, -4)]
+    assert pages == 4
+    assert len(index.limits) > pages
+
+
+def test_dynamodb_cursor_resumes_after_the_last_returned_item():
+    items = [
+        {'invoiceId': f'inv_{i:02d}', 'recordType': 'invoice', 'createdAt': Decimal(i), 'fields': '{}'}
+        for i in range(10)
+    ]
+    backend = DynamoDBResultsBackend(_FilteredIndex(items, keep=lambda item: True))
+    page = backend.query(limit=4)
+    assert [item['invoice_id'] for item in page['items']] == ['inv_09', 'inv_08', 'inv_07', 'inv_06']
+    assert decode_cursor(page['next_cursor']) == ['created', {
+        'invoiceId': 'inv_06', 'recordType': 'invoice', 'createdAt': '6',
+    }]
+    with pytest.raises(ValueError, match="does not belong"):
+        backend.query(vendor='acme', cursor=encode_cursor(['created', {}]))
@@ -0,0 +1,83 @@
+import types
+
+import pytest
+from google.cloud import vision
+
+from scoring import OCR_LOW_CONFIDENCE, merge_quality, score_response
+
+
+def _word(text, confidence):
+    return {'confidence': confidence, 'symbols': [{'text': char, 'confidence': confidence} for char in text]}
+
+
+def _response(*blocks):
+    """AnnotateImageResponse with one page of (block confidence, [(word, confidence)]) blocks"""
+    return vision.AnnotateImageResponse(full_text_annotation={'pages': [{'blocks': [
+        {'confidence': confidence, 'paragraphs': [{'words': [_word(*word) for word in words]}]}
+        for confidence, words in blocks
+    ]}]})
+
+
+def test_word_confidence_is_weighted_by_symbol_count():
+    quality = score_response(_response((0.9, [('of', 0.9), ('123456789012', 0.3)])))
+    assert quality['word_confidence'] == pytest.approx((0.9 * 2 + 0.3 * 12) / 14, abs=1e-4)
+    assert quality['words'] == 2
+
+
+def test_block_confidence_is_weighted_by_words_per_block():
+    quality = score_response(_response(
+        (0.9, [('Invoice', 0.8), ('Total', 0.8), ('Due', 0.8)]),
+        (0.5, [('smudge', 0.8)]),
+    ))
+    assert quality['block_confidence'] == pytest.approx((0.9 * 3 + 0.5) / 4, abs=1e-4)
+    # The geometric mean of the word and block confidences
+    assert quality['score'] == round(100 * (0.8 * 0.8) ** 0.5)
+    assert quality['source'] == 'confidence'
+
+
+def test_low_confidence_share_counts_words_under_the_threshold():
+    quality = score_response(_response((0.9, [
+        ('a', 0.95), ('b', OCR_LOW_CONFIDENCE), ('c', OCR_LOW_CONFIDENCE - 0.01), ('d', 0.2),
+    ])))
+    assert quality['low_confidence_share'] == 0.5
+
+
+def test_text_detection_response_falls_back_to_the_text_heuristic():
+    from routes.upload import calculate_accuracy_score, ocr_quality
+    text = "INVOICE 1042\nTotal $ 120.00\nTax 10.00"
+    response = vision.AnnotateImageResponse(text_annotations=[{'description': text}])
+    assert score_response(response) is None
+
+    prepared = types.SimpleNamespace(scale_x=0.5, scale_y=0.25)
+    quality = ocr_quality(response, text, ['w'] * 6, prepared)
+    assert quality == {
+        'source': 'heuristic', 'score': calculate_accuracy_score(text), 'words': 6, 'preprocess_scale': 0.25,
+    }
+
+
+def test_pages_merge_weighted_by_word_count():
+    pages = [
+        {'source': 'confidence', 'score': 90, 'words': 30, 'word_confidence': 0.9,
+         'block_confidence': 0.9, 'low_confidence_share': 0.0, 'preprocess_scale': 1.0},
+        None,
+        {'source': 'confidence', 'score': 50, 'words': 10, 'word_confidence': 0.5,
+         'block_confidence': 0.5, 'low_confidence_share': 0.4, 'preprocess_scale': 0.5},
+    ]
+    merged = merge_quality(pages)
+    assert merged['score'] == 80
+    assert merged['words'] == 40
+    assert merged['word_confidence'] == 0.8
+    assert merged['low_confidence_share'] == 0.1
+    assert merged['preprocess_scale'] == 0.5
+    assert merged['source'] == 'confidence'
+
+
+def test_mixed_pages_average_confidences_over_the_pages_that_have_them():
+    merged = merge_quality([
+        {'source': 'confidence', 'score': 90, 'words': 10, 'word_confidence': 0.9},
+        {'source': 'heuristic', 'score': 40, 'words': 10},
+    ])
+    assert merged['source'] == 'mixed'
+    assert merged['score'] == 65
+    assert merged['word_confidence'] == 0.9
+    assert merge_quality([None, None]) is None
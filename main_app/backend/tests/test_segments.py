@@ -0,0 +1,100 @@
+import numpy as np
+import pytest
+from google.cloud import vision
+
+from segments import SegmentArray
+
+
+def _annotation(text, vertices):
+    return {'description': text, 'bounding_poly': {'vertices': [{'x': x, 'y': y} for x, y in vertices]}}
+
+
+def _response(*words):
+    return vision.AnnotateImageResponse(text_annotations=[
+        _annotation(' '.join(text for text, _ in words), [(0, 0), (500, 0), (500, 100), (0, 100)]),
+    ] + [_annotation(text, vertices) for text, vertices in words])
+
+
+def _box(x, y, width=80, height=20):
+    return [(x, y), (x + width, y), (x + width, y + height), (x, y + height)]
+
+
+def test_from_annotations_skips_the_full_text_entry():
+    response = _response(('Invoice', _box(10, 20)), ('#1042', _box(100, 20)))
+    segments = SegmentArray.from_annotations(response.text_annotations)
+    assert segments.texts == ['Invoice', '#1042']
+    assert segments.boxes.dtype == np.int32 and segments.boxes.shape == (2, 4, 2)
+    assert segments.boxes[1].tolist() == [[100, 20], [180, 20], [180, 40], [100, 40]]
+
+
+def test_from_annotations_pads_missing_vertices_to_keep_rows_aligned():
+    # Vision leaves out vertices (and zero coordinates) it could not place
+    response = _response(('cut', [(5, 6), (7, 8)]), ('whole', _box(100, 20)))
+    segments = SegmentArray.from_annotations(response.text_annotations)
+    assert segments.boxes[0].tolist() == [[5, 6], [7, 8], [0, 0], [0, 0]]
+    assert segments.boxes[1].tolist() == [list(point) for point in _box(100, 20)]
+    assert len(SegmentArray.from_annotations(_response().text_annotations)) == 0
+
+
+def test_json_and_compact_forms_round_trip():
+    segments = SegmentArray(['Total', '12.50'], np.array([_box(10, 20), _box(100, 20)], dtype=np.int32))
+    text_segments = segments.to_json()
+    assert text_segments[0] == {'text': 'Total', 'bounding_box': {
+        'x1': 10, 'y1': 20, 'x2': 90, 'y2': 20, 'x3': 90, 'y3': 40, 'x4': 10, 'y4': 40,
+    }}
+    for copy in (SegmentArray.from_json(text_segments), SegmentArray.from_compact(segments.to_compact())):
+        assert copy.texts == segments.texts
+        assert np.array_equal(copy.boxes, segments.boxes)
+    assert len(SegmentArray.from_json([])) == 0
+    assert SegmentArray.empty().to_json() == []
+
+
+def test_bounds_centres_and_heights():
+    # A tilted box: the axis-aligned extents come from different vertices
+    segments = SegmentArray(['a', 'b'], np.array([
+        [(10, 30), (50, 20), (55, 40), (15, 50)],
+        _box(0, 0, width=10, height=0),
+    ], dtype=np.int32))
+    left, right, top, bottom = segments.bounds()
+    assert (left.tolist(), right.tolist(), top.tolist(), bottom.tolist()) == ([10, 0], [55, 10], [20, 0], [50, 0])
+    assert segments.centers().tolist()[0] == [32.5, 35.0]
+    # A zero-height box still counts as one pixel tall
+    assert segments.heights().tolist() == [30, 1]
+
+
+def test_angles_follow_the_top_edge():
+    segments = SegmentArray(['flat', 'up', 'down'], np.array([
+        _box(0, 0),
+        [(0, 100), (100, 0), (100, 20), (0, 120)],
+        [(0, 0), (100, 100), (100, 120), (0, 20)],
+    ], dtype=np.int32))
+    assert segments.angles() == pytest.approx([0.0, -45.0, 45.0])
+
+
+def test_scaled_rounds_to_the_nearest_pixel():
+    segments = SegmentArray(['a'], np.array([_box(11, 21, width=80, height=20)], dtype=np.int32))
+    scaled = segments.scaled(0.5, 2.0)
+    assert scaled.boxes.dtype == np.int32
+    assert scaled.boxes[0].tolist() == [[6, 42], [46, 42], [46, 82], [6, 82]]
+    assert segments.boxes[0, 0].tolist() == [11, 21]
+
+
+def test_deskewed_levels_the_median_baseline():
+    theta = np.radians(5)
+    rotation = np.array([[np.cos(theta), -np.sin(theta)], [np.sin(theta), np.cos(theta)]])
+    level = np.array([_box(100 * i, 50 * (i % 3), width=90, height=30) for i in range(9)], dtype=np.float64)
+    skewed = SegmentArray([str(i) for i in range(9)], np.rint(level @ rotation.T).astype(np.int32))
+    assert np.median(skewed.angles()) == pytest.approx(5, abs=0.5)
+
+    deskewed = skewed.deskewed()
+    assert np.abs(deskewed.angles()).max() < 1
+    # Each box keeps its size, and the rows come apart again
+    assert (deskewed.heights() - 30).max() <= 2
+    _, _, top, _ = deskewed.bounds()
+    assert np.ptp(top[::3]) <= 2
+
+
+def test_deskewed_leaves_a_level_page_alone():
+    segments = SegmentArray(['a', 'b'], np.array([_box(0, 0), _box(100, 1)], dtype=np.int32))
+    assert segments.deskewed() is segments
+    assert SegmentArray.empty().deskewed().boxes.shape == (0, 4, 2)
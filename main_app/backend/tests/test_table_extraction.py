@@ -0,0 +1,93 @@
+import numpy as np
+import pytest
+
+from segments import SegmentArray
+from table_extraction import extract_line_items, parse_number
+
+# x of each column's words: description, quantity, price, total
+COLUMNS = (100, 900, 1200, 1500)
+ROW_HEIGHT = 28
+
+
+def _page(rows, degrees=0.0):
+    """SegmentArray for rows of cell texts, one row every 50 px, optionally rotated"""
+    texts, boxes = [], []
+    for row_number, cells in enumerate(rows):
+        y = 200 + row_number * 50
+        for x, cell in zip(COLUMNS, cells):
+            for word in (cell or '').split():
+                width = 20 * len(word)
+                texts.append(word)
+                boxes.append([(x, y), (x + width, y), (x + width, y + ROW_HEIGHT), (x, y + ROW_HEIGHT)])
+                x += width + 15
+    points = np.array(boxes, dtype=np.float64)
+    if degrees:
+        theta = np.radians(degrees)
+        rotation = np.array([[np.cos(theta), -np.sin(theta)], [np.sin(theta), np.cos(theta)]])
+        origin = points.reshape(-1, 2).mean(axis=0)
+        points = (points - origin) @ rotation.T + origin
+    return SegmentArray(texts, np.rint(points).astype(np.int32))
+
+
+ITEMS = [
+    ('Widget large', '2', '$10.00', '$20.00'),
+    ('Gadget', '1', '$5.50', '$5.50'),
+    ('Service hours', '3', '$40.00', '$120.00'),
+]
+
+
+@pytest.mark.parametrize('header, columns', [
+    (('Description', 'Qty', 'Price', 'Amount'), ['description', 'quantity', 'price', 'total']),
+    (('Item', 'Hours', 'Rate', 'Total'), ['description', 'quantity', 'price', 'total']),
+    (('Product', 'Quantity', 'Unit', None), ['description', 'quantity', 'price']),
+])
+def test_header_aliases_name_the_columns(header, columns):
+    result = extract_line_items(_page([('Acme Ltd',), header] + ITEMS))
+    assert result['columns'] == columns
+    assert [item['description'] for item in result['line_items']] == ['Widget large', 'Gadget', 'Service hours']
+    assert result['line_items'][0]['quantity'] == 2.0
+    assert result['line_items'][0]['price'] == 10.0
+
+
+def test_line_items_are_typed_and_keep_their_row_text():
+    result = extract_line_items(_page([('Description', 'Qty', 'Price', 'Amount')] + ITEMS))
+    assert result['line_items'][2] == {
+        'description': 'Service hours', 'quantity': 3.0, 'price': 40.0, 'total': 120.0,
+        'row_text': 'Service hours 3 $40.00 $120.00',
+    }
+
+
+def test_table_ends_at_the_first_summary_row():
+    rows = [('Description', 'Qty', 'Price', 'Amount')] + ITEMS + [
+        ('Subtotal', None, None, '$145.50'),
+        ('Late fee', '1', '$9.00', '$9.00'),
+    ]
+    result = extract_line_items(_page(rows))
+    assert len(result['line_items']) == 3
+    assert all(item['description'] != 'Late fee' for item in result['line_items'])
+
+
+def test_rows_without_a_number_are_skipped():
+    rows = [('Description', 'Qty', 'Price', 'Amount'), ITEMS[0], ('Delivered in two boxes',), ITEMS[1]]
+    result = extract_line_items(_page(rows))
+    assert [item['description'] for item in result['line_items']] == ['Widget large', 'Gadget']
+
+
+@pytest.mark.parametrize('degrees', [-4.0, 3.0])
+def test_skewed_rows_land_in_their_columns(degrees):
+    result = extract_line_items(_page([('Description', 'Qty', 'Price', 'Amount')] + ITEMS, degrees))
+    assert [(item['description'], item['quantity'], item['total']) for item in result['line_items']] == [
+        ('Widget large', 2.0, 20.0), ('Gadget', 1.0, 5.5), ('Service hours', 3.0, 120.0),
+    ]
+
+
+def test_no_header_row_means_no_table():
+    assert extract_line_items(_page(ITEMS)) == {'columns': [], 'line_items': []}
+    assert extract_line_items(SegmentArray.empty()) == {'columns': [], 'line_items': []}
+
+
+@pytest.mark.parametrize('text, expected', [
+    ('$1,234.50', 1234.5), ('-3', -3.0), ('x2', 2.0), ('n/a', None),
+])
+def test_parse_number(text, expected):
+    assert parse_number(text) == expected
@@ -0,0 +1,117 @@
+import contextvars
+import io
+import json
+import logging
+import sys
+import types
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import telemetry
+from telemetry import JSONFormatter, current_timings, fields, propagate, span, start_timings
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """telemetry's perf_counter, advanced by hand"""
+    now = [100.0]
+    monkeypatch.setattr(telemetry, 'time', types.SimpleNamespace(perf_counter=lambda: now[0]))
+    return now
+
+
+def _in_fresh_context(fn):
+    return contextvars.Context().run(fn)
+
+
+def test_spans_with_the_same_name_add_up_in_first_run_order(clock):
+    def request():
+        timings = start_timings()
+        for stage, seconds in (('vision', 0.2), ('parse', 0.0016), ('vision', 0.3)):
+            with span(stage):
+                clock[0] += seconds
+        return timings.as_dict()
+
+    assert list(_in_fresh_context(request).items()) == [('vision', 500), ('parse', 2)]
+
+
+def test_span_is_timed_even_when_the_stage_raises(clock):
+    def request():
+        timings = start_timings()
+        with pytest.raises(ValueError):
+            with span('render'):
+                clock[0] += 0.05
+                raise ValueError("bad image")
+        return timings.as_dict()
+
+    assert _in_fresh_context(request) == {'render': 50}
+
+
+def test_span_outside_a_request_is_a_no_op():
+    def outside():
+        with span('vision'):
+            pass
+        return current_timings()
+
+    assert _in_fresh_context(outside) is None
+
+
+def test_propagate_carries_the_timings_into_pool_threads(clock):
+    def request():
+        timings = start_timings()
+
+        def page():
+            with span('page'):
+                clock[0] += 0.01
+            return current_timings()
+
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            carried = [pool.submit(propagate(page)) for _ in range(3)]
+            bare = pool.submit(page)
+            assert all(future.result() is timings for future in carried)
+            assert bare.result() is None
+        return timings.as_dict()
+
+    assert _in_fresh_context(request) == {'page': 30}
+
+
+def _record(message, level=logging.INFO, exc_info=None, extra=None):
+    logger = logging.getLogger('invoice.test')
+    return logger.makeRecord(logger.name, level, __file__, 1, message, (), exc_info, extra=extra)
+
+
+def test_log_line_is_one_json_object_with_the_fields():
+    record = _record("Stored metrics", extra=fields(invoice_id='inv-1', processing_time_ms=812))
+    entry = json.loads(JSONFormatter().format(record))
+    assert set(entry) == {'time', 'level', 'logger', 'message', 'invoice_id', 'processing_time_ms'}
+    assert (entry['level'], entry['logger'], entry['message']) == ('INFO', 'invoice.test', "Stored metrics")
+    assert (entry['invoice_id'], entry['processing_time_ms']) == ('inv-1', 812)
+    assert entry['time'].endswith('Z') and len(entry['time']) == len('2024-01-01T00:00:00.000Z')
+
+
+def test_log_line_carries_the_exception():
+    try:
+        raise RuntimeError("Vision down")
+    except RuntimeError:
+        record = _record("Vision call failed", logging.ERROR, exc_info=sys.exc_info())
+    entry = json.loads(JSONFormatter().format(record))
+    assert 'RuntimeError: Vision down' in entry['exception']
+
+
+def test_log_level_drops_lines_below_it(monkeypatch):
+    stdout = io.StringIO()
+    monkeypatch.setattr(sys, 'stdout', stdout)
+    # A logger tree of its own, configured the way the app's is on first use
+    monkeypatch.setattr(telemetry, 'LOGGER_ROOT', 'invoice_level_test')
+    monkeypatch.setattr(telemetry, 'LOG_LEVEL', 'WARNING')
+    monkeypatch.setattr(telemetry, '_configured', False)
+
+    logger = telemetry.get_logger('upload')
+    logger.debug("Request received")
+    logger.info("File received")
+    logger.warning("Upload rejected", extra=fields(status=413))
+
+    lines = [json.loads(line) for line in stdout.getvalue().splitlines()]
+    assert [(line['level'], line['message'], line['status']) for line in lines] == [
+        ('WARNING', "Upload rejected", 413),
+    ]
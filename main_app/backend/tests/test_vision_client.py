@@ -0,0 +1,84 @@
+import datetime
+import threading
+
+import pytest
+
+import vision_client
+
+
+class _Credentials:
+    """Stands in for service_account.Credentials with a token about to expire"""
+
+    def __init__(self, on_refresh=None):
+        self.expiry = datetime.datetime.utcnow() + datetime.timedelta(seconds=10)
+        self.on_refresh = on_refresh
+        self.refreshes = 0
+
+    def refresh(self, request):
+        self.refreshes += 1
+        if self.on_refresh:
+            self.on_refresh()
+        self.expiry = datetime.datetime.utcnow() + datetime.timedelta(hours=1)
+
+
+@pytest.fixture
+def built(monkeypatch):
+    """Replace the Secrets Manager + Vision build with a counter"""
+    clients = []
+
+    def build():
+        client = object()
+        clients.append(client)
+        return None, client
+
+    monkeypatch.setattr(vision_client, '_build_client', build)
+    vision_client.invalidate_vision_client()
+    yield clients
+    vision_client.invalidate_vision_client()
+
+
+def test_invalidate_between_check_and_read_is_not_none(built, monkeypatch):
+    is_fresh = vision_client._is_fresh
+
+    def racing_is_fresh(now):
+        fresh = is_fresh(now)
+        if not vision_client._lock.locked():
+            # A check made outside the lock: let an invalidate land right after it
+            vision_client.invalidate_vision_client()
+        return fresh
+
+    first = vision_client.get_vision_client()
+    monkeypatch.setattr(vision_client, '_is_fresh', racing_is_fresh)
+    assert vision_client.get_vision_client() is first
+    vision_client.invalidate_vision_client()
+    rebuilt = vision_client.get_vision_client()
+    assert rebuilt is not None and rebuilt is not first
+    assert len(built) == 2
+
+
+def test_token_refresh_does_not_hold_the_cache_lock(built):
+    in_refresh = threading.Event()
+    release = threading.Event()
+    seen = {}
+
+    def on_refresh():
+        seen['cache_lock_held'] = vision_client._lock.locked()
+        in_refresh.set()
+        release.wait(5)
+
+    credentials = _Credentials(on_refresh)
+    client = object()
+    with vision_client._lock:
+        vision_client._cache.update(credentials=credentials, client=client, loaded_at=vision_client.time.time())
+
+    refresher = threading.Thread(target=vision_client.get_vision_client)
+    refresher.start()
+    assert in_refresh.wait(5)
+    # While one thread refreshes, others get the client and the stats at once
+    assert vision_client.get_vision_client() is client
+    assert vision_client.get_cache_stats()['hits'] >= 2
+    release.set()
+    refresher.join()
+
+    assert seen['cache_lock_held'] is False
+    assert credentials.refreshes == 1
@@ -0,0 +1,127 @@
+import pytest
+from google.api_core import exceptions
+
+import vision_guard
+from vision_guard import CircuitBreaker, TokenBucket, VisionGuard, VisionUnavailable
+
+
+class _Clock:
+    """Fake monotonic clock; sleeping just moves it forward"""
+
+    def __init__(self):
+        self.now = 1000.0
+        self.slept = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock():
+    return _Clock()
+
+
+@pytest.fixture
+def guard(clock, monkeypatch):
+    monkeypatch.setattr(vision_guard, 'backoff_seconds', lambda attempt: 1.0)
+    return VisionGuard(rate=10, burst=5, max_in_flight=2, deadline_seconds=20, max_attempts=4,
+                       breaker_failures=3, breaker_reset_seconds=30, clock=clock, sleep=clock.sleep)
+
+
+def _failing(error, calls):
+    def fn(retry=None, timeout=None):
+        calls.append(timeout)
+        raise error
+    return fn
+
+
+def test_breaker_opens_after_consecutive_failures(clock):
+    breaker = CircuitBreaker(3, 30, clock)
+    for _ in range(2):
+        breaker.record_failure()
+    breaker.before_call()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    with pytest.raises(VisionUnavailable) as raised:
+        breaker.before_call()
+    assert raised.value.retry_after == 30
+
+
+def test_breaker_lets_one_probe_through_after_the_reset(clock):
+    breaker = CircuitBreaker(1, 30, clock)
+    breaker.record_failure()
+    clock.now += 30
+    breaker.before_call()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    with pytest.raises(VisionUnavailable):
+        breaker.before_call()
+
+    # A failed probe opens it again for another reset period
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    clock.now += 29
+    with pytest.raises(VisionUnavailable):
+        breaker.before_call()
+    clock.now += 1
+    breaker.before_call()
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    breaker.before_call()
+
+
+def test_throttling_backs_off_without_tripping_the_breaker(guard):
+    calls = []
+    with pytest.raises(exceptions.TooManyRequests):
+        guard.call(_failing(exceptions.TooManyRequests("quota"), calls))
+    assert len(calls) == 4
+    assert guard.breaker.state == CircuitBreaker.CLOSED
+    stats = guard.stats()
+    assert stats['throttled'] == 4 and stats['retries'] == 3
+
+
+def test_server_errors_trip_the_breaker(guard):
+    calls = []
+    # The third failure opens the breaker, so the fourth attempt is refused
+    with pytest.raises(VisionUnavailable, match="circuit open"):
+        guard.call(_failing(exceptions.ServiceUnavailable("down"), calls))
+    assert len(calls) == 3
+    assert guard.breaker.state == CircuitBreaker.OPEN
+    assert guard.stats()['rejected'] == 1
+
+
+def test_deadline_stops_the_retries(guard, clock):
+    calls = []
+    with pytest.raises(exceptions.TooManyRequests):
+        guard.call(_failing(exceptions.TooManyRequests("quota"), calls), deadline=clock.now + 1.5)
+    # One backoff fits before the deadline, a second would overrun it
+    assert len(calls) == 2
+    assert clock.slept == [1.0]
+    assert calls[1] == pytest.approx(0.5)
+
+
+def test_batch_larger_than_the_burst_is_charged_in_full(clock):
+    bucket = TokenBucket(rate=10, burst=5, clock=clock, sleep=clock.sleep)
+    assert bucket.acquire(25) == pytest.approx(2.0)
+    # The whole batch was paid for: the next image waits behind it
+    assert bucket.acquire(1) == pytest.approx(0.1)
+
+
+def test_batch_over_the_deadline_is_refused_without_spending_tokens(clock):
+    bucket = TokenBucket(rate=10, burst=5, clock=clock, sleep=clock.sleep)
+    with pytest.raises(VisionUnavailable):
+        bucket.acquire(25, deadline=clock.now + 1)
+    assert bucket.acquire(5) == 0
+
+
+def test_tokens_are_refunded_when_no_slot_frees_up(guard, clock):
+    for _ in range(2):
+        guard.slots.acquire()
+    with pytest.raises(VisionUnavailable, match="No Vision slot"):
+        guard.call(lambda retry=None, timeout=None: None, images=5, deadline=clock.now)
+    assert guard.stats()['deadline_exceeded'] == 1
+    # The 5 tokens came back: a full burst is available without waiting
+    assert guard.bucket.acquire(5) == 0
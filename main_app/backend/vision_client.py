@@ -0,0 +1,162 @@
+import datetime
+import json
+import os
+import threading
+import time
+
+from telemetry import get_logger
+
+# Process-wide cache for the Google service account credentials and the
+# Vision client. On a warm Lambda every invoice reuses the same client (and
+# its open channel) instead of paying for a Secrets Manager round trip and a
+# new TLS handshake per request.
+
+SECRET_NAME = "google_ocr"
+
+# How long the secret/client pair is trusted before it is rebuilt
+CREDENTIALS_TTL_SECONDS = int(os.environ.get('VISION_CREDENTIALS_TTL_SECONDS', '3300'))
+# Refresh the OAuth token this many seconds before it expires so no request
+# pays for the refresh inline
+TOKEN_REFRESH_MARGIN_SECONDS = int(os.environ.get('VISION_TOKEN_REFRESH_MARGIN_SECONDS', '300'))
+
+logger = get_logger('vision_client')
+
+# Guards _cache and _stats; held only for reads and swaps
+_lock = threading.Lock()
+# Single-flight guards for rebuilding the client and refreshing its token
+_build_lock = threading.Lock()
+_refresh_lock = threading.Lock()
+_cache = {
+    'credentials': None,
+    'client': None,
+    'loaded_at': 0.0,
+}
+_stats = {
+    'hits': 0,
+    'misses': 0,
+    'secret_fetches': 0,
+    'token_refreshes': 0,
+}
+
+
+def get_secret():
+    from botocore.exceptions import ClientError
+    from aws_clients import get_secretsmanager_client
+
+    # Shared Secrets Manager client (one pool, retries and timeouts for the process)
+    client = get_secretsmanager_client()
+
+    try:
+        get_secret_value_response = client.get_secret_value(
+            SecretId=SECRET_NAME
+        )
+    except ClientError as e:
+        # For a list of exceptions thrown, see
+        # https://docs.aws.amazon.com/secretsmanager/latest/apireference/API_GetSecretValue.html
+        raise e
+
+    secret = get_secret_value_response['SecretString']
+    return json.loads(secret)
+
+
+def _is_fresh(now):
+    return _cache['client'] is not None and now - _cache['loaded_at'] < CREDENTIALS_TTL_SECONDS
+
+
+def _cached_client():
+    """(credentials, client) if the cache holds a fresh pair, else None
+
+    Presence and freshness are checked under the same lock the pair is read
+    under, so a concurrent invalidate_vision_client() can't hand back None.
+    """
+    with _lock:
+        if not _is_fresh(time.time()):
+            return None
+        _stats['hits'] += 1
+        return _cache['credentials'], _cache['client']
+
+
+def _token_expiring(credentials):
+    """True when the OAuth token expires within the refresh margin"""
+    expiry = getattr(credentials, 'expiry', None)
+    if expiry is None:
+        # No token fetched yet - the client fetches one on its first call
+        return False
+    # google-auth keeps expiry as a naive UTC datetime
+    now = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+    return (expiry - now).total_seconds() < TOKEN_REFRESH_MARGIN_SECONDS
+
+
+def _refresh_token_if_needed(credentials):
+    if not _token_expiring(credentials):
+        return
+    # Single flight: one thread refreshes, the others carry on with the
+    # current token, which is still good for up to the refresh margin
+    if not _refresh_lock.acquire(blocking=False):
+        return
+    try:
+        # Another thread may have refreshed just before we got the guard
+        if not _token_expiring(credentials):
+            return
+        from google.auth.transport.requests import Request
+        credentials.refresh(Request())
+        with _lock:
+            _stats['token_refreshes'] += 1
+        logger.info("Vision credentials token refreshed ahead of expiry")
+    finally:
+        _refresh_lock.release()
+
+
+def _build_client():
+    from google.cloud import vision
+    from google.oauth2 import service_account
+
+    credentials_info = get_secret()
+    with _lock:
+        _stats['secret_fetches'] += 1
+    credentials = service_account.Credentials.from_service_account_info(
+        credentials_info,
+        scopes=['https://www.googleapis.com/auth/cloud-platform']
+    )
+    client = vision.ImageAnnotatorClient(credentials=credentials)
+    return credentials, client
+
+
+def get_vision_client():
+    """Return the cached Vision client, rebuilding it when the TTL has passed"""
+    cached = _cached_client()
+    if cached is None:
+        # Single flight: only one thread talks to Secrets Manager, the rest
+        # wait for it and then reuse the client it built. _lock is only held
+        # to read and swap the cache, never across a network call.
+        with _build_lock:
+            cached = _cached_client()
+            if cached is None:
+                with _lock:
+                    _stats['misses'] += 1
+                credentials, client = _build_client()
+                with _lock:
+                    _cache['credentials'] = credentials
+                    _cache['client'] = client
+                    _cache['loaded_at'] = time.time()
+                logger.info("Vision client built and cached")
+                return client
+    credentials, client = cached
+    _refresh_token_if_needed(credentials)
+    return client
+
+
+def invalidate_vision_client():
+    """Drop the cached client so the next call re-reads the secret"""
+    with _lock:
+        _cache['credentials'] = None
+        _cache['client'] = None
+        _cache['loaded_at'] = 0.0
+
+
+def get_cache_stats():
+    """Hit/miss counters for the credential and client cache"""
+    with _lock:
+        stats = dict(_stats)
+        stats['age_seconds'] = int(time.time() - _cache['loaded_at']) if _cache['client'] else None
+    return stats
@@ -0,0 +1,329 @@
+import os
+import random
+import threading
+import time
+from collections import deque
+
+from telemetry import fields, get_logger, span
+
+# Admission control for Google Vision calls. Every annotate call goes
+# through call(), which
+#   - waits for rate-limit tokens (one per image) from a process-wide token
+#     bucket sized to the project quota, and for one of a fixed number of
+#     in-flight slots, so a burst of uploads queues here instead of being
+#     answered with 429s,
+#   - retries 429 / 5xx / timeouts with full-jitter exponential backoff,
+#     but only while the per-call deadline allows another attempt,
+#   - trips a circuit breaker after repeated Vision failures and then fails
+#     fast with VisionUnavailable until a probe call succeeds again.
+# Waiting and calling are timed separately (vision_queue / vision spans in
+# the request timings, rolling percentiles in get_vision_stats()), so a slow
+# request can be pinned on our own queue or on Vision itself.
+
+# Vision's default quota is 1800 requests per minute; each image counts
+VISION_RATE_PER_SECOND = float(os.environ.get('VISION_RATE_PER_SECOND', '30'))
+VISION_BURST = int(os.environ.get('VISION_BURST', '16'))
+# Vision calls in flight across every request in this process
+VISION_MAX_IN_FLIGHT = int(os.environ.get('VISION_MAX_IN_FLIGHT', '8'))
+# Time budget for one call: queueing, every attempt and the backoff between
+# them (the Lambda itself times out at 30 s)
+VISION_DEADLINE_SECONDS = float(os.environ.get('VISION_DEADLINE_SECONDS', '20'))
+VISION_MAX_ATTEMPTS = int(os.environ.get('VISION_MAX_ATTEMPTS', '4'))
+VISION_RETRY_BASE_SECONDS = float(os.environ.get('VISION_RETRY_BASE_SECONDS', '0.25'))
+VISION_RETRY_MAX_SECONDS = float(os.environ.get('VISION_RETRY_MAX_SECONDS', '4'))
+# Consecutive failed attempts that open the breaker, and how long it stays open
+VISION_BREAKER_FAILURES = int(os.environ.get('VISION_BREAKER_FAILURES', '5'))
+VISION_BREAKER_RESET_SECONDS = float(os.environ.get('VISION_BREAKER_RESET_SECONDS', '30'))
+
+# Samples kept for the rolling queue-wait / call-time percentiles
+STATS_WINDOW = 512
+
+logger = get_logger('vision_guard')
+
+
+class VisionUnavailable(Exception):
+    """Vision was not called (breaker open, or no time left within the deadline)"""
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """rate tokens per second, up to burst banked; waiters are served in order
+
+    acquire() reserves its tokens straight away (the balance may go
+    negative) and then sleeps off the debt, so later callers queue behind
+    earlier ones rather than racing them. A request for more than burst
+    tokens is charged in full: it waits out the difference at rate.
+    """
+
+    def __init__(self, rate, burst, clock=time.monotonic, sleep=time.sleep):
+        self.rate = rate
+        self.burst = burst
+        self.clock = clock
+        self.sleep = sleep
+        self._tokens = float(burst)
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = self.clock()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        return now
+
+    def acquire(self, tokens=1, deadline=None):
+        """Block until tokens are available; returns the seconds waited
+
+        Raises VisionUnavailable without waiting when the tokens would
+        only come after the deadline (a clock() value).
+        """
+        with self._lock:
+            now = self._refill()
+            wait = max(0.0, (tokens - self._tokens) / self.rate)
+            if deadline is not None and now + wait > deadline:
+                raise VisionUnavailable(
+                    f"Vision rate limit: {wait:.1f} s wait exceeds the deadline", retry_after=wait
+                )
+            self._tokens -= tokens
+        if wait:
+            self.sleep(wait)
+        return wait
+
+    def refund(self, tokens):
+        """Give back tokens acquired for a call that was never made"""
+        with self._lock:
+            self._refill()
+            self._tokens = min(self.burst, self._tokens + tokens)
+
+
+class CircuitBreaker:
+    """closed -> open after `failures` consecutive failures -> half-open probe"""
+
+    CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+    def __init__(self, failures, reset_seconds, clock=time.monotonic):
+        self.failures = failures
+        self.reset_seconds = reset_seconds
+        self.clock = clock
+        self.state = self.CLOSED
+        self._consecutive = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        """Raise VisionUnavailable if the call must not go to Vision"""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return
+            remaining = self._opened_at + self.reset_seconds - self.clock()
+            if self.state == self.OPEN and remaining <= 0:
+                self.state = self.HALF_OPEN
+                logger.info("Vision circuit half-open, sending a probe call")
+            if self.state == self.HALF_OPEN and not self._probing:
+                self._probing = True
+                return
+        raise VisionUnavailable(
+            "Vision is unavailable (circuit open), try again shortly", retry_after=max(remaining, 1.0)
+        )
+
+    def record_success(self):
+        with self._lock:
+            if self.state != self.CLOSED:
+                logger.info("Vision circuit closed")
+            self.state = self.CLOSED
+            self._consecutive = 0
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self._consecutive += 1
+            if self.state == self.HALF_OPEN or self._consecutive >= self.failures:
+                if self.state != self.OPEN:
+                    logger.warning("Vision circuit opened", extra=fields(
+                        consecutive_failures=self._consecutive, reset_seconds=self.reset_seconds
+                    ))
+                self.state = self.OPEN
+                self._opened_at = self.clock()
+            self._probing = False
+
+    def release_probe(self):
+        """The probe ended without a verdict (e.g. a 400 for a bad image)"""
+        with self._lock:
+            self._probing = False
+
+
+def _retryable_errors():
+    from google.api_core import exceptions
+    errors = (
+        exceptions.TooManyRequests, exceptions.ResourceExhausted, exceptions.InternalServerError,
+        exceptions.BadGateway, exceptions.ServiceUnavailable, exceptions.GatewayTimeout,
+        exceptions.DeadlineExceeded, exceptions.RetryError,
+    )
+    try:
+        # REST transport: the connection itself failed or timed out
+        from requests.exceptions import ConnectionError, Timeout
+        errors += (ConnectionError, Timeout)
+    except ImportError:
+        pass
+    return errors
+
+
+def backoff_seconds(attempt):
+    """Full-jitter exponential backoff before retry number `attempt` (1-based)"""
+    return random.uniform(0, min(VISION_RETRY_MAX_SECONDS, VISION_RETRY_BASE_SECONDS * 2 ** (attempt - 1)))
+
+
+class VisionGuard:
+    """Rate limiter + in-flight cap + retries + circuit breaker around Vision calls"""
+
+    def __init__(self, rate=VISION_RATE_PER_SECOND, burst=VISION_BURST, max_in_flight=VISION_MAX_IN_FLIGHT,
+                 deadline_seconds=VISION_DEADLINE_SECONDS, max_attempts=VISION_MAX_ATTEMPTS,
+                 breaker_failures=VISION_BREAKER_FAILURES, breaker_reset_seconds=VISION_BREAKER_RESET_SECONDS,
+                 clock=time.monotonic, sleep=time.sleep):
+        self.bucket = TokenBucket(rate, burst, clock, sleep)
+        self.slots = threading.BoundedSemaphore(max_in_flight)
+        self.breaker = CircuitBreaker(breaker_failures, breaker_reset_seconds, clock)
+        self.clock = clock
+        self.sleep = sleep
+        self.deadline_seconds = deadline_seconds
+        self.max_attempts = max_attempts
+        self._retryable = None
+        self._lock = threading.Lock()
+        self._counters = {
+            'calls': 0, 'attempts': 0, 'retries': 0, 'throttled': 0,
+            'failures': 0, 'rejected': 0, 'deadline_exceeded': 0,
+        }
+        self._queue_ms = deque(maxlen=STATS_WINDOW)
+        self._call_ms = deque(maxlen=STATS_WINDOW)
+
+    def _count(self, name, n=1):
+        with self._lock:
+            self._counters[name] += n
+
+    def _wait_for_slot(self, images, deadline):
+        start = time.perf_counter()
+        with span('vision_queue'):
+            self.bucket.acquire(images, deadline)
+            if not self.slots.acquire(timeout=max(0.0, deadline - self.clock())):
+                # The call is never made, so neither is its quota spent
+                self.bucket.refund(images)
+                raise VisionUnavailable("No Vision slot free within the deadline")
+        return (time.perf_counter() - start) * 1000
+
+    def _admit(self, images, deadline):
+        """Wait for tokens and a slot; returns the ms waited, holding the slot"""
+        try:
+            self.breaker.before_call()
+        except VisionUnavailable:
+            self._count('rejected')
+            raise
+        try:
+            queue_ms = self._wait_for_slot(images, deadline)
+        except VisionUnavailable:
+            self.breaker.release_probe()
+            self._count('deadline_exceeded')
+            raise
+        if self.breaker.state == CircuitBreaker.OPEN:
+            # Opened while we were queued - don't add to the pile-up
+            self.slots.release()
+            self._count('rejected')
+            raise VisionUnavailable(
+                "Vision is unavailable (circuit open), try again shortly", retry_after=self.breaker.reset_seconds
+            )
+        return queue_ms
+
+    def call(self, fn, *args, images=1, deadline=None, **kwargs):
+        """fn(*args, **kwargs) under the limits; retries transient failures
+
+        images is the number of images in the request (batch calls spend one
+        token per image). deadline is a clock() value and defaults
+        to VISION_DEADLINE_SECONDS from now. The client's own retry is
+        turned off and each attempt gets the time left as its timeout.
+        """
+        if self._retryable is None:
+            self._retryable = _retryable_errors()
+        deadline = deadline or self.clock() + self.deadline_seconds
+        self._count('calls')
+        attempt = 0
+        while True:
+            attempt += 1
+            queue_ms = self._admit(images, deadline)
+            start = time.perf_counter()
+            try:
+                with span('vision'):
+                    result = fn(*args, retry=None, timeout=max(0.1, deadline - self.clock()), **kwargs)
+            except self._retryable as e:
+                error = e
+            except Exception:
+                # A request we got wrong (bad image, auth) says nothing about Vision's health
+                self.breaker.release_probe()
+                self._record(queue_ms, (time.perf_counter() - start) * 1000)
+                raise
+            else:
+                self.breaker.record_success()
+                self._record(queue_ms, (time.perf_counter() - start) * 1000)
+                return result
+            finally:
+                self.slots.release()
+
+            call_ms = (time.perf_counter() - start) * 1000
+            self._record(queue_ms, call_ms)
+            # api_core errors carry the HTTP status (ResourceExhausted is 429 too)
+            status = getattr(error, 'code', None) or type(error).__name__
+            if status == 429:
+                # Over quota is not Vision being down: back off, leave the breaker be
+                self._count('throttled')
+                self.breaker.release_probe()
+            else:
+                self.breaker.record_failure()
+            delay = backoff_seconds(attempt)
+            if attempt >= self.max_attempts or self.clock() + delay >= deadline:
+                self._count('failures')
+                logger.warning(f"Vision call failed: {error}", extra=fields(
+                    attempts=attempt, status=str(status), call_ms=int(call_ms)
+                ))
+                raise error
+            logger.info("Retrying Vision call", extra=fields(
+                attempt=attempt, status=str(status), backoff_ms=int(delay * 1000)
+            ))
+            self._count('retries')
+            with span('vision_backoff'):
+                self.sleep(delay)
+
+    def _record(self, queue_ms, call_ms):
+        with self._lock:
+            self._counters['attempts'] += 1
+            self._queue_ms.append(queue_ms)
+            self._call_ms.append(call_ms)
+
+    def stats(self):
+        """Counters, breaker state and rolling p50/p95 of queue wait and call time"""
+        with self._lock:
+            stats = dict(self._counters)
+            samples = {'queue_ms': sorted(self._queue_ms), 'call_ms': sorted(self._call_ms)}
+        stats['breaker'] = self.breaker.state
+        for name, values in samples.items():
+            for p in (50, 95):
+                stats[f"{name}_p{p}"] = round(values[min(len(values) - 1, len(values) * p // 100)], 1) if values else None
+        return stats
+
+
+_guard = None
+_guard_lock = threading.Lock()
+
+
+def get_vision_guard():
+    """The process-wide VisionGuard (one quota, one breaker per process)"""
+    global _guard
+    if _guard is None:
+        with _guard_lock:
+            if _guard is None:
+                _guard = VisionGuard()
+    return _guard
+
+
+def get_vision_stats():
+    return get_vision_guard().stats()
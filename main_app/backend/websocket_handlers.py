@@ -0,0 +1,82 @@
+import json
+import time
+
+from aws_clients import get_dynamodb_client
+from dashboard import CONNECTIONS_TABLE_NAME, send_metrics_to_connection
+from telemetry import fields, get_logger
+
+# WebSocket routes. This is the Lambda fast path: it never imports Flask,
+# PIL or the upload code, and $connect/$disconnect use the low-level
+# DynamoDB client for their single write instead of building the resource
+# layer.
+
+logger = get_logger('websocket')
+
+
+def handle_websocket_connect(connection_id):
+    """Handle WebSocket connection"""
+    try:
+        # Store the connection
+        get_dynamodb_client().put_item(
+            TableName=CONNECTIONS_TABLE_NAME,
+            Item={
+                'connectionId': {'S': connection_id},
+                'timestamp': {'N': str(int(time.time() * 1000))},
+                'connectedAt': {'S': time.strftime('%Y-%m-%d %H:%M:%S UTC')}
+            }
+        )
+        logger.info("Connection stored - waiting for metrics request", extra=fields(connection_id=connection_id))
+        return {"statusCode": 200}
+    except Exception as e:
+        logger.error(f"Error storing connection: {e}", extra=fields(connection_id=connection_id))
+        return {"statusCode": 500}
+
+def handle_websocket_disconnect(connection_id):
+    """Handle WebSocket disconnection"""
+    try:
+        get_dynamodb_client().delete_item(
+            TableName=CONNECTIONS_TABLE_NAME,
+            Key={'connectionId': {'S': connection_id}}
+        )
+        logger.info("Connection removed", extra=fields(connection_id=connection_id))
+        return {"statusCode": 200}
+    except Exception as e:
+        logger.error(f"Error removing connection: {e}", extra=fields(connection_id=connection_id))
+        return {"statusCode": 500}
+
+def handle_websocket_message(connection_id, body):
+    """Handle an incoming message on the $default route"""
+    try:
+        message = json.loads(body) if body else {}
+        action = message.get('action')
+        
+        logger.debug("Received WebSocket message", extra=fields(action=action, connection_id=connection_id))
+        
+        if action == 'get-metrics':
+            # Only the asking dashboard gets a reply - no fan-out. An
+            # optional window ('5m', '1h', '24h', ...) picks the recent stats
+            send_metrics_to_connection(connection_id, message.get('window'))
+            return {"statusCode": 200}
+        else:
+            logger.warning("Unknown action", extra=fields(action=action, connection_id=connection_id))
+            return {"statusCode": 200}
+            
+    except Exception as e:
+        logger.error(f"Error handling WebSocket message: {e}", extra=fields(connection_id=connection_id))
+        return {"statusCode": 500}
+
+def handle_websocket_event(event):
+    """Dispatch an API Gateway WebSocket event by route"""
+    route_key = event['requestContext']['routeKey']
+    connection_id = event['requestContext']['connectionId']
+    
+    logger.info("WebSocket event", extra=fields(route_key=route_key, connection_id=connection_id))
+    
+    if route_key == '$connect':
+        return handle_websocket_connect(connection_id)
+    elif route_key == '$disconnect':
+        return handle_websocket_disconnect(connection_id)
+    elif route_key == '$default':
+        return handle_websocket_message(connection_id, event.get('body', '{}'))
+    else:
+        return {"statusCode": 200}
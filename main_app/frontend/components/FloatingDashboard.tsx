@@ -6,6 +6,7 @@ interface Metrics {
   total: number;
   throughput: number;
   avgLatency: number;
+  p95Latency: number;
   avgAccuracy: number;
   timestamp: number;
 }
@@ -142,10 +143,11 @@ export default function FloatingDashboard() {
           <div className="bg-green-50 p-2 rounded">
             <div className="text-green-600 font-medium">Speed</div>
             <div className="text-green-800 font-bold">{formatValue(metrics.avgLatency)}ms</div>
+            <div className="text-green-600">p95 {formatValue(metrics.p95Latency)}ms</div>
           </div>
           <div className="bg-purple-50 p-2 rounded">
             <div className="text-purple-600 font-medium">Rate</div>
-            <div className="text-purple-800 font-bold">{formatValue(metrics.throughput)}/s</div>
+            <div className="text-purple-800 font-bold">{formatValue(metrics.throughput)}/min</div>
           </div>
           <div className="bg-orange-50 p-2 rounded">
             <div className="text-orange-600 font-medium">Quality</div>